@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils import timezone
-from .models import Product, Order, RefundRequest, PayboxWallet, PayboxTransaction, Color, Size, ProductVariant
+from .models import Product, Order, RefundRequest, PayboxWallet, PayboxTransaction, Color, Size, ProductVariant, FlashSale, OrderIntake, StripeEvent
 
 # Action: Chấp nhận hoàn tiền
 @admin.action(description="✅ Chấp nhận hoàn tiền")
@@ -30,15 +30,27 @@ class RefundRequestAdmin(admin.ModelAdmin):
 
 @admin.register(PayboxWallet)
 class PayboxWalletAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'balance']
+    list_display = ['id', 'user', 'balance', 'last_sequence']
     search_fields = ['user__username']
+    # Số dư chỉ thay đổi qua api/wallets.py (kèm dòng giao dịch trong sổ)
+    readonly_fields = ['balance', 'last_sequence']
 
 @admin.register(PayboxTransaction)
 class PayboxTransactionAdmin(admin.ModelAdmin):
-    list_display = ['id', 'wallet', 'amount', 'transaction_type', 'created_at']
+    list_display = ['id', 'wallet', 'sequence', 'amount', 'transaction_type', 'balance_after', 'created_at']
     list_filter = ['transaction_type']
     search_fields = ['wallet__user__username']
 
+    # Sổ giao dịch chỉ ghi thêm
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(Color)
 class ColorAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'hex_code']
@@ -73,6 +85,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'price', 'has_variants', 'get_total_stock']
     search_fields = ['name']
     list_filter = ['has_variants', 'category', 'brand']
+    list_select_related = ['summary']
     inlines = [ProductVariantInline]
 
     def get_total_stock(self, obj):
@@ -85,3 +98,27 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'isPaid', 'isDelivered', 'isRefunded', 'createdAt']
     list_filter = ['isPaid', 'isDelivered', 'isRefunded']
     search_fields = ['user__username']
+
+
+@admin.register(FlashSale)
+class FlashSaleAdmin(admin.ModelAdmin):
+    list_display = ['id', 'product', 'starts_at', 'ends_at', 'status']
+    list_filter = ['status']
+    search_fields = ['product__name']
+    readonly_fields = ['status', 'allocation', 'sold', 'created_at']
+
+
+@admin.register(OrderIntake)
+class OrderIntakeAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'order', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status']
+    search_fields = ['user__username']
+    readonly_fields = ['payload', 'order', 'claimed_by', 'claimed_at', 'created_at', 'finished_at']
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'type', 'payment_intent_id', 'status', 'created_at', 'applied_at']
+    list_filter = ['status', 'type']
+    search_fields = ['id', 'payment_intent_id']
+    readonly_fields = ['id', 'type', 'payment_intent_id', 'payload', 'error', 'created_at', 'applied_at']
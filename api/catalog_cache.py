@@ -0,0 +1,119 @@
+"""
+Cache phản hồi cho API sản phẩm, đánh khóa theo phiên bản catalog.
+
+Danh sách dùng phiên bản chung của catalog, chi tiết dùng phiên bản riêng của từng
+sản phẩm; tín hiệu lưu/xóa chỉ cần tăng phiên bản thay vì tìm và xóa từng khóa.
+Dữ liệu được cache không chứa is_favorite của người dùng, trường này được ghép vào
+sau khi đọc cache nên mọi người dùng dùng chung một bản cache.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.models import Favorite
+
+CATALOG_VERSION_KEY = 'catalog:version'
+PRODUCT_VERSION_KEY = 'catalog:product:{}:version'
+
+CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def _get_version(key):
+    # Giá trị khởi tạo theo thời gian để phiên bản không lặp lại khi cache bị xóa
+    return cache.get_or_set(key, time.time_ns, timeout=None)
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def get_catalog_version():
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    _bump_version(CATALOG_VERSION_KEY)
+
+
+def bump_product_version(product_id):
+    _bump_version(PRODUCT_VERSION_KEY.format(product_id))
+
+
+def _make_key(request, version_key):
+    query = sorted(request.query_params.lists())
+    raw = json.dumps([request.get_host(), request.path, query, _get_version(version_key)])
+    return 'catalog:response:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def _digest(data):
+    return hashlib.md5(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()).hexdigest()
+
+
+def _items(data):
+    """Các dòng sản phẩm trong phản hồi (danh sách có phân trang hoặc một sản phẩm)"""
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return data['results']
+    if isinstance(data, dict) and 'id' in data:
+        return [data]
+    return []
+
+
+def cached_response(request, build, product_id=None):
+    """
+    Trả về phản hồi từ cache hoặc gọi build() (build phải bỏ qua is_favorite); phản hồi có
+    response.stale = True không được cache. Hỗ trợ ETag/If-None-Match và Last-Modified/If-Modified-Since.
+    """
+    version_key = PRODUCT_VERSION_KEY.format(product_id) if product_id is not None else CATALOG_VERSION_KEY
+    key = _make_key(request, version_key)
+    entry = cache.get(key)
+    if entry is None:
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        entry = {
+            'data': response.data,
+            'digest': _digest(response.data),
+            'last_modified': int(time.time()),
+        }
+        # Dựng từ dữ liệu chưa theo kịp phiên bản catalog (chỉ mục facet chưa xây lại): không lưu dưới khóa mới
+        if not getattr(response, 'stale', False):
+            cache.set(key, entry, CACHE_TIMEOUT)
+
+    data = entry['data']
+    items = _items(data)
+    favorite_ids = []
+    if request.user.is_authenticated and items and 'is_favorite' in items[0]:
+        favorite_ids = sorted(Favorite.objects.filter(
+            user=request.user, product_id__in=[item['id'] for item in items]
+        ).values_list('product_id', flat=True))
+        for item in items:
+            item['is_favorite'] = item['id'] in favorite_ids
+
+    etag = '"{}-{}"'.format(entry['digest'], _digest(favorite_ids)[:8] if favorite_ids else '0')
+    headers = {'ETag': etag, 'Last-Modified': http_date(entry['last_modified'])}
+
+    if_none_match = request.headers.get('If-None-Match')
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    if if_none_match is not None:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    else:
+        # Last-Modified chỉ phản ánh dữ liệu catalog dùng chung, người dùng đăng nhập kiểm tra bằng ETag
+        not_modified = (
+            not request.user.is_authenticated
+            and if_modified_since is not None
+            and if_modified_since >= entry['last_modified']
+        )
+    if not_modified:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(data, headers=headers)
@@ -0,0 +1,353 @@
+"""
+Import catalog từ file CSV hoặc NDJSON theo từng lô, bộ nhớ không phụ thuộc kích thước file.
+
+Mỗi dòng CSV là một biến thể (hoặc một sản phẩm không có biến thể) với các cột:
+    external_id, name, description, brand, category, price, count_in_stock, image,
+    color, color_hex, size, variant_price, stock_quantity, sku
+Mỗi dòng NDJSON là một object cùng các khóa trên, có thể kèm "variants": [{color, size, ...}].
+
+Sản phẩm được nhận diện bằng external_id nên chạy lại cùng một file không tạo bản ghi trùng.
+Brand, category, màu và size còn thiếu được tạo mới từ bảng tra cứu trong bộ nhớ.
+Sau mỗi lô đã commit, số dòng đã xử lý được ghi vào file trạng thái để có thể chạy tiếp
+(--resume) từ lô cuối cùng.
+"""
+import csv
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from api import catalog_cache, search, storage
+from api.models import Brand, Category, Color, Product, Size
+from api.summaries import refresh_summaries
+from api.variant_bulk import bulk_upsert_variants
+
+PRODUCT_FIELDS = ('name', 'description', 'brand_id', 'category_id', 'price', 'countInStock', 'image', 'has_variants')
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    raise CatalogImportError(f'Không nhận diện được định dạng của {path}, dùng --format csv|ndjson')
+
+
+def read_records(path, fmt):
+    """Sinh (số dòng, record) lần lượt từ file, không đọc cả file vào bộ nhớ"""
+    if fmt == 'csv':
+        with open(path, newline='', encoding='utf-8-sig') as handle:
+            reader = csv.DictReader(handle)
+            for record in reader:
+                yield reader.line_num, record
+    else:
+        with open(path, encoding='utf-8') as handle:
+            for line_no, line in enumerate(handle, start=1):
+                if line.strip():
+                    yield line_no, line
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _decimal(value, name):
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'{name} không hợp lệ: {value}')
+
+
+def _int(value, name):
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} không hợp lệ: {value}')
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=1000, log=None):
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.stats = Counter()
+        # Các bảng tra cứu nhỏ (tên -> id) được nạp một lần và giữ trong bộ nhớ suốt quá trình import;
+        # title của brand/category không duy nhất nên lấy bản ghi cũ nhất
+        self.brands = dict(Brand.objects.order_by('-id').values_list('title', 'id'))
+        self.categories = dict(Category.objects.order_by('-id').values_list('title', 'id'))
+        self.colors = dict(Color.objects.values_list('name', 'id'))
+        self.sizes = dict(Size.objects.values_list('name', 'id'))
+
+    # Đọc file và trạng thái
+
+    def run(self, path, fmt=None, resume=False, state_path=None):
+        fmt = fmt or detect_format(path)
+        state_path = state_path or path + '.import-state'
+        size = os.path.getsize(path)
+        skip = 0
+        if resume and os.path.exists(state_path):
+            with open(state_path) as handle:
+                state = json.load(handle)
+            if state.get('size') != size:
+                raise CatalogImportError('File đã thay đổi kể từ lần import trước, không thể chạy tiếp')
+            skip = state['records']
+            self.stats.update(state.get('stats', {}))
+            self.log(f'Tiếp tục từ dòng dữ liệu thứ {skip + 1}')
+
+        started = time.monotonic()
+        done = 0
+        batch = []
+        for line_no, record in read_records(path, fmt):
+            done += 1
+            if done <= skip:
+                continue
+            batch.append((line_no, record))
+            if len(batch) >= self.batch_size:
+                self._flush(batch, fmt, done, size, state_path, started, skip)
+                batch = []
+        if batch:
+            self._flush(batch, fmt, done, size, state_path, started, skip)
+
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return self.stats
+
+    def _flush(self, batch, fmt, done, size, state_path, started, skip):
+        self.import_batch(batch, fmt)
+        self.stats['records'] = done
+        # Ghi trạng thái sau khi lô đã commit; chạy lại một lô đã ghi cũng không tạo bản ghi trùng
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump({'size': size, 'records': done, 'stats': self.stats}, handle)
+        os.replace(tmp_path, state_path)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.log(
+            f"{done} dòng ({(done - skip) / elapsed:.0f} dòng/s) - "
+            f"sản phẩm: +{self.stats['products_created']} ~{self.stats['products_updated']}, "
+            f"biến thể: +{self.stats['variants_created']} ~{self.stats['variants_updated']}, "
+            f"lỗi: {self.stats['errors']}"
+        )
+
+    def _error(self, line_no, message):
+        self.stats['errors'] += 1
+        self.log(f'Dòng {line_no}: {message}')
+
+    # Xử lý một lô
+
+    def import_batch(self, batch, fmt='csv'):
+        rows = []
+        for line_no, record in batch:
+            try:
+                if fmt == 'ndjson':
+                    record = json.loads(record)
+                    if not isinstance(record, dict):
+                        raise ValueError('mỗi dòng phải là một object JSON')
+                rows.extend(self._parse(line_no, record))
+            except ValueError as exc:
+                self._error(line_no, exc)
+        if not rows:
+            return
+
+        with transaction.atomic():
+            products = self._upsert_products(rows)
+            self._upsert_variants(rows, products)
+            product_ids = [product.id for product in products.values()]
+            refresh_summaries(product_ids)
+            search.index_products(products.values())
+
+        catalog_cache.bump_catalog_version()
+        for product_id in product_ids:
+            catalog_cache.bump_product_version(product_id)
+
+    def _parse(self, line_no, record):
+        """Trả về các dòng (line_no, trường sản phẩm, biến thể hoặc None) của một record"""
+        external_id = _text(record.get('external_id'))
+        if external_id is None:
+            raise ValueError('thiếu external_id')
+        fields = {
+            'name': _text(record.get('name')),
+            'description': _text(record.get('description')),
+            'brand': _text(record.get('brand')),
+            'category': _text(record.get('category')),
+            'price': _decimal(record.get('price'), 'price'),
+            'countInStock': _int(record.get('count_in_stock'), 'count_in_stock'),
+            'image': _text(record.get('image')),
+        }
+        fields = {key: value for key, value in fields.items() if value is not None}
+        fields['external_id'] = external_id
+
+        variants = record.get('variants')
+        if variants is None:
+            variants = [record] if _text(record.get('color')) or _text(record.get('size')) else []
+        elif not isinstance(variants, list):
+            raise ValueError('variants phải là một danh sách')
+
+        rows = []
+        for variant in variants:
+            if not isinstance(variant, dict):
+                raise ValueError('mỗi biến thể phải là một object JSON')
+            color, size = _text(variant.get('color')), _text(variant.get('size'))
+            if color is None or size is None:
+                raise ValueError('biến thể cần cả color và size')
+            rows.append((line_no, fields, {
+                'color': color,
+                'color_hex': _text(variant.get('color_hex')),
+                'size': size,
+                'price': _decimal(variant.get('variant_price'), 'variant_price'),
+                'stock_quantity': _int(variant.get('stock_quantity'), 'stock_quantity'),
+                'sku': _text(variant.get('sku')),
+            }))
+        return rows or [(line_no, fields, None)]
+
+    def _ensure(self, model, lookup, titles, field='title', defaults=None):
+        """Tạo các bản ghi còn thiếu (brand/category/màu/size) và thêm vào bảng tra cứu"""
+        missing = [title for title in titles if title not in lookup]
+        if not missing:
+            return
+        model.objects.bulk_create([model(**{field: title}, **(defaults(title) if defaults else {})) for title in missing])
+        for value, pk in model.objects.filter(**{f'{field}__in': missing}).order_by('-id').values_list(field, 'id'):
+            lookup[value] = pk
+
+    def _upsert_products(self, rows):
+        """Tạo/cập nhật sản phẩm của lô, trả về {external_id: Product} (đã select_related brand, category)"""
+        merged = {}
+        lines = defaultdict(list)
+        with_variants = set()
+        for line_no, fields, variant in rows:
+            key = fields['external_id']
+            merged.setdefault(key, {}).update(fields)
+            lines[key].append(line_no)
+            if variant is not None:
+                with_variants.add(key)
+
+        self._ensure(Brand, self.brands, {fields['brand'] for fields in merged.values() if 'brand' in fields})
+        self._ensure(Category, self.categories, {fields['category'] for fields in merged.values() if 'category' in fields})
+
+        existing = {
+            product.external_id: product
+            for product in Product.objects.filter(external_id__in=list(merged)).only('id', 'external_id', *PRODUCT_FIELDS)
+        }
+        to_create = []
+        to_update = defaultdict(list)
+        # bulk_create/bulk_update không phát tín hiệu: tự tăng/giảm số tham chiếu của ảnh
+        acquired, released = Counter(), Counter()
+        for key, fields in merged.items():
+            values = dict(fields)
+            if 'brand' in values:
+                values['brand_id'] = self.brands[values.pop('brand')]
+            if 'category' in values:
+                values['category_id'] = self.categories[values.pop('category')]
+            if key in with_variants:
+                values['has_variants'] = True
+
+            product = existing.get(key)
+            if product is None:
+                missing = [name for name in ('name', 'brand_id', 'category_id') if name not in values]
+                if missing:
+                    for line_no in lines[key]:
+                        self._error(line_no, f'sản phẩm mới {key} thiếu {", ".join(missing)}')
+                    continue
+                to_create.append(Product(**values))
+                if values.get('image'):
+                    acquired[values['image']] += 1
+                continue
+
+            changed = []
+            for name in PRODUCT_FIELDS:
+                if name not in values:
+                    continue
+                current = getattr(product, name)
+                if name == 'image':
+                    current = current.name if current else None
+                if current != values[name]:
+                    if name == 'image':
+                        acquired[values[name]] += 1
+                        if current:
+                            released[current] += 1
+                    setattr(product, name, values[name])
+                    changed.append(name)
+            if changed:
+                to_update[tuple(changed)].append(product)
+
+        Product.objects.bulk_create(to_create, batch_size=self.batch_size)
+        for fields, group in to_update.items():
+            Product.objects.bulk_update(group, fields, batch_size=self.batch_size)
+        for name, count in acquired.items():
+            storage.acquire(name, count)
+        for name, count in released.items():
+            storage.release(name, count)
+        self.stats['products_created'] += len(to_create)
+        self.stats['products_updated'] += sum(len(group) for group in to_update.values())
+
+        # Lấy lại theo external_id: có id của sản phẩm mới (MySQL không trả về) và brand/category cho chỉ mục tìm kiếm
+        return {
+            product.external_id: product
+            for product in Product.objects.filter(external_id__in=list(merged)).select_related('brand', 'category')
+        }
+
+    def _upsert_variants(self, rows, products):
+        rows = [(line_no, fields, variant) for line_no, fields, variant in rows
+                if variant is not None and fields['external_id'] in products]
+        if not rows:
+            return
+
+        hex_codes = {variant['color']: variant['color_hex'] for _, _, variant in rows if variant['color_hex']}
+        self._ensure(Color, self.colors, {variant['color'] for _, _, variant in rows}, field='name',
+                     defaults=lambda name: {'hex_code': hex_codes.get(name, '#000000')})
+        self._ensure(Size, self.sizes, {variant['size'] for _, _, variant in rows}, field='name')
+
+        # Một biến thể xuất hiện nhiều lần trong lô: dòng sau ghi đè dòng trước
+        planned = {}
+        for line_no, fields, variant in rows:
+            product = products[fields['external_id']]
+            row = {
+                'product': product.id,
+                'color_id': self.colors[variant['color']],
+                'size_id': self.sizes[variant['size']],
+                'price': variant['price'] if variant['price'] is not None else product.price,
+            }
+            if row['price'] is None:
+                del row['price']
+            if variant['stock_quantity'] is not None:
+                row['stock_quantity'] = variant['stock_quantity']
+            if variant['sku']:
+                row['sku'] = variant['sku']
+            planned[(row['product'], row['color_id'], row['size_id'])] = (line_no, row)
+
+        lines = [line_no for line_no, _ in planned.values()]
+        variant_rows = [row for _, row in planned.values()]
+        ok, results = bulk_upsert_variants(variant_rows, refresh_catalog=False, validate=False)
+        if not ok:
+            # Bỏ các dòng lỗi rồi ghi lại phần còn lại
+            keep = []
+            for line_no, row, result in zip(lines, variant_rows, results):
+                if result.get('status') == 'error':
+                    self._error(line_no, result['errors'])
+                else:
+                    keep.append(row)
+            ok, results = bulk_upsert_variants(keep, refresh_catalog=False, validate=False)
+            if not ok:
+                self.stats['errors'] += len(keep)
+                self.log(f'Bỏ qua {len(keep)} biến thể của lô do lỗi')
+                return
+
+        for result in results:
+            if result['status'] in ('created', 'updated'):
+                self.stats[f"variants_{result['status']}"] += 1
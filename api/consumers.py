@@ -0,0 +1,41 @@
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from api import order_intake
+from api.models import OrderIntake
+
+
+class OrderIntakeConsumer(AsyncWebsocketConsumer):
+    """Gửi trạng thái của một vé đặt hàng bất đồng bộ (api.order_intake) khi worker xử lý xong"""
+
+    async def connect(self):
+        self.ticket = self.scope['url_route']['kwargs']['ticket']
+        data = await self.current_status()
+        if data is None:
+            await self.close()
+            return
+        self.group_name = order_intake.group_name(self.ticket)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        # Trạng thái hiện tại, phòng khi worker đã xử lý xong trước khi kết nối
+        await self.send(text_data=json.dumps(data))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def intake_status(self, event):
+        await self.send(text_data=json.dumps(event['data']))
+
+    @database_sync_to_async
+    def current_status(self):
+        # Client dùng JWT nên websocket thường không có user (AuthMiddlewareStack đọc session):
+        # vé là UUID ngẫu nhiên chỉ chủ đơn biết, đủ để xem trạng thái
+        intakes = OrderIntake.objects.filter(id=self.ticket)
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            intakes = intakes.filter(user=user)
+        intake = intakes.first()
+        return order_intake.describe(intake) if intake else None
@@ -0,0 +1,193 @@
+"""
+Chỉ mục facet trong bộ nhớ cho danh sách sản phẩm.
+
+Dữ liệu lấy từ bảng ProductSummary. Mỗi sản phẩm có một vị trí bit; vị trí được sắp
+theo giá thấp nhất (có tính biến thể), nên lọc theo khoảng giá là một dải bit liên tục
+và sắp xếp theo giá chính là thứ tự bit.
+Mỗi giá trị facet (brand, category, color, size) là một số nguyên Python dùng như bitset.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+
+from api.catalog_cache import get_catalog_version
+from api.models import Product, ProductSummary
+
+# Không xây lại chỉ mục quá một lần trong khoảng thời gian này (giây) cho mỗi process
+REBUILD_INTERVAL = getattr(settings, 'FACET_INDEX_REBUILD_INTERVAL', 5)
+
+# Các khoảng giá hiển thị trên trang tìm kiếm (VND), cận trên được tính vào khoảng
+PRICE_BUCKETS = (
+    ('under-100k', None, 99999),
+    ('100k-300k', 100000, 300000),
+    ('300k-500k', 300001, 500000),
+    ('500k-1m', 500001, 1000000),
+    ('over-1m', 1000001, None),
+)
+
+DIMENSIONS = ('brand', 'category', 'color', 'size')
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+def _bits_from_positions(positions, size):
+    """Tạo bitset từ danh sách vị trí trong một lần (tránh OR liên tục trên số nguyên lớn)"""
+    buffer = bytearray(size // 8 + 1)
+    for pos in positions:
+        buffer[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _positions(bits):
+    """Các vị trí bit được bật, theo thứ tự tăng dần"""
+    return [i for i, bit in enumerate(reversed(bin(bits)[2:])) if bit == '1']
+
+
+class FacetIndex:
+    # Phiên bản catalog lúc xây chỉ mục
+    version = None
+
+    def __init__(self, rows, variant_rows):
+        """
+        rows: (id, brand_id, category_id, min_price, total_stock, createdAt)
+        variant_rows: (product_id, color_ids, size_ids)
+        """
+        rows = sorted(rows, key=lambda row: (self._price_key(row[3]), row[0]))
+        self.ids = [row[0] for row in rows]
+        self.prices = [self._price_key(row[3]) for row in rows]
+        self.position_of = {pk: pos for pos, pk in enumerate(self.ids)}
+        newest_first = sorted(range(len(rows)), key=lambda pos: (rows[pos][5], rows[pos][0]), reverse=True)
+        self.created_rank = {pos: rank for rank, pos in enumerate(newest_first)}
+        self.all_bits = (1 << len(rows)) - 1
+
+        positions = {dimension: defaultdict(list) for dimension in DIMENSIONS}
+        in_stock = []
+        for pos, row in enumerate(rows):
+            positions['brand'][row[1]].append(pos)
+            positions['category'][row[2]].append(pos)
+            if row[4] and row[4] > 0:
+                in_stock.append(pos)
+
+        for product_id, color_ids, size_ids in variant_rows:
+            pos = self.position_of.get(product_id)
+            if pos is not None:
+                for color_id in color_ids:
+                    positions['color'][color_id].append(pos)
+                for size_id in size_ids:
+                    positions['size'][size_id].append(pos)
+
+        size = len(rows)
+        self.bits = {
+            dimension: {value: _bits_from_positions(items, size) for value, items in values.items()}
+            for dimension, values in positions.items()
+        }
+        self.in_stock_bits = _bits_from_positions(in_stock, size)
+
+    @staticmethod
+    def _price_key(price):
+        return Decimal('Infinity') if price is None else Decimal(price)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def price_range_bits(self, min_price=None, max_price=None):
+        lo = 0 if min_price is None else bisect_left(self.prices, Decimal(min_price))
+        hi = bisect_right(self.prices, Decimal(max_price)) if max_price is not None else bisect_left(self.prices, Decimal('Infinity'))
+        if hi <= lo:
+            return 0
+        return ((1 << (hi - lo)) - 1) << lo
+
+    def _dimension_bits(self, dimension, values):
+        bits = 0
+        for value in values:
+            bits |= self.bits[dimension].get(value, 0)
+        return bits
+
+    def _mask(self, filters, skip=None):
+        mask = self.all_bits
+        for dimension in DIMENSIONS:
+            if dimension != skip and filters.get(dimension):
+                mask &= self._dimension_bits(dimension, filters[dimension])
+        if skip != 'price' and (filters.get('min_price') is not None or filters.get('max_price') is not None):
+            mask &= self.price_range_bits(filters.get('min_price'), filters.get('max_price'))
+        if skip != 'in_stock' and filters.get('in_stock'):
+            mask &= self.in_stock_bits
+        return mask
+
+    def filter(self, filters):
+        return self._mask(filters)
+
+    def facet_counts(self, filters):
+        """Đếm theo từng chiều, áp dụng mọi bộ lọc trừ bộ lọc của chính chiều đó"""
+        facets = {}
+        for dimension in DIMENSIONS:
+            mask = self._mask(filters, skip=dimension)
+            counts = {value: _popcount(bits & mask) for value, bits in self.bits[dimension].items()}
+            facets[dimension] = {value: count for value, count in counts.items() if count}
+
+        mask = self._mask(filters, skip='price')
+        facets['price'] = {
+            name: _popcount(self.price_range_bits(lo, hi) & mask)
+            for name, lo, hi in PRICE_BUCKETS
+        }
+
+        mask = self._mask(filters, skip='in_stock')
+        facets['in_stock'] = _popcount(self.in_stock_bits & mask)
+        return facets
+
+    def ordered_ids(self, mask, ordering='-createdAt'):
+        positions = _positions(mask)
+        if ordering == 'price':
+            pass
+        elif ordering == '-price':
+            # Sản phẩm chưa có giá (Infinity, cuối chỉ mục) vẫn xếp cuối khi giá giảm dần
+            priced = bisect_left(positions, bisect_left(self.prices, Decimal('Infinity')))
+            positions = positions[priced - 1::-1] + positions[priced:] if priced else positions
+        else:
+            positions.sort(key=self.created_rank.__getitem__)
+        return [self.ids[pos] for pos in positions]
+
+    @classmethod
+    def build(cls):
+        rows = Product.objects.values_list(
+            'id', 'brand_id', 'category_id', 'summary__min_price', 'summary__total_stock', 'createdAt'
+        )
+        variant_rows = ProductSummary.objects.values_list('product_id', 'color_ids', 'size_ids')
+        return cls(list(rows), variant_rows.iterator())
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'built_at': 0}
+
+
+def get_facet_index():
+    """
+    Trả về chỉ mục hiện tại, xây lại khi phiên bản catalog thay đổi. Trong REBUILD_INTERVAL giây
+    sau lần xây trước, chỉ mục cũ (index.version khác phiên bản hiện tại) vẫn được dùng.
+    """
+    version = get_catalog_version()
+    index = _state['index']
+    if index is not None and (
+        index.version == version or time.monotonic() - _state['built_at'] < REBUILD_INTERVAL
+    ):
+        return index
+
+    with _lock:
+        if _state['index'] is not index:
+            return _state['index']
+        index = FacetIndex.build()
+        index.version = version
+        _state['index'] = index
+        _state['built_at'] = time.monotonic()
+        return index
+
+
+def is_current(index):
+    """Chỉ mục đã theo kịp phiên bản catalog hiện tại (phản hồi dựng từ nó được phép cache)"""
+    return index.version == get_catalog_version()
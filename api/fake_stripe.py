@@ -0,0 +1,231 @@
+"""
+Server Stripe giả để chạy thử và đo luồng thanh toán khi không có mạng.
+
+Hỗ trợ phần API mà ứng dụng dùng: tạo, đọc và xác nhận payment intent (/v1/payment_intents).
+Khi một payment intent được xác nhận, server gửi sự kiện payment_intent.succeeded có chữ ký
+(cùng cách ký với Stripe: HMAC-SHA256 của "timestamp.body" bằng webhook secret) tới webhook của
+ứng dụng từ một luồng riêng, thử lại khi webhook lỗi, và có thể gửi trùng để kiểm tra tính
+idempotent. Có thể giả lập Stripe chậm hoặc lỗi (latency, error_rate, fail_next) để thử timeout,
+thử lại và ngắt mạch của api.stripe_gateway; POST cùng Idempotency-Key trả lại kết quả cũ như
+Stripe. Trỏ ứng dụng vào server bằng STRIPE_API_BASE.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_ATTEMPTS = 3
+
+
+def sign(payload, secret, timestamp=None):
+    """Giá trị header Stripe-Signature cho body (str)"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+
+def build_event(intent, event_type='payment_intent.succeeded'):
+    return {
+        'id': f'evt_{secrets.token_hex(12)}',
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()),
+        'data': {'object': intent},
+    }
+
+
+def _parse_form(body):
+    """Body form của thư viện stripe (metadata[order_id]=1) thành dict lồng nhau"""
+    data = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        if '[' in key and key.endswith(']'):
+            name, _, sub = key[:-1].partition('[')
+            data.setdefault(name, {})[sub] = value
+        else:
+            data[key] = value
+    return data
+
+
+def http_delivery(url):
+    """Hàm gửi webhook qua HTTP POST; trả về mã HTTP"""
+    def deliver(payload, signature):
+        request = urllib.request.Request(url, data=payload.encode(), method='POST', headers={
+            'Content-Type': 'application/json', 'Stripe-Signature': signature,
+        })
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    return deliver
+
+
+class FakeStripe:
+    """Trạng thái của server: các payment intent và hàng đợi webhook"""
+
+    def __init__(self, secret, deliver=None, duplicates=0, latency=0.0, error_rate=0.0):
+        self.secret = secret
+        self.deliver = deliver
+        self.duplicates = duplicates
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failures = []
+        self.requests = 0
+        self.intents = {}
+        self.idempotent = {}
+        self.lock = threading.Lock()
+        self.outbox = queue.Queue()
+        self.delivered = 0
+        self.failed = 0
+
+    def fail_next(self, count, status=503):
+        """count request tiếp theo trả lỗi status"""
+        with self.lock:
+            self.failures.extend([status] * count)
+
+    def fault(self):
+        """Mã lỗi giả lập cho request hiện tại, None nếu xử lý bình thường"""
+        with self.lock:
+            self.requests += 1
+            if self.failures:
+                return self.failures.pop(0)
+        if self.error_rate and random.random() < self.error_rate:
+            return 500
+        return None
+
+    def create_intent(self, params, idempotency_key=None):
+        intent_id = f'pi_{secrets.token_hex(12)}'
+        intent = {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': int(params.get('amount', 0)),
+            'amount_received': 0,
+            'currency': params.get('currency', 'vnd'),
+            'status': 'requires_payment_method',
+            'client_secret': f'{intent_id}_secret_{secrets.token_hex(8)}',
+            'metadata': params.get('metadata', {}),
+            'created': int(time.time()),
+        }
+        with self.lock:
+            if idempotency_key:
+                intent = self.idempotent.setdefault(idempotency_key, intent)
+            self.intents[intent['id']] = intent
+        return intent
+
+    def confirm_intent(self, intent_id):
+        with self.lock:
+            intent = self.intents.get(intent_id)
+            if intent is None or intent['status'] == 'succeeded':
+                return intent
+            intent.update(status='succeeded', amount_received=intent['amount'])
+            event = build_event(dict(intent))
+        for _ in range(1 + self.duplicates):
+            self.outbox.put(event)
+        return intent
+
+    def deliver_forever(self):
+        """Luồng gửi webhook; thử lại tối đa DELIVERY_ATTEMPTS lần"""
+        while True:
+            event = self.outbox.get()
+            if event is None:
+                return
+            payload = json.dumps(event)
+            for attempt in range(DELIVERY_ATTEMPTS):
+                try:
+                    if 200 <= self.deliver(payload, sign(payload, self.secret)) < 300:
+                        self.delivered += 1
+                        break
+                except Exception:
+                    logger.warning('Gửi webhook %s thất bại', event['id'], exc_info=True)
+                time.sleep(0.1 * (attempt + 1))
+            else:
+                self.failed += 1
+            self.outbox.task_done()
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeStripe/1.0'
+    # Giữ kết nối để thử pool kết nối của client
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self):
+        self._send(404, {'error': {'type': 'invalid_request_error', 'message': f'No such resource: {self.path}'}})
+
+    def _route(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts[:2] != ['v1', 'payment_intents']:
+            return None, None
+        return parts[2] if len(parts) > 2 else None, parts[3] if len(parts) > 3 else None
+
+    def _fault(self):
+        """Giả lập độ trễ và lỗi; trả về True nếu đã trả lỗi"""
+        stripe = self.server.stripe
+        if stripe.latency:
+            time.sleep(stripe.latency)
+        status = stripe.fault()
+        if status is None:
+            return False
+        self._send(status, {'error': {'type': 'api_error', 'message': 'Fake Stripe error'}})
+        return True
+
+    def do_GET(self):
+        if self._fault():
+            return
+        intent_id, action = self._route()
+        intent = self.server.stripe.intents.get(intent_id) if intent_id and not action else None
+        if intent is None:
+            return self._not_found()
+        self._send(200, intent)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = _parse_form(self.rfile.read(length).decode())
+        if self._fault():
+            return
+        intent_id, action = self._route()
+        stripe = self.server.stripe
+        if intent_id is None and self.path.startswith('/v1/payment_intents'):
+            return self._send(200, stripe.create_intent(params, self.headers.get('Idempotency-Key')))
+        if intent_id and action == 'confirm':
+            intent = stripe.confirm_intent(intent_id)
+            return self._send(200, intent) if intent else self._not_found()
+        self._not_found()
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Client bỏ kết nối khi hết thời gian chờ: không in traceback
+        logger.debug('Lỗi khi trả lời %s', client_address, exc_info=True)
+
+
+def make_server(host, port, secret, deliver, duplicates=0, latency=0.0, error_rate=0.0):
+    """Tạo server (chưa chạy) và khởi động luồng gửi webhook; server.stripe là trạng thái FakeStripe"""
+    server = FakeStripeServer((host, port), FakeStripeHandler)
+    server.stripe = FakeStripe(secret, deliver, duplicates, latency, error_rate)
+    threading.Thread(target=server.stripe.deliver_forever, daemon=True).start()
+    return server
+
+
+def url(server):
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}'
@@ -0,0 +1,320 @@
+"""
+Flash sale: bán một sản phẩm trong thời gian ngắn mà không khóa dòng tồn kho cho mỗi đơn.
+
+- start_sale: chuyển tồn kho của sản phẩm vào bộ đếm trong cache FLASH_SALE_CACHE (tồn kho
+  trong DB về 0 nên checkout thường không bán trùng), ghi số đã chuyển vào FlashSale.allocation.
+- purchase: nhận/từ chối đơn bằng cache.decr trên bộ đếm (nguyên tử trong LocMemCache của một
+  process; nhiều process thì FLASH_SALE_CACHE phải là cache dùng chung như Redis). Đơn đã nhận
+  được OrderWriter ghi theo lô: nhiều đơn trong một transaction, dòng đơn hàng bulk_create.
+- reconcile_sale: sau khi kết thúc, tính số đã bán từ các đơn đã ghi (DB là nguồn đúng) và
+  trả phần còn lại về tồn kho.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as WriteTimeout
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from api.models import FlashSale, Order, OrderItem, Product, ProductVariant, ShippingAddress
+from api.orders import (
+    OrderError, apply_stock_change, build_order_items, build_shipping_address, load_items, return_stock,
+    save_order_items, stock_key, take_stock, validate_checkout,
+)
+
+COUNTER_CACHE = getattr(settings, 'FLASH_SALE_CACHE', 'default')
+WRITE_BATCH_SIZE = getattr(settings, 'FLASH_SALE_WRITE_BATCH_SIZE', 200)
+# Thời gian tối đa chờ gom thêm đơn vào một lô (giây)
+WRITE_INTERVAL = getattr(settings, 'FLASH_SALE_WRITE_INTERVAL', 0.02)
+WRITE_TIMEOUT = 10
+# Chỉ đối soát sau ends_at một khoảng, để các đơn đã nhận kịp được ghi
+RECONCILE_GRACE = timedelta(seconds=getattr(settings, 'FLASH_SALE_RECONCILE_GRACE', 60))
+# Thông tin đợt sale được giữ trong process một lúc để không đọc DB mỗi request
+SALE_CACHE_SECONDS = 1
+
+
+def _counters():
+    return caches[COUNTER_CACHE]
+
+
+def _label(key):
+    return f'{key[0]}:{key[1]}'
+
+
+def _parse(label):
+    kind, pk = label.split(':')
+    return kind, int(pk)
+
+
+def _counter_key(sale_id, key):
+    return f'flash_sale:{sale_id}:{_label(key)}'
+
+
+def start_sale(sale_id):
+    """Chuyển tồn kho vào bộ đếm và bắt đầu đợt sale, trả về FlashSale"""
+    with transaction.atomic():
+        sale = FlashSale.objects.select_for_update().get(id=sale_id)
+        if sale.status != FlashSale.SCHEDULED:
+            return sale
+        product = Product.objects.select_for_update().get(id=sale.product_id)
+        if product.has_variants:
+            rows = ProductVariant.objects.select_for_update().filter(product=product).values_list('id', 'stock_quantity')
+            allocation = {('variant', pk): stock for pk, stock in rows if stock > 0}
+        else:
+            allocation = {('product', product.id): product.countInStock} if (product.countInStock or 0) > 0 else {}
+        for key, qty in allocation.items():
+            take_stock(key, qty)
+        apply_stock_change({product.id: sum(allocation.values())})
+
+        sale.allocation = {_label(key): qty for key, qty in allocation.items()}
+        sale.status = FlashSale.RUNNING
+        sale.save(update_fields=['allocation', 'status'])
+        transaction.on_commit(lambda: _counters().set_many(
+            {_counter_key(sale.id, key): qty for key, qty in allocation.items()}, timeout=None,
+        ))
+    _sales.pop(sale.id, None)
+    return sale
+
+
+def _sold(sale_id):
+    """Số đã bán theo dòng tồn kho, tính từ các đơn đã ghi"""
+    sold = Counter()
+    rows = (OrderItem.objects.filter(order__flash_sale_id=sale_id)
+            .values_list('product_id', 'product_variant_id').annotate(total=Sum('qty')).order_by())
+    for product_id, variant_id, total in rows:
+        sold[('variant', variant_id) if variant_id else ('product', product_id)] += total
+    return sold
+
+
+def _load_counters(sale):
+    """Khởi tạo bộ đếm còn thiếu (process mới, cache bị xóa) từ allocation trừ số đã ghi"""
+    sold = _sold(sale.id)
+    for label, qty in sale.allocation.items():
+        key = _parse(label)
+        _counters().add(_counter_key(sale.id, key), qty - sold[key], timeout=None)
+
+
+def _decr(sale, key, qty):
+    """Giảm bộ đếm, trả về số còn lại sau khi giảm; None nếu dòng tồn kho không thuộc đợt sale"""
+    if _label(key) not in sale.allocation:
+        return None
+    counter = _counter_key(sale.id, key)
+    try:
+        return _counters().decr(counter, qty)
+    except ValueError:
+        # Đọc lại từ DB: bộ đếm đã bị xóa khi đối soát thì không được tạo lại
+        sale = FlashSale.objects.get(id=sale.id)
+        if sale.status != FlashSale.RUNNING:
+            raise OrderError('Flash sale chưa bắt đầu hoặc đã kết thúc')
+        _load_counters(sale)
+        return _counters().decr(counter, qty)
+
+
+def admit(sale, demand):
+    """Trừ bộ đếm cho mọi dòng của đơn; nếu một dòng không đủ thì hoàn lại và trả về False"""
+    taken = []
+    for key, qty in sorted(demand.items()):
+        remaining = _decr(sale, key, qty)
+        if remaining is not None and remaining >= 0:
+            taken.append((key, qty))
+            continue
+        if remaining is not None:
+            taken.append((key, qty))
+        release(sale, dict(taken))
+        return False
+    return True
+
+
+def release(sale, demand):
+    for key, qty in demand.items():
+        _counters().incr(_counter_key(sale.id, key), qty)
+
+
+def remaining(sale):
+    """Số còn lại trên bộ đếm theo dòng tồn kho (None nếu bộ đếm chưa có trong cache)"""
+    values = _counters().get_many([_counter_key(sale.id, _parse(label)) for label in sale.allocation])
+    return {label: values.get(_counter_key(sale.id, _parse(label))) for label in sale.allocation}
+
+
+class OrderWriter:
+    """
+    Ghi đơn flash sale theo lô trong một luồng nền: gom các đơn đến trong WRITE_INTERVAL
+    (tối đa WRITE_BATCH_SIZE đơn) và ghi trong một transaction. Request chờ Future của đơn mình.
+    background=False ghi ngay trong luồng gọi (dùng cho test).
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, interval=WRITE_INTERVAL, background=True):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.background = background
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        future = Future()
+        if not self.background:
+            self._write([(job, future)])
+            return future
+        self.queue.put((job, future))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='flash-sale-writer', daemon=True)
+                self._thread.start()
+        return future
+
+    def flush(self, timeout=WRITE_TIMEOUT):
+        """Chờ các đơn đã gửi trước đó được ghi xong"""
+        self.submit(None).result(timeout=timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            close_old_connections()
+            self._write(batch)
+
+    def _write(self, batch):
+        jobs = [(job, future) for job, future in batch if job is not None]
+        try:
+            orders = _write_orders([job for job, _ in jobs])
+        except Exception:
+            # Một đơn lỗi không làm hỏng cả lô: ghi lại từng đơn
+            orders = []
+            for job, future in jobs:
+                try:
+                    orders.append(_write_orders([job])[0])
+                except Exception as exc:
+                    orders.append(exc)
+        for (job, future), result in zip(jobs, orders):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        for job, future in batch:
+            if job is None:
+                future.set_result(None)
+
+
+def _write_orders(jobs):
+    """Ghi nhiều đơn trong một transaction, trả về danh sách id đơn"""
+    with transaction.atomic():
+        orders, addresses, items = [], [], []
+        for job in jobs:
+            data = job['data']
+            order = Order.objects.create(
+                user_id=job['user_id'],
+                paymentMethod=data['paymentMethod'],
+                taxPrice=data['taxPrice'],
+                shippingPrice=data['shippingPrice'],
+                totalPrice=data['totalPrice'],
+                flash_sale_id=job['sale_id'],
+            )
+            orders.append(order.id)
+            addresses.append(build_shipping_address(order, data['shippingAddress']))
+            items.extend(build_order_items(order, job['lines']))
+        ShippingAddress.objects.bulk_create(addresses)
+        save_order_items(items)
+    return orders
+
+
+writer = OrderWriter()
+
+# {sale_id: (FlashSale, thời điểm đọc)}
+_sales = {}
+
+
+def get_sale(sale_id):
+    cached = _sales.get(sale_id)
+    if cached is None or time.monotonic() - cached[1] > SALE_CACHE_SECONDS:
+        sale = FlashSale.objects.filter(id=sale_id).first()
+        if sale is None:
+            raise FlashSale.DoesNotExist
+        cached = _sales[sale_id] = (sale, time.monotonic())
+    return cached[0]
+
+
+def purchase(user, sale_id, data):
+    """
+    Nhận một đơn flash sale, trả về id đơn sau khi được ghi; ném OrderError nếu bị từ chối,
+    WriteTimeout (concurrent.futures.TimeoutError, trước Python 3.11 khác TimeoutError có sẵn)
+    nếu đơn đã được nhận nhưng chưa ghi xong sau WRITE_TIMEOUT giây.
+    """
+    sale = get_sale(sale_id)
+    now = timezone.now()
+    if sale.status != FlashSale.RUNNING or not sale.starts_at <= now < sale.ends_at:
+        raise OrderError('Flash sale chưa bắt đầu hoặc đã kết thúc')
+    validate_checkout(data)
+    lines = load_items(data.get('orderItems'))
+    if any(product.id != sale.product_id for item, product, variant, qty in lines):
+        raise OrderError('Sản phẩm không thuộc flash sale')
+
+    demand = Counter()
+    for item, product, variant, qty in lines:
+        demand[stock_key(product, variant)] += qty
+    if not admit(sale, demand):
+        raise OrderError('Sản phẩm flash sale đã hết hàng')
+
+    future = writer.submit({'user_id': user.id, 'sale_id': sale.id, 'data': data, 'lines': lines})
+    try:
+        return future.result(timeout=WRITE_TIMEOUT)
+    except WriteTimeout:
+        # Đơn vẫn có thể được ghi sau đó nên không hoàn bộ đếm; đối soát dựa trên đơn đã ghi
+        raise
+    except Exception:
+        release(sale, demand)
+        raise
+
+
+def end_sale(sale_id):
+    """Dừng nhận đơn ngay; đối soát chạy sau RECONCILE_GRACE"""
+    FlashSale.objects.filter(id=sale_id, ends_at__gt=timezone.now()).update(ends_at=timezone.now())
+    _sales.pop(sale_id, None)
+
+
+def reconcile_sale(sale_id, force=False):
+    """
+    Kết thúc đợt sale: trả phần chưa bán về tồn kho và xóa bộ đếm. Trả về báo cáo
+    {dòng tồn kho: {allocated, sold, returned, counter}} hoặc None nếu chưa tới lúc đối soát.
+    counter khác allocated - sold nghĩa là có đơn đã nhận nhưng không được ghi.
+    """
+    if writer.background:
+        writer.flush()
+    with transaction.atomic():
+        sale = FlashSale.objects.select_for_update().get(id=sale_id)
+        if sale.status != FlashSale.RUNNING:
+            return None
+        if not force and timezone.now() < sale.ends_at + RECONCILE_GRACE:
+            return None
+        counters = remaining(sale)
+        sold = _sold(sale.id)
+        report = {}
+        returned = 0
+        for label, allocated in sorted(sale.allocation.items()):
+            key = _parse(label)
+            left = allocated - sold[key]
+            if left > 0:
+                return_stock(key, left)
+                returned += left
+            report[label] = {'allocated': allocated, 'sold': sold[key], 'returned': max(left, 0), 'counter': counters[label]}
+        apply_stock_change({sale.product_id: -returned})
+
+        sale.sold = {_label(key): qty for key, qty in sold.items()}
+        sale.status = FlashSale.RECONCILED
+        sale.save(update_fields=['sold', 'status'])
+        transaction.on_commit(lambda: _counters().delete_many(
+            [_counter_key(sale.id, _parse(label)) for label in sale.allocation]
+        ))
+    _sales.pop(sale.id, None)
+    return report
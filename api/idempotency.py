@@ -0,0 +1,119 @@
+"""
+Header Idempotency-Key cho các API đặt hàng/thanh toán mà client có thể gửi lại khi timeout.
+
+Request đầu tiên với một key tạo dòng IdempotencyKey (chưa có phản hồi) trước khi chạy view,
+rồi lưu phản hồi khi xong. Request trùng key nhận lại phản hồi đã lưu mà không chạy view
+(không đụng tới bảng đơn hàng, tồn kho, ví); nếu request đầu chưa xong thì chờ nó thay vì
+chạy song song. Chỉ phản hồi thành công (2xx/3xx) được lưu: các view này trả lỗi khi chưa ghi
+gì (hết hàng, số dư không đủ, thanh toán chưa xong...), nên client được thử lại với cùng key.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+# Thời gian request trùng chờ request đầu tiên (giây)
+WAIT_SECONDS = getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+POLL_INTERVAL = 0.05
+# Request đầu tiên chưa xong sau khoảng này coi như đã chết (process bị kill), request sau được xử lý lại
+LOCK_TIMEOUT = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60))
+KEY_TTL = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(user, key, fingerprint):
+    """Tạo dòng cho key; trả về (record, True) nếu request này được xử lý, (record, False) nếu key đã có"""
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint), True
+    except IntegrityError:
+        pass
+    record = IdempotencyKey.objects.get(user=user, key=key)
+    if record.response_status is None and record.created_at < timezone.now() - LOCK_TIMEOUT:
+        # Tiếp quản key của request đã chết; UPDATE có điều kiện để chỉ một request thắng
+        taken = IdempotencyKey.objects.filter(
+            id=record.id, response_status__isnull=True, created_at=record.created_at,
+        ).update(created_at=timezone.now(), fingerprint=fingerprint)
+        if taken:
+            return record, True
+    return record, False
+
+
+def _wait(record):
+    deadline = time.monotonic() + WAIT_SECONDS
+    while record.response_status is None and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(id=record.id).first()
+        if record is None:
+            # Request đầu tiên lỗi và đã bỏ key
+            return None
+    return record
+
+
+def idempotent(view):
+    """Decorator cho view (request, ...); dùng method_decorator cho method của APIView"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': f'{HEADER} quá dài'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = _fingerprint(request)
+        record, owner = _claim(request.user, key, fingerprint)
+        if not owner:
+            if record.fingerprint != fingerprint:
+                return Response({'error': f'{HEADER} đã được dùng cho một request khác'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            record = _wait(record)
+            if record is None:
+                return wrapper(request, *args, **kwargs)
+            if record.response_status is None:
+                response = Response({'error': 'Request với key này đang được xử lý'}, status=status.HTTP_409_CONFLICT)
+                response['Retry-After'] = '1'
+                return response
+            return _replay(record)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            IdempotencyKey.objects.filter(id=record.id).delete()
+            raise
+        if response.status_code >= 400 or not hasattr(response, 'data'):
+            IdempotencyKey.objects.filter(id=record.id).delete()
+            return response
+        IdempotencyKey.objects.filter(id=record.id).update(
+            response_status=response.status_code,
+            response_body=json.loads(json.dumps(response.data, cls=DjangoJSONEncoder)),
+            completed_at=timezone.now(),
+        )
+        return response
+    return wrapper
+
+
+def purge_expired(older_than=KEY_TTL):
+    """Xóa key cũ hơn older_than, trả về số dòng đã xóa"""
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - older_than).delete()
+    return deleted
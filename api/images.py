@@ -0,0 +1,111 @@
+"""
+Ảnh phái sinh (thumbnail, card, detail) cho ảnh sản phẩm, kèm bản WebP.
+
+Ảnh phái sinh nằm trong MEDIA_ROOT/derivatives/<size>/<tên ảnh gốc>.<định dạng>,
+nên URL tính được từ tên ảnh gốc mà không cần đọc đĩa. Ảnh được tạo khi upload/lưu sản phẩm;
+ảnh cũ chưa có bản phái sinh được tạo ở lần request đầu tiên (xem serve_derivative).
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.utils._os import safe_join
+from PIL import Image, ImageOps
+
+from api.storage import write_atomic
+
+DERIVATIVES_DIR = 'derivatives'
+
+# Kích thước tối đa (rộng, cao) của từng loại, giữ nguyên tỉ lệ
+DERIVATIVE_SIZES = getattr(settings, 'IMAGE_DERIVATIVES', {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+})
+QUALITY = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 82)
+
+# Ảnh có thể trong suốt giữ PNG làm bản dự phòng, còn lại dùng JPEG
+ALPHA_EXTENSIONS = ('.png', '.gif', '.webp')
+FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+
+def _normalize(name):
+    return str(name or '').lstrip('/')
+
+
+def fallback_format(name):
+    return 'png' if os.path.splitext(name)[1].lower() in ALPHA_EXTENSIONS else 'jpg'
+
+
+def derivative_name(name, size, fmt):
+    # Giữ cả đuôi của ảnh gốc để 'a.jpg' và 'a.png' không trùng bản phái sinh
+    return f'{DERIVATIVES_DIR}/{size}/{_normalize(name)}.{fmt}'
+
+
+def derivative_urls(name):
+    """{size: {'src': url jpg/png, 'webp': url webp}} cho một ảnh, không truy cập đĩa"""
+    name = _normalize(name)
+    if not name or name.startswith(DERIVATIVES_DIR + '/'):
+        return None
+    fallback = fallback_format(name)
+    return {
+        size: {
+            'src': settings.MEDIA_URL + derivative_name(name, size, fallback),
+            'webp': settings.MEDIA_URL + derivative_name(name, size, 'webp'),
+        }
+        for size in DERIVATIVE_SIZES
+    }
+
+
+def _render(image, size, fmt):
+    image = image.copy()
+    image.thumbnail(DERIVATIVE_SIZES[size], Image.LANCZOS)
+    if fmt == 'jpg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image.mode == 'P':
+        image = image.convert('RGBA')
+    buffer = BytesIO()
+    options = {'quality': QUALITY}
+    if fmt == 'jpg':
+        options.update(optimize=True, progressive=True)
+    elif fmt == 'webp':
+        options.update(method=4)
+    elif fmt == 'png':
+        options = {'optimize': True}
+    image.save(buffer, FORMATS[fmt], **options)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, force=False):
+    """Tạo mọi bản phái sinh còn thiếu cho ảnh gốc; trả về False nếu ảnh gốc không đọc được"""
+    name = _normalize(name)
+    source = safe_join(settings.MEDIA_ROOT, name)
+    targets = [
+        (size, fmt, safe_join(settings.MEDIA_ROOT, derivative_name(name, size, fmt)))
+        for size in DERIVATIVE_SIZES
+        for fmt in (fallback_format(name), 'webp')
+    ]
+    targets = [target for target in targets if force or not os.path.exists(target[2])]
+    if not targets:
+        return True
+    try:
+        with Image.open(source) as image:
+            image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return False
+    for size, fmt, path in targets:
+        write_atomic(path, [_render(image, size, fmt)])
+    return True
+
+
+def find_source(size, derivative):
+    """Tên ảnh gốc của đường dẫn phái sinh '<tên ảnh gốc>.<định dạng>', None nếu không hợp lệ"""
+    name, fmt = os.path.splitext(_normalize(derivative))
+    fmt = fmt.lstrip('.')
+    if size not in DERIVATIVE_SIZES or fmt not in FORMATS or fmt not in ('webp', fallback_format(name)):
+        return None
+    if name.startswith(DERIVATIVES_DIR + '/') or not os.path.isfile(safe_join(settings.MEDIA_ROOT, name)):
+        return None
+    return name
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.stripe_events import BATCH_SIZE, run_worker
+
+
+class Command(BaseCommand):
+    help = ('Áp dụng các sự kiện webhook Stripe đã nhận (thanh toán đơn hàng, nạp ví) theo lô. Chạy liên tục, '
+            '--once thì dừng khi không còn sự kiện chờ; có thể chạy nhiều process cùng lúc.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Số sự kiện mỗi lô')
+        parser.add_argument('--idle-sleep', type=float, default=0.5, help='Thời gian chờ khi không có sự kiện (giây)')
+        parser.add_argument('--once', action='store_true', help='Dừng khi không còn sự kiện chờ')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size phải >= 1')
+        total = run_worker(batch_size=options['batch_size'], idle_sleep=options['idle_sleep'], once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f'Đã xử lý {total} sự kiện Stripe'))
@@ -0,0 +1,40 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from api.models import Order
+from api.sales_rollups import backfill
+
+
+class Command(BaseCommand):
+    help = ('Tính lại bảng tổng hợp doanh số từ Order/OrderItem cho một khoảng ngày thanh toán '
+            '(mặc định từ đơn đầu tiên tới hôm nay), theo từng đoạn --chunk-days ngày')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=date.fromisoformat, help='Ngày bắt đầu (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, help='Ngày kết thúc (YYYY-MM-DD)')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Số ngày mỗi transaction')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        start = options['start']
+        if start is None:
+            first = Order.objects.filter(isPaid=True).aggregate(first=Min('paidAt'))['first']
+            if first is None:
+                self.stdout.write('Chưa có đơn đã thanh toán')
+                return
+            start = timezone.localdate(first)
+        if start > end or options['chunk_days'] < 1:
+            raise CommandError('Khoảng ngày hoặc --chunk-days không hợp lệ')
+
+        total = 0
+        chunk = timedelta(days=options['chunk_days'])
+        while start <= end:
+            chunk_end = min(start + chunk - timedelta(days=1), end)
+            rows = backfill(start, chunk_end)
+            total += rows
+            self.stdout.write(f'{start} → {chunk_end}: {rows} dòng')
+            start = chunk_end + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f'Đã ghi {total} dòng tổng hợp'))
@@ -0,0 +1,116 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from api import flash_sale
+from api.models import Brand, Category, Color, FlashSale, Order, Product, ProductSummary, ProductVariant, Size
+from api.orders import OrderError, place_order
+
+BENCH_NAME = '[bench] checkout'
+
+
+class Command(BaseCommand):
+    help = ('Đo số đơn/giây khi nhiều lượt checkout cùng mua một sản phẩm và kiểm tra tồn kho '
+            'sau cùng (không bán quá số hàng có). Tạo dữ liệu tạm và xóa khi xong; '
+            'nên chạy trên MySQL, SQLite khóa cả file khi ghi.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500, help='Tổng số lượt checkout')
+        parser.add_argument('--workers', type=int, default=16, help='Số luồng checkout song song')
+        parser.add_argument('--stock', type=int, default=300, help='Tồn kho ban đầu của mỗi biến thể')
+        parser.add_argument('--variants', type=int, default=2, help='Số biến thể được mua (mỗi đơn mua 1 cái mỗi biến thể)')
+        parser.add_argument('--flash-sale', action='store_true',
+                            help='Mua qua flash sale (bộ đếm trong cache + ghi đơn theo lô), đối soát khi xong')
+        parser.add_argument('--keep', action='store_true', help='Giữ lại dữ liệu tạm để kiểm tra')
+
+    def handle(self, *args, **options):
+        if options['variants'] < 1 or options['workers'] < 1:
+            raise CommandError('--variants và --workers phải >= 1')
+        user, product, variants = self.setup(options['stock'], options['variants'])
+        data = {
+            'orderItems': [{'id': product.id, 'variant_id': variant.id, 'qty': 1} for variant in variants],
+            'paymentMethod': 'bench', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 0,
+            'shippingAddress': {'address': '-', 'city': '-', 'postalCode': '-', 'country': '-'},
+        }
+
+        sale = None
+        if options['flash_sale']:
+            sale = FlashSale.objects.create(
+                product=product, starts_at=timezone.now(), ends_at=timezone.now() + timedelta(hours=1),
+            )
+            flash_sale.start_sale(sale.id)
+
+        def checkout(_):
+            close_old_connections()
+            try:
+                if sale is not None:
+                    flash_sale.purchase(user, sale.id, data)
+                else:
+                    place_order(user, data)
+                return 'ok'
+            except OrderError:
+                return 'out_of_stock'
+            except OperationalError:
+                # Lock wait timeout/deadlock: client sẽ thử lại
+                return 'retry'
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(checkout, range(options['orders'])))
+        elapsed = time.perf_counter() - started
+        if sale is not None:
+            flash_sale.reconcile_sale(sale.id, force=True)
+
+        placed = results.count('ok')
+        stocks = list(ProductVariant.objects.filter(product=product).values_list('stock_quantity', flat=True))
+        orders = Order.objects.filter(user=user).count()
+        summary = ProductSummary.objects.filter(product=product).values_list('total_stock', flat=True).first()
+        expected = max(0, options['stock'] - placed)
+        self.stdout.write(
+            f'{options["orders"]} lượt checkout, {options["workers"]} luồng: {elapsed:.2f}s, '
+            f'{placed / elapsed:.1f} đơn/giây; thành công {placed}, hết hàng {results.count("out_of_stock")}, '
+            f'lỗi khóa {results.count("retry")}'
+        )
+        self.stdout.write(f'Tồn kho còn lại {stocks}, tổng hợp {summary}, số đơn {orders}')
+
+        consistent = (
+            all(stock == expected for stock in stocks)
+            and orders == placed
+            and summary == expected * len(stocks)
+            and placed <= options['stock']
+        )
+        if not options['keep']:
+            Order.objects.filter(user=user).delete()
+            product.delete()
+            user.delete()
+        if not consistent:
+            raise CommandError(f'Sai lệch tồn kho: mong đợi {expected} mỗi biến thể')
+        self.stdout.write(self.style.SUCCESS('Tồn kho và số đơn khớp nhau'))
+
+    def setup(self, stock, variant_count):
+        user, _ = User.objects.get_or_create(username='bench-checkout')
+        Order.objects.filter(user=user).delete()
+        Product.objects.filter(name=BENCH_NAME).delete()
+        product = Product.objects.create(
+            name=BENCH_NAME, price=1, has_variants=True,
+            brand=Brand.objects.get_or_create(title='Bench')[0],
+            category=Category.objects.get_or_create(title='Bench')[0],
+        )
+        color = Color.objects.get_or_create(name='Bench', defaults={'hex_code': '#000000'})[0]
+        variants = [
+            ProductVariant.objects.create(
+                product=product, color=color, size=Size.objects.get_or_create(name=f'B{i}')[0],
+                price=1, stock_quantity=stock,
+            )
+            for i in range(variant_count)
+        ]
+        return user, product, variants
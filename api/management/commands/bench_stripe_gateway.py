@@ -0,0 +1,60 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import fake_stripe
+from api.stripe_gateway import CircuitBreaker, GatewayError, StripeGateway
+
+
+class Command(BaseCommand):
+    help = ('Đo api.stripe_gateway với server Stripe giả chậm/lỗi (không cần mạng): số lời gọi/giây, số lần thử lại, '
+            'số lời gọi bị ngắt mạch từ chối và độ trễ theo thao tác')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=1000, help='Tổng số lời gọi tạo payment intent')
+        parser.add_argument('--workers', type=int, default=16, help='Số luồng song song')
+        parser.add_argument('--latency', type=float, default=0.02, help='Độ trễ của Stripe giả (giây)')
+        parser.add_argument('--error-rate', type=float, default=0.05, help='Tỉ lệ lỗi 500 của Stripe giả')
+        parser.add_argument('--timeout', type=float, default=2.0, help='Thời gian chờ mỗi lời gọi (giây)')
+        parser.add_argument('--retries', type=int, default=2, help='Số lần thử lại')
+        parser.add_argument('--circuit-failures', type=int, default=5, help='Số lỗi liên tiếp để mở mạch')
+
+    def handle(self, *args, **options):
+        if options['calls'] < 1 or options['workers'] < 1:
+            raise CommandError('--calls và --workers phải >= 1')
+        server = fake_stripe.make_server('127.0.0.1', 0, 'whsec_bench', lambda *args: 200,
+                                         latency=options['latency'], error_rate=options['error_rate'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        gateway = StripeGateway(
+            api_key='sk_test_fake', api_base=fake_stripe.url(server), timeout=options['timeout'],
+            max_retries=options['retries'], pool_size=options['workers'],
+            breaker=CircuitBreaker(failure_threshold=options['circuit_failures'], reset_timeout=1),
+        )
+
+        def call(i):
+            try:
+                gateway.create_payment_intent(amount=1000 + i, metadata={'bench': i})
+                return 'ok'
+            except GatewayError:
+                return 'error'
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(call, range(options['calls'])))
+        finally:
+            server.shutdown()
+            server.server_close()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{options["calls"]} lời gọi, {options["workers"]} luồng: {elapsed:.2f}s '
+            f'({options["calls"] / elapsed:.1f}/giây); thành công {results.count("ok")}, lỗi {results.count("error")}, '
+            f'{server.stripe.requests} request tới Stripe giả, {len(server.stripe.intents)} payment intent, '
+            f'mạch {gateway.breaker.state}'
+        )
+        self.stdout.write(json.dumps(gateway.metrics.snapshot(), indent=2))
+        if len(server.stripe.intents) > results.count('ok') + results.count('error'):
+            raise CommandError('Thử lại đã tạo trùng payment intent')
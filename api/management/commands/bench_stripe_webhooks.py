@@ -0,0 +1,114 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from api import fake_stripe, sales_rollups, stripe_events
+from api.models import Order, PayboxTransaction, StripeEvent
+
+BENCH_USER = 'bench-stripe'
+
+
+class Command(BaseCommand):
+    help = ('Đo luồng thanh toán Stripe qua webhook mà không cần mạng: tạo và xác nhận payment intent trên server '
+            'Stripe giả, webhook được gửi vào ứng dụng (trong process), rồi áp dụng sự kiện theo lô; kiểm tra mỗi '
+            'đơn được thanh toán và mỗi lần nạp được cộng đúng một lần. Tạo dữ liệu tạm và xóa khi xong.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=500, help='Số đơn hàng thanh toán qua Stripe')
+        parser.add_argument('--deposits', type=int, default=100, help='Số lần nạp ví')
+        parser.add_argument('--amount', type=int, default=100000, help='Số tiền mỗi giao dịch')
+        parser.add_argument('--workers', type=int, default=8, help='Số luồng gọi API Stripe giả')
+        parser.add_argument('--duplicates', type=int, default=1, help='Số lần Stripe giả gửi lặp mỗi sự kiện')
+        parser.add_argument('--batch-size', type=int, default=stripe_events.BATCH_SIZE)
+        parser.add_argument('--keep', action='store_true', help='Giữ lại dữ liệu tạm để kiểm tra')
+
+    def handle(self, *args, **options):
+        if min(options['payments'], options['deposits'], options['duplicates']) < 0 or options['workers'] < 1:
+            raise CommandError('Tham số không hợp lệ')
+        if options['payments'] + options['deposits'] < 1:
+            raise CommandError('Cần ít nhất một thanh toán hoặc lần nạp')
+        secret = settings.STRIPE_WEBHOOK_SECRET or 'whsec_bench'
+        with override_settings(STRIPE_WEBHOOK_SECRET=secret):
+            self._run(options, secret)
+
+    def _run(self, options, secret):
+        amount = options['amount']
+        user, _ = User.objects.get_or_create(username=BENCH_USER)
+        Order.objects.filter(user=user).delete()
+        orders = Order.objects.bulk_create([
+            Order(user=user, paymentMethod='Stripe', taxPrice=0, shippingPrice=0, totalPrice=amount)
+            for _ in range(options['payments'])
+        ])
+        if not all(order.id for order in orders):
+            # MySQL không trả id cho bulk_create
+            orders = list(Order.objects.filter(user=user))
+        targets = [{'order_id': order.id} for order in orders]
+        targets += [{'user_id': user.id, 'transaction_type': 'DEPOSIT'}] * options['deposits']
+
+        client = Client(raise_request_exception=False)
+
+        def deliver(payload, signature):
+            return client.post('/api/stripe/webhook/', payload, content_type='application/json',
+                               HTTP_STRIPE_SIGNATURE=signature).status_code
+
+        server = fake_stripe.make_server('127.0.0.1', 0, secret, deliver, options['duplicates'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        previous = stripe.api_base, stripe.api_key
+        stripe.api_base, stripe.api_key = fake_stripe.url(server), 'sk_test_fake'
+
+        def pay(metadata):
+            intent = stripe.PaymentIntent.create(amount=amount, currency='vnd', metadata=metadata)
+            return stripe.PaymentIntent.confirm(intent['id'])['id']
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                intent_ids = list(pool.map(pay, targets))
+            server.stripe.outbox.join()
+            ingested = time.perf_counter() - started
+
+            started = time.perf_counter()
+            while stripe_events.apply_batch(options['batch_size']):
+                pass
+            applied = time.perf_counter() - started
+        finally:
+            stripe.api_base, stripe.api_key = previous
+            server.shutdown()
+            server.server_close()
+
+        events = StripeEvent.objects.filter(payment_intent_id__in=intent_ids)
+        deposits = PayboxTransaction.objects.filter(wallet__user=user, transaction_type='DEPOSIT')
+        total = len(targets)
+        self.stdout.write(
+            f'{total} thanh toán, {options["workers"]} luồng: tạo + xác nhận + nhận webhook {ingested:.2f}s '
+            f'({total / ingested:.1f}/giây, {server.stripe.delivered} lần gửi, {server.stripe.failed} lỗi); '
+            f'áp dụng {applied:.2f}s ({total / applied:.1f}/giây)'
+        )
+        consistent = (
+            events.count() == total
+            and not events.exclude(status=StripeEvent.APPLIED).exists()
+            and Order.objects.filter(user=user, isPaid=True).count() == options['payments']
+            and deposits.count() == options['deposits']
+            and (deposits.aggregate(total=Sum('amount'))['total'] or 0) == amount * options['deposits']
+        )
+        if not options['keep']:
+            events.delete()
+            Order.objects.filter(user=user).delete()
+            user.delete()
+            # Bỏ các đơn tạm khỏi tổng hợp doanh số
+            today = timezone.localdate()
+            sales_rollups.backfill(today, today)
+        connection.close()
+        if not consistent:
+            raise CommandError('Sai lệch: có sự kiện chưa áp dụng hoặc bị áp dụng nhiều lần')
+        self.stdout.write(self.style.SUCCESS('Mỗi thanh toán được áp dụng đúng một lần'))
@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import Sum
+
+from api import wallets
+from api.models import PayboxTransaction, PayboxWallet
+
+BENCH_USER = 'bench-wallet'
+
+
+class Command(BaseCommand):
+    help = ('Đo số giao dịch/giây khi nhiều luồng cùng trừ tiền một ví Paybox và kiểm tra số dư sau cùng '
+            '(không âm, khớp tổng giao dịch và sổ, số thứ tự và balance_before/balance_after nối tiếp). Tạo dữ liệu tạm và xóa khi xong; '
+            'nên chạy trên MySQL, SQLite khóa cả file khi ghi.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debits', type=int, default=5000, help='Tổng số lượt trừ tiền')
+        parser.add_argument('--workers', type=int, default=32, help='Số luồng song song')
+        parser.add_argument('--amount', type=int, default=1000, help='Số tiền mỗi lượt')
+        parser.add_argument('--balance', type=int, default=None,
+                            help='Số dư ban đầu (mặc định đủ cho 80%% số lượt để có cả lượt bị từ chối)')
+        parser.add_argument('--keep', action='store_true', help='Giữ lại dữ liệu tạm để kiểm tra')
+
+    def handle(self, *args, **options):
+        if options['debits'] < 1 or options['workers'] < 1 or options['amount'] < 1:
+            raise CommandError('--debits, --workers và --amount phải >= 1')
+        initial = options['balance']
+        if initial is None:
+            initial = options['amount'] * options['debits'] * 4 // 5
+        user, _ = User.objects.get_or_create(username=BENCH_USER)
+        PayboxWallet.objects.filter(user=user).delete()
+        wallet = PayboxWallet.objects.create(user=user)
+        if initial:
+            # Nạp qua sổ giao dịch để số dư tính từ sổ khớp ngay từ đầu
+            wallets.credit(wallet, initial, 'DEPOSIT', description='bench')
+        first = wallet.last_sequence + 1
+        amount = options['amount']
+
+        def debit(_):
+            close_old_connections()
+            try:
+                wallets.debit(PayboxWallet(id=wallet.id), amount, 'PAYMENT', description='bench')
+                return 'ok'
+            except wallets.InsufficientBalance:
+                return 'insufficient'
+            except OperationalError:
+                # Lock wait timeout/deadlock: client sẽ thử lại
+                return 'retry'
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(debit, range(options['debits'])))
+        elapsed = time.perf_counter() - started
+
+        succeeded = results.count('ok')
+        wallet.refresh_from_db()
+        transactions = PayboxTransaction.objects.filter(wallet=wallet, transaction_type='PAYMENT')
+        total = transactions.aggregate(total=Sum('amount'))['total'] or 0
+        chain = list(transactions.order_by('sequence').values_list('sequence', 'balance_before', 'balance_after'))
+        chained = all(
+            sequence == first + i and before - after == amount and (i == 0 or chain[i - 1][2] == before)
+            for i, (sequence, before, after) in enumerate(chain)
+        )
+        self.stdout.write(
+            f'{options["debits"]} lượt trừ tiền, {options["workers"]} luồng: {elapsed:.2f}s, '
+            f'{succeeded / elapsed:.1f} giao dịch/giây; thành công {succeeded}, '
+            f'không đủ số dư {results.count("insufficient")}, lỗi khóa {results.count("retry")}'
+        )
+        self.stdout.write(f'Số dư ban đầu {initial}, còn lại {wallet.balance}, tổng đã trừ {total}')
+
+        consistent = (
+            wallet.balance >= 0
+            and wallet.balance == initial - total
+            and len(chain) == succeeded
+            and total == succeeded * amount
+            and (not chain or chain[0][1] == initial)
+            and wallets.balance_at(wallet) == wallet.balance
+            and chained
+        )
+        if not options['keep']:
+            wallet.delete()
+            user.delete()
+        if not consistent:
+            raise CommandError('Sai lệch số dư ví')
+        self.stdout.write(self.style.SUCCESS('Số dư và lịch sử giao dịch khớp nhau'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.wallets import SNAPSHOT_EVERY, compact, verify
+
+
+class Command(BaseCommand):
+    help = ('Ghi snapshot số dư cho các ví có nhiều giao dịch sau snapshot gần nhất, để tính số dư từ sổ '
+            'chỉ phải cộng một đoạn ngắn; --verify đối chiếu số dư lưu trong ví với số dư tính từ sổ')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-tail', type=int, default=SNAPSHOT_EVERY,
+                            help='Chỉ ghi snapshot cho ví có từ chừng này giao dịch sau snapshot gần nhất')
+        parser.add_argument('--batch-size', type=int, default=500, help='Số ví mỗi lô')
+        parser.add_argument('--verify', action='store_true', help='Đối chiếu số dư sau khi ghi snapshot')
+
+    def handle(self, *args, **options):
+        if options['min_tail'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--min-tail và --batch-size phải >= 1')
+        written = compact(min_tail=options['min_tail'], batch_size=options['batch_size'])
+        self.stdout.write(f'Đã ghi {written} snapshot')
+        if not options['verify']:
+            return
+        drift = verify()
+        for wallet_id, stored, computed in drift:
+            self.stdout.write(f'Ví {wallet_id}: lưu {stored}, tính từ sổ {computed}')
+        if drift:
+            raise CommandError(f'{len(drift)} ví lệch số dư so với sổ giao dịch')
+        self.stdout.write(self.style.SUCCESS('Số dư các ví khớp sổ giao dịch'))
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import fake_stripe
+
+
+class Command(BaseCommand):
+    help = ('Chạy server Stripe giả (payment intent + webhook có chữ ký) để thử luồng thanh toán không cần mạng. '
+            'Chạy ứng dụng với STRIPE_API_BASE trỏ tới server này và cùng STRIPE_WEBHOOK_SECRET.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--webhook-url', default='http://127.0.0.1:8000/api/stripe/webhook/',
+                            help='Địa chỉ webhook của ứng dụng')
+        parser.add_argument('--secret', default=None, help='Webhook secret (mặc định STRIPE_WEBHOOK_SECRET)')
+        parser.add_argument('--duplicates', type=int, default=0, help='Số lần gửi lặp lại mỗi sự kiện')
+        parser.add_argument('--latency', type=float, default=0.0, help='Độ trễ giả lập mỗi request API (giây)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Tỉ lệ request API trả lỗi 500 (0..1)')
+
+    def handle(self, *args, **options):
+        secret = options['secret'] or settings.STRIPE_WEBHOOK_SECRET or 'whsec_fake'
+        server = fake_stripe.make_server(
+            options['host'], options['port'], secret,
+            fake_stripe.http_delivery(options['webhook_url']), options['duplicates'],
+            options['latency'], options['error_rate'],
+        )
+        self.stdout.write(f'Stripe giả tại {fake_stripe.url(server)}, webhook → {options["webhook_url"]}')
+        self.stdout.write(f'STRIPE_API_BASE={fake_stripe.url(server)} STRIPE_WEBHOOK_SECRET={secret}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from api.storage import collect_garbage, recount_references
+from api.uploads import expire_uploads
+
+
+class Command(BaseCommand):
+    help = 'Dọn các file media (blob) không còn được sản phẩm/biến thể/brand/category/đơn hàng nào dùng'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true', help='Tính lại số tham chiếu từ dữ liệu trước khi dọn')
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Chỉ xóa blob upload lâu hơn số giờ này (ảnh vừa upload chưa kịp gắn vào sản phẩm)')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            expired = expire_uploads()
+            self.stdout.write(f'Đã xóa {expired} phiên upload dở dang đã hết hạn')
+
+        if options['recount']:
+            changed = recount_references()
+            self.stdout.write(f'Đã cập nhật số tham chiếu của {changed} blob')
+
+        removed = collect_garbage(grace=timedelta(hours=options['grace_hours']), dry_run=options['dry_run'])
+        for name in removed:
+            self.stdout.write(name)
+        action = 'Sẽ xóa' if options['dry_run'] else 'Đã xóa'
+        self.stdout.write(self.style.SUCCESS(f'{action} {len(removed)} blob không còn được dùng'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.catalog_import import CatalogImporter, CatalogImportError
+
+
+class Command(BaseCommand):
+    help = 'Import sản phẩm, biến thể, brand, category từ file CSV hoặc NDJSON theo từng lô'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Mặc định đoán theo phần mở rộng của file')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--resume', action='store_true', help='Chạy tiếp từ lô cuối cùng đã commit')
+        parser.add_argument('--state-file', help='Mặc định <path>.import-state')
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(batch_size=options['batch_size'], log=self.stdout.write)
+        try:
+            stats = importer.run(
+                options['path'], fmt=options['format'], resume=options['resume'], state_path=options['state_file'],
+            )
+        except (CatalogImportError, OSError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã import {stats['records']} dòng: "
+            f"{stats['products_created']} sản phẩm mới, {stats['products_updated']} sản phẩm cập nhật, "
+            f"{stats['variants_created']} biến thể mới, {stats['variants_updated']} biến thể cập nhật, "
+            f"{stats['errors']} lỗi"
+        ))
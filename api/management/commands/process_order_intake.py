@@ -0,0 +1,46 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.order_intake import BATCH_SIZE, run_worker
+
+
+def _work(options):
+    run_worker(batch_size=options['batch_size'], idle_sleep=options['idle_sleep'], once=options['once'])
+
+
+class Command(BaseCommand):
+    help = ('Tạo đơn từ hàng đợi OrderIntake (ORDER_INTAKE_ASYNC). Số process quyết định số đơn '
+            'được ghi đồng thời; chạy liên tục, --once thì dừng khi hàng đợi trống.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Số process worker')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Số dòng mỗi lần nhận')
+        parser.add_argument('--idle-sleep', type=float, default=0.5, help='Thời gian chờ khi hàng đợi trống (giây)')
+        parser.add_argument('--once', action='store_true', help='Dừng khi hàng đợi trống')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--processes và --batch-size phải >= 1')
+        if options['processes'] == 1:
+            total = run_worker(batch_size=options['batch_size'], idle_sleep=options['idle_sleep'],
+                               once=options['once'])
+            self.stdout.write(self.style.SUCCESS(f'Đã xử lý {total} yêu cầu đặt hàng'))
+            return
+
+        # Process con không được dùng chung kết nối DB của process cha
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=_work, args=(options,), daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+        self.stdout.write(self.style.SUCCESS('Các worker đã dừng'))
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from api.idempotency import KEY_TTL, purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Xóa các Idempotency-Key đã hết hạn (chạy định kỳ, ví dụ mỗi giờ)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=KEY_TTL.total_seconds() / 3600,
+                            help='Xóa key cũ hơn số giờ này')
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f'Đã xóa {deleted} idempotency key'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Xây lại bảng tổng hợp sản phẩm (giá, tồn kho, màu/size, đánh giá)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = rebuild_summaries(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Đã cập nhật tổng hợp cho {total} sản phẩm')
+        )
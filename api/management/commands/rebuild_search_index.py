@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Xây lại toàn bộ chỉ mục tìm kiếm sản phẩm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Đã đánh chỉ mục {total} sản phẩm')
+        )
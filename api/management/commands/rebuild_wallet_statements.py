@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import PayboxWallet
+from api.wallets import rebuild_monthly_summaries
+
+
+class Command(BaseCommand):
+    help = 'Tính lại sao kê tháng của các ví Paybox từ sổ giao dịch, theo lô ví'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallet', type=int, action='append', dest='wallet_ids',
+                            help='Chỉ tính lại ví này (có thể lặp lại)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Số ví mỗi lô')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size phải >= 1')
+        wallet_ids = options['wallet_ids']
+        if wallet_ids is None:
+            wallet_ids = list(PayboxWallet.objects.order_by('id').values_list('id', flat=True))
+        written = 0
+        for start in range(0, len(wallet_ids), options['batch_size']):
+            written += rebuild_monthly_summaries(wallet_ids[start:start + options['batch_size']])
+        self.stdout.write(self.style.SUCCESS(f'Đã ghi {written} dòng sao kê tháng cho {len(wallet_ids)} ví'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Trả hàng của các lượt giữ hàng đã hết hạn về kho (chạy định kỳ, ví dụ mỗi phút)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Đã trả lại kho {total} lượt giữ hàng hết hạn')
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.flash_sale import end_sale, reconcile_sale, start_sale
+from api.models import FlashSale
+
+
+class Command(BaseCommand):
+    help = ('Bắt đầu các flash sale đã tới giờ (chuyển tồn kho vào bộ đếm) và đối soát các flash sale '
+            'đã kết thúc (trả hàng chưa bán về kho). Chạy định kỳ, ví dụ mỗi phút.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--end', type=int, metavar='SALE_ID', help='Dừng nhận đơn của một flash sale ngay')
+        parser.add_argument('--force', action='store_true', help='Đối soát không chờ hết thời gian ân hạn')
+
+    def handle(self, *args, **options):
+        if options['end']:
+            end_sale(options['end'])
+            self.stdout.write(f'Đã dừng nhận đơn flash sale #{options["end"]}')
+
+        now = timezone.now()
+        for sale_id in FlashSale.objects.filter(status=FlashSale.SCHEDULED, starts_at__lte=now, ends_at__gt=now).values_list('id', flat=True):
+            sale = start_sale(sale_id)
+            self.stdout.write(f'Bắt đầu flash sale #{sale.id}: {sale.allocation}')
+
+        for sale_id in FlashSale.objects.filter(status=FlashSale.RUNNING, ends_at__lte=now).values_list('id', flat=True):
+            report = reconcile_sale(sale_id, force=options['force'])
+            if report is None:
+                continue
+            for label, row in report.items():
+                line = f'#{sale_id} {label}: ' + ', '.join(f'{name}={value}' for name, value in row.items())
+                expected = row['allocated'] - row['sold']
+                if row['counter'] is not None and row['counter'] != expected:
+                    self.stdout.write(self.style.WARNING(line + f' (bộ đếm lệch {row["counter"] - expected})'))
+                else:
+                    self.stdout.write(line)
+            self.stdout.write(self.style.SUCCESS(f'Đã đối soát flash sale #{sale_id}'))
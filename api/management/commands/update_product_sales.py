@@ -1,32 +1,25 @@
 from django.core.management.base import BaseCommand
-from api.models import Product, OrderItem, Order
-from django.db.models import Sum, F, Q
+from django.utils import timezone
+
+from api.sales import WATERMARK, rebuild_total_sold, set_watermark, sync_total_sold
+
 
 class Command(BaseCommand):
-    help = 'Update total_sold field for all products based on order history'
+    help = ('Tính lại total_sold của sản phẩm từ các đơn đã thanh toán. Mặc định tính lại toàn bộ; '
+            '--incremental chỉ tính các sản phẩm có đơn được thanh toán từ lần chạy trước')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Chỉ xử lý đơn được thanh toán sau mốc của lần chạy trước')
 
     def handle(self, *args, **options):
-        # Lấy tất cả sản phẩm
-        products = Product.objects.all()
-        
-        # Cập nhật từng sản phẩm
-        for product in products:
-            # Tính tổng số lượng đã bán từ các đơn hàng đã thanh toán
-            total_sold = OrderItem.objects.filter(
-                product=product,
-                order__isPaid=True
-            ).aggregate(
-                total=Sum('qty')
-            )['total'] or 0
-            
-            # Cập nhật trường total_sold
-            product.total_sold = total_sold
-            product.save()
-            
-            self.stdout.write(
-                self.style.SUCCESS(f'Updated product "{product.name}" with total_sold={total_sold}')
-            )
-        
-        self.stdout.write(
-            self.style.SUCCESS('Successfully updated total_sold for all products')
-        )
\ No newline at end of file
+        if options['incremental']:
+            changed, watermark = sync_total_sold()
+            self.stdout.write(self.style.SUCCESS(
+                f'Đã cập nhật total_sold cho {changed} sản phẩm (mốc mới {watermark:%Y-%m-%d %H:%M:%S})'
+            ))
+            return
+        started = timezone.now()
+        changed = rebuild_total_sold()
+        set_watermark(WATERMARK, started)
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật total_sold cho {changed} sản phẩm'))
@@ -0,0 +1,31 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.sales_rollups import verify
+
+
+class Command(BaseCommand):
+    help = ('Tính lại tổng hợp doanh số của một khoảng ngày từ dữ liệu gốc và so sánh với bảng tổng hợp; '
+            'báo lỗi nếu có sai lệch (sửa bằng backfill_sales_rollups)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                            help='Ngày bắt đầu (YYYY-MM-DD), mặc định 30 ngày trước')
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, help='Ngày kết thúc, mặc định hôm nay')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        start = options['start'] or end - timedelta(days=30)
+        if start > end:
+            raise CommandError('Ngày bắt đầu sau ngày kết thúc')
+        diffs = verify(start, end)
+        for diff in diffs:
+            self.stdout.write(
+                f'{diff["day"]} {diff["dimension"]}:{diff["key"] or "-"} {diff["metric"]}: '
+                f'lưu {diff["stored"]}, tính lại {diff["expected"]}'
+            )
+        if diffs:
+            raise CommandError(f'{len(diffs)} sai lệch trong khoảng {start} → {end}')
+        self.stdout.write(self.style.SUCCESS(f'Tổng hợp khớp dữ liệu gốc ({start} → {end})'))
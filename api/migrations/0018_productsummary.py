@@ -0,0 +1,32 @@
+# Generated by Django 3.2.19 on 2026-10-17 20:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_productsearchterm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='api.product')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=0, max_digits=12, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=0, max_digits=12, null=True)),
+                ('total_stock', models.IntegerField(default=0)),
+                ('color_ids', models.JSONField(blank=True, default=list)),
+                ('size_ids', models.JSONField(blank=True, default=list)),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_avg', models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Tổng hợp sản phẩm',
+                'verbose_name_plural': 'Tổng hợp sản phẩm',
+            },
+        ),
+    ]
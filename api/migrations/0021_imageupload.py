@@ -0,0 +1,34 @@
+# Generated by Django 3.2.19 on 2026-10-17 20:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0020_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(help_text='Kích thước file khai báo khi bắt đầu upload')),
+                ('received', models.BigIntegerField(default=0, help_text='Số byte đã nhận (offset của phần tiếp theo)')),
+                ('blob', models.CharField(blank=True, help_text='Tên file sau khi hoàn tất', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Phiên upload ảnh',
+                'verbose_name_plural': 'Phiên upload ảnh',
+            },
+        ),
+    ]
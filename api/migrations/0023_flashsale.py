@@ -0,0 +1,36 @@
+# Generated by Django 3.2.19 on 2026-10-17 20:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlashSale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('scheduled', 'Chưa bắt đầu'), ('running', 'Đang diễn ra'), ('reconciled', 'Đã đối soát')], db_index=True, default='scheduled', max_length=20)),
+                ('allocation', models.JSONField(blank=True, default=dict, help_text='Số lượng chuyển vào bộ đếm theo dòng tồn kho')),
+                ('sold', models.JSONField(blank=True, default=dict, help_text='Số lượng đã bán theo dòng tồn kho (khi đối soát)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flash_sales', to='api.product')),
+            ],
+            options={
+                'verbose_name': 'Flash sale',
+                'verbose_name_plural': 'Flash sale',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='flash_sale',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='api.flashsale'),
+        ),
+    ]
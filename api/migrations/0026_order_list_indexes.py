@@ -0,0 +1,33 @@
+# Generated by Django 3.2.19 on 2026-10-17 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_orderintake'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-createdAt', '-id'], name='api_order_user_id_90c286_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['isPaid', '-createdAt', '-id'], name='api_order_isPaid_49a7b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['isDelivered', '-createdAt', '-id'], name='api_order_isDeliv_1d5ad2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['isRefunded', '-createdAt', '-id'], name='api_order_isRefun_6401d2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-createdAt', '-id'], name='api_order_created_bfc335_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.19 on 2026-10-17 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_sales_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('total', 'Tổng'), ('category', 'Danh mục'), ('brand', 'Thương hiệu'), ('payment_method', 'Phương thức thanh toán')], max_length=20)),
+                ('key', models.CharField(blank=True, max_length=255)),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=16)),
+                ('refunded_orders', models.IntegerField(default=0)),
+                ('refunded_units', models.IntegerField(default=0)),
+                ('refunded_revenue', models.DecimalField(decimal_places=0, default=0, max_digits=16)),
+            ],
+            options={
+                'verbose_name': 'Tổng hợp doanh số',
+                'verbose_name_plural': 'Tổng hợp doanh số',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollup',
+            constraint=models.UniqueConstraint(fields=('dimension', 'day', 'key'), name='unique_sales_rollup'),
+        ),
+    ]
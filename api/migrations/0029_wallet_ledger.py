@@ -0,0 +1,70 @@
+# Generated by Django 3.2.19 on 2026-10-17 20:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def number_transactions(apps, schema_editor):
+    """Đánh số thứ tự giao dịch có sẵn theo thời gian; phần số dư không khớp với giao dịch thành snapshot đầu"""
+    PayboxWallet = apps.get_model('api', 'PayboxWallet')
+    PayboxTransaction = apps.get_model('api', 'PayboxTransaction')
+    WalletSnapshot = apps.get_model('api', 'WalletSnapshot')
+    for wallet in PayboxWallet.objects.all().iterator():
+        transactions = list(PayboxTransaction.objects.filter(wallet=wallet).order_by('created_at', 'id'))
+        total = 0
+        for sequence, item in enumerate(transactions, start=1):
+            item.sequence = sequence
+            total += item.balance_after - item.balance_before
+        PayboxTransaction.objects.bulk_update(transactions, ['sequence'], batch_size=500)
+        PayboxWallet.objects.filter(id=wallet.id).update(last_sequence=len(transactions))
+        if wallet.balance != total:
+            WalletSnapshot.objects.create(wallet=wallet, sequence=0, balance=wallet.balance - total,
+                                          as_of=wallet.created_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_salesrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.BigIntegerField()),
+                ('balance', models.DecimalField(decimal_places=0, max_digits=14)),
+                ('as_of', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='payboxtransaction',
+            name='sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payboxwallet',
+            name='last_sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='walletsnapshot',
+            name='wallet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='api.payboxwallet'),
+        ),
+        migrations.RunPython(number_transactions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='payboxtransaction',
+            constraint=models.UniqueConstraint(fields=('wallet', 'sequence'), name='unique_wallet_sequence'),
+        ),
+        migrations.AddIndex(
+            model_name='walletsnapshot',
+            index=models.Index(fields=['wallet', 'as_of'], name='api_wallets_wallet__530944_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='walletsnapshot',
+            constraint=models.UniqueConstraint(fields=('wallet', 'sequence'), name='unique_wallet_snapshot'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.19 on 2026-10-17 20:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+TYPE_TOTALS = {'DEPOSIT': 'deposits', 'PAYMENT': 'payments', 'REFUND': 'refunds', 'TRANSFER': 'transfers'}
+
+
+def build_summaries(apps, schema_editor):
+    """Sao kê tháng cho các giao dịch có sẵn (tương đương lệnh rebuild_wallet_statements)"""
+    PayboxTransaction = apps.get_model('api', 'PayboxTransaction')
+    WalletMonthlySummary = apps.get_model('api', 'WalletMonthlySummary')
+    summaries = {}
+    rows = PayboxTransaction.objects.order_by('wallet_id', 'sequence').values_list(
+        'wallet_id', 'created_at', 'transaction_type', 'amount', 'balance_before', 'balance_after')
+    for wallet_id, created_at, transaction_type, amount, before, after in rows.iterator():
+        key = (wallet_id, timezone.localdate(created_at).replace(day=1))
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = WalletMonthlySummary(
+                wallet_id=wallet_id, month=key[1], opening_balance=before, transaction_count=0)
+        summary.closing_balance = after
+        summary.transaction_count += 1
+        total = TYPE_TOTALS[transaction_type]
+        setattr(summary, total, getattr(summary, total) + amount)
+    WalletMonthlySummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_wallet_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletMonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=0, max_digits=14)),
+                ('closing_balance', models.DecimalField(decimal_places=0, max_digits=14)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('deposits', models.DecimalField(decimal_places=0, default=0, max_digits=14)),
+                ('payments', models.DecimalField(decimal_places=0, default=0, max_digits=14)),
+                ('refunds', models.DecimalField(decimal_places=0, default=0, max_digits=14)),
+                ('transfers', models.DecimalField(decimal_places=0, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='payboxtransaction',
+            index=models.Index(fields=['wallet', '-created_at', '-id'], name='api_payboxt_wallet__ddd2ae_idx'),
+        ),
+        migrations.AddField(
+            model_name='walletmonthlysummary',
+            name='wallet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_summaries', to='api.payboxwallet'),
+        ),
+        migrations.AddConstraint(
+            model_name='walletmonthlysummary',
+            constraint=models.UniqueConstraint(fields=('wallet', 'month'), name='unique_wallet_month'),
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -5,6 +5,7 @@ from django.core.validators import MaxValueValidator
 from decimal import Decimal
 from django.utils import timezone
 import logging;
+import uuid
 from django.contrib.auth.models import User
 # Create your models here.
 import logging
@@ -56,6 +57,19 @@ class Size(models.Model):
         ordering = ['order', 'name']
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_stock_summary(self):
+        """Đọc giá thấp nhất, tổng tồn kho... từ bảng ProductSummary (một JOIN) thay vì tổng hợp biến thể"""
+        return self.select_related('summary')
+
+    def with_related(self):
+        """Prefetch biến thể (kèm màu, size) và đánh giá (kèm người dùng)"""
+        return self.prefetch_related(
+            models.Prefetch('variants', queryset=ProductVariant.objects.select_related('color', 'size')),
+            models.Prefetch('review_set', queryset=Review.objects.select_related('user')),
+        )
+
+
 class Product(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     name = models.CharField(max_length=200, null=True, blank=True)
@@ -72,18 +86,34 @@ class Product(models.Model):
 
     # Thêm trường để xác định sản phẩm có biến thể hay không
     has_variants = models.BooleanField(default=False, help_text="Sản phẩm có biến thể màu sắc/size")
+    # Mã sản phẩm ở hệ thống nguồn, dùng làm khóa khi import catalog
+    external_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def get_summary(self):
+        try:
+            return self.summary
+        except ProductSummary.DoesNotExist:
+            return None
+
     def get_total_stock(self):
         """Tính tổng số lượng tồn kho từ tất cả biến thể"""
+        summary = self.get_summary()
+        if summary is not None:
+            return summary.total_stock
         if self.has_variants:
             return self.variants.aggregate(total=models.Sum('stock_quantity'))['total'] or 0
         return self.countInStock
 
     def get_min_price(self):
         """Lấy giá thấp nhất từ các biến thể"""
+        summary = self.get_summary()
+        if summary is not None:
+            return summary.min_price
         if self.has_variants:
             min_price = self.variants.aggregate(min_price=models.Min('price'))['min_price']
             return min_price if min_price is not None else self.price
@@ -105,15 +135,140 @@ class ProductVariant(models.Model):
     def save(self, *args, **kwargs):
         # Tự động tạo SKU nếu chưa có
         if not self.sku:
-            self.sku = f"{self.product.id}-{self.color.name}-{self.size.name}".upper().replace(' ', '-')
+            self.sku = self.make_sku(self.product_id, self.color.name, self.size.name)
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def make_sku(product_id, color_name, size_name):
+        return f"{product_id}-{color_name}-{size_name}".upper().replace(' ', '-')
+
     class Meta:
         unique_together = ('product', 'color', 'size')
         verbose_name = "Biến thể sản phẩm"
         verbose_name_plural = "Biến thể sản phẩm"
 
 
+class ProductSummary(models.Model):
+    """Bảng đọc (denormalized) cho mỗi sản phẩm, được cập nhật khi Product/ProductVariant/Review thay đổi"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    min_price = models.DecimalField(max_digits=12, decimal_places=0, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=12, decimal_places=0, null=True, blank=True)
+    total_stock = models.IntegerField(default=0)
+    color_ids = models.JSONField(default=list, blank=True)
+    size_ids = models.JSONField(default=list, blank=True)
+    review_count = models.IntegerField(default=0)
+    rating_avg = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary #{self.product_id}"
+
+    class Meta:
+        verbose_name = "Tổng hợp sản phẩm"
+        verbose_name_plural = "Tổng hợp sản phẩm"
+
+
+class MediaBlob(models.Model):
+    """
+    Một file media lưu theo hash nội dung (xem api.storage.ContentAddressedStorage).
+    ref_count là số dòng (sản phẩm, biến thể, brand, category, order item) đang trỏ tới file.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    # Lần upload gần nhất: blob chưa được dùng chỉ bị dọn sau một khoảng chờ kể từ thời điểm này
+    uploaded_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "File media"
+        verbose_name_plural = "File media"
+
+
+class ImageUpload(models.Model):
+    """Phiên upload ảnh theo từng phần (api.uploads): các phần được ghi nối tiếp vào file tạm"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField(help_text="Kích thước file khai báo khi bắt đầu upload")
+    received = models.BigIntegerField(default=0, help_text="Số byte đã nhận (offset của phần tiếp theo)")
+    blob = models.CharField(max_length=255, blank=True, help_text="Tên file sau khi hoàn tất")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+    class Meta:
+        verbose_name = "Phiên upload ảnh"
+        verbose_name_plural = "Phiên upload ảnh"
+
+
+class StockReservation(models.Model):
+    """
+    Hàng đang được giữ cho giỏ hàng của một user (api.reservations). Số lượng giữ đã được trừ
+    khỏi stock_quantity/countInStock; hết hạn thì được trả lại kho.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, null=True, blank=True)
+    qty = models.IntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.product_id}/{self.product_variant_id} x{self.qty}"
+
+    class Meta:
+        verbose_name = "Giữ hàng"
+        verbose_name_plural = "Giữ hàng"
+
+
+class IdempotencyKey(models.Model):
+    """Phản hồi đã lưu của một request có header Idempotency-Key (api.idempotency)"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 của method, đường dẫn và body")
+    response_status = models.IntegerField(null=True, blank=True, help_text="Trống khi request đầu tiên đang xử lý")
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.key}"
+
+    class Meta:
+        unique_together = ('user', 'key')
+        verbose_name = "Idempotency key"
+        verbose_name_plural = "Idempotency key"
+
+
+class Watermark(models.Model):
+    """Mốc thời gian đã xử lý tới của một tác vụ chạy định kỳ theo kiểu tăng dần (ví dụ update_product_sales)"""
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class ProductSearchTerm(models.Model):
+    """Một dòng của chỉ mục tìm kiếm: từ (đã bỏ dấu) xuất hiện trong sản phẩm kèm trọng số"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64, db_index=True)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.term} -> {self.product_id}"
+
+    class Meta:
+        unique_together = ('product', 'term')
+
+
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
@@ -143,6 +298,36 @@ class Coupon(models.Model):
     def __str__(self):
         return f"{self.code} - {self.discount_amount} VND"
 
+class FlashSale(models.Model):
+    """
+    Đợt flash sale của một sản phẩm (api.flash_sale). Khi bắt đầu, tồn kho được chuyển vào bộ đếm
+    trong cache (allocation) và trả phần chưa bán về DB khi đối soát lúc kết thúc.
+    """
+    SCHEDULED = 'scheduled'
+    RUNNING = 'running'
+    RECONCILED = 'reconciled'
+    STATUS_CHOICES = (
+        (SCHEDULED, 'Chưa bắt đầu'),
+        (RUNNING, 'Đang diễn ra'),
+        (RECONCILED, 'Đã đối soát'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='flash_sales')
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=SCHEDULED, db_index=True)
+    allocation = models.JSONField(default=dict, blank=True, help_text="Số lượng chuyển vào bộ đếm theo dòng tồn kho")
+    sold = models.JSONField(default=dict, blank=True, help_text="Số lượng đã bán theo dòng tồn kho (khi đối soát)")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Flash sale #{self.id} - {self.product_id}"
+
+    class Meta:
+        verbose_name = "Flash sale"
+        verbose_name_plural = "Flash sale"
+
+
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     taxPrice = models.DecimalField(max_digits=12, decimal_places=0)
@@ -158,6 +343,7 @@ class Order(models.Model):
         auto_now_add=False, null=True, blank=True)
     coupon = models.ForeignKey(
         Coupon, null=True, blank=True, on_delete=models.SET_NULL)
+    flash_sale = models.ForeignKey(FlashSale, null=True, blank=True, on_delete=models.SET_NULL, related_name='orders')
     # deliveredAt = models.DateTimeField(auto_now_add=False, null=True, blank=True)
 
     def __str__(self) -> str:
@@ -165,6 +351,15 @@ class Order(models.Model):
 
     class Meta:
         ordering = ('-createdAt',)
+        # Khớp với bộ lọc và thứ tự (-createdAt, -id) của danh sách đơn hàng
+        indexes = [
+            models.Index(fields=['user', '-createdAt', '-id']),
+            models.Index(fields=['isPaid', '-createdAt', '-id']),
+            models.Index(fields=['isDelivered', '-createdAt', '-id']),
+            models.Index(fields=['isRefunded', '-createdAt', '-id']),
+            models.Index(fields=['-createdAt', '-id']),
+            models.Index(fields=['paidAt']),
+        ]
 
 
 class OrderItem(models.Model):
@@ -190,6 +385,110 @@ class OrderItem(models.Model):
 
 
 
+class OrderIntake(models.Model):
+    """
+    Hàng đợi đơn hàng nhận bất đồng bộ (api.order_intake): placeOrder lưu dữ liệu checkout và trả
+    về id làm vé, worker process_order_intake tạo đơn và ghi kết quả vào đây.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Đang chờ'),
+        (PROCESSING, 'Đang xử lý'),
+        (DONE, 'Đã tạo đơn'),
+        (FAILED, 'Thất bại'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+        verbose_name = "Đơn chờ xử lý"
+        verbose_name_plural = "Đơn chờ xử lý"
+
+
+class StripeEvent(models.Model):
+    """Sự kiện webhook Stripe đã nhận (api.stripe_events); id là id sự kiện của Stripe nên nhận trùng không tạo dòng mới"""
+    PENDING = 'pending'
+    APPLIED = 'applied'
+    IGNORED = 'ignored'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Đang chờ'),
+        (APPLIED, 'Đã áp dụng'),
+        (IGNORED, 'Bỏ qua'),
+        (FAILED, 'Thất bại'),
+    )
+
+    id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=100)
+    payment_intent_id = models.CharField(max_length=255, blank=True, db_index=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    applied_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id} {self.type} ({self.status})"
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+
+class SalesRollup(models.Model):
+    """
+    Doanh thu, số đơn và số lượng bán theo ngày thanh toán và theo một chiều (tổng, danh mục,
+    thương hiệu, phương thức thanh toán), cập nhật khi đơn được thanh toán/hoàn tiền (api.sales_rollups)
+    """
+    TOTAL = 'total'
+    CATEGORY = 'category'
+    BRAND = 'brand'
+    PAYMENT_METHOD = 'payment_method'
+    DIMENSION_CHOICES = (
+        (TOTAL, 'Tổng'),
+        (CATEGORY, 'Danh mục'),
+        (BRAND, 'Thương hiệu'),
+        (PAYMENT_METHOD, 'Phương thức thanh toán'),
+    )
+
+    day = models.DateField()
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    # id danh mục/thương hiệu, tên phương thức thanh toán; rỗng với chiều tổng
+    key = models.CharField(max_length=255, blank=True)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=0, default=0)
+    refunded_orders = models.IntegerField(default=0)
+    refunded_units = models.IntegerField(default=0)
+    refunded_revenue = models.DecimalField(max_digits=16, decimal_places=0, default=0)
+
+    def __str__(self):
+        return f"{self.day} {self.dimension}:{self.key}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'day', 'key'], name='unique_sales_rollup'),
+        ]
+        verbose_name = "Tổng hợp doanh số"
+        verbose_name_plural = "Tổng hợp doanh số"
+
+
 class ShippingAddress(models.Model):
     order = models.OneToOneField(Order, on_delete=models.CASCADE, null=True, blank=False, related_name='shippingAddress')
     address = models.CharField(max_length=255, null=True, blank=True)
@@ -204,6 +503,8 @@ class ShippingAddress(models.Model):
 class PayboxWallet(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='paybox_wallet')
     balance = models.DecimalField(max_digits=12, decimal_places=0, default=0, help_text="Số dư ví tính bằng VND")
+    # Số thứ tự của giao dịch gần nhất, tăng cùng UPDATE số dư (api.wallets)
+    last_sequence = models.BigIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -211,20 +512,6 @@ class PayboxWallet(models.Model):
     def __str__(self):
         return f"Paybox - {self.user.username}: {self.balance:,.0f} VND"
 
-    def add_balance(self, amount):
-        if amount > 0:
-            self.balance += Decimal(str(amount))
-            self.save()
-            return True
-        return False
-
-    def deduct_balance(self, amount):
-        if amount > 0 and self.balance >= Decimal(str(amount)):
-            self.balance -= Decimal(str(amount))
-            self.save()
-            return True
-        return False
-
     def has_sufficient_balance(self, amount):
         return self.balance >= Decimal(str(amount))
 
@@ -249,6 +536,8 @@ class PayboxTransaction(models.Model):
     ]
 
     wallet = models.ForeignKey(PayboxWallet, on_delete=models.CASCADE, related_name='transactions')
+    # Số thứ tự trong ví, liên tục từ 1
+    sequence = models.BigIntegerField(default=0)
     transaction_type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
     amount = models.DecimalField(max_digits=12, decimal_places=0, help_text="Số tiền giao dịch tính bằng VND")
     status = models.CharField(max_length=20, choices=TRANSACTION_STATUS, default='PENDING')
@@ -263,10 +552,63 @@ class PayboxTransaction(models.Model):
     def __str__(self):
         return f"{self.wallet.user.username} - {self.get_transaction_type_display()}: {self.amount:,.0f} VND"
 
+    def save(self, *args, **kwargs):
+        # Sổ giao dịch chỉ được ghi thêm: số dư được tính lại từ các dòng này
+        if not self._state.adding:
+            raise ValueError('PayboxTransaction không được sửa sau khi ghi')
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Paybox Transaction"
         verbose_name_plural = "Paybox Transactions"
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'sequence'], name='unique_wallet_sequence'),
+        ]
+        # Sao kê theo ví, phân trang theo con trỏ (created_at, id)
+        indexes = [models.Index(fields=['wallet', '-created_at', '-id'])]
+
+
+class WalletSnapshot(models.Model):
+    """Số dư của ví sau giao dịch thứ sequence; số dư tại một thời điểm = snapshot gần nhất + các giao dịch sau nó"""
+    wallet = models.ForeignKey(PayboxWallet, on_delete=models.CASCADE, related_name='snapshots')
+    sequence = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=14, decimal_places=0)
+    # Thời điểm của giao dịch thứ sequence
+    as_of = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.wallet_id}#{self.sequence}: {self.balance}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'sequence'], name='unique_wallet_snapshot'),
+        ]
+        indexes = [models.Index(fields=['wallet', 'as_of'])]
+
+
+class WalletMonthlySummary(models.Model):
+    """Tổng hợp giao dịch của ví theo tháng, cập nhật cùng giao dịch (api.wallets) để sao kê tháng không phải quét sổ"""
+    wallet = models.ForeignKey(PayboxWallet, on_delete=models.CASCADE, related_name='monthly_summaries')
+    # Ngày đầu tháng (theo TIME_ZONE)
+    month = models.DateField()
+    opening_balance = models.DecimalField(max_digits=14, decimal_places=0)
+    closing_balance = models.DecimalField(max_digits=14, decimal_places=0)
+    transaction_count = models.PositiveIntegerField(default=0)
+    deposits = models.DecimalField(max_digits=14, decimal_places=0, default=0)
+    payments = models.DecimalField(max_digits=14, decimal_places=0, default=0)
+    refunds = models.DecimalField(max_digits=14, decimal_places=0, default=0)
+    transfers = models.DecimalField(max_digits=14, decimal_places=0, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.wallet_id} {self.month:%Y-%m}: {self.opening_balance} → {self.closing_balance}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'month'], name='unique_wallet_month'),
+        ]
 
 
 class RefundRequest(models.Model):
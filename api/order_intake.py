@@ -0,0 +1,174 @@
+"""
+Nhận đơn hàng bất đồng bộ khi lượng checkout vượt quá khả năng ghi của DB.
+
+placeOrder (khi ORDER_INTAKE_ASYNC bật) chỉ kiểm tra cấu trúc dữ liệu rồi lưu vào bảng
+OrderIntake và trả về 202 kèm vé (id của dòng). Các worker (lệnh process_order_intake) lấy
+từng lô dòng đang chờ bằng SELECT ... FOR UPDATE SKIP LOCKED và tạo đơn bằng place_order, nên
+số đơn được ghi đồng thời bị giới hạn bởi số worker thay vì số request. Đơn và trạng thái của
+dòng được ghi trong cùng transaction: một dòng không thể tạo ra hai đơn kể cả khi worker chết
+giữa chừng. Client hỏi trạng thái qua API hoặc nhận thông báo qua websocket.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api.models import OrderIntake
+from api.orders import OrderError, place_order, validate_checkout
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'ORDER_INTAKE_BATCH_SIZE', 50)
+# Dòng đang xử lý quá khoảng này coi như worker đã chết, worker khác được lấy lại
+CLAIM_TIMEOUT = timedelta(seconds=getattr(settings, 'ORDER_INTAKE_CLAIM_SECONDS', 300))
+# Số lần thử khi gặp lỗi không phải OrderError (mất kết nối DB, deadlock...)
+MAX_ATTEMPTS = 3
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def group_name(ticket):
+    return f'order_intake_{ticket}'
+
+
+def enqueue(user, data):
+    """Kiểm tra dữ liệu checkout (ném OrderError) và đưa vào hàng đợi, trả về dòng OrderIntake"""
+    validate_checkout(data)
+    return OrderIntake.objects.create(user=user, payload=data)
+
+
+def claim_batch(worker, batch_size=BATCH_SIZE):
+    """Nhận tối đa batch_size dòng đang chờ (cũ nhất trước) cho worker"""
+    now = timezone.now()
+    with transaction.atomic():
+        intakes = list(
+            OrderIntake.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=OrderIntake.PENDING)
+                    | Q(status=OrderIntake.PROCESSING, claimed_at__lt=now - CLAIM_TIMEOUT))
+            .order_by('created_at')[:batch_size]
+        )
+        if not intakes:
+            return []
+        OrderIntake.objects.filter(id__in=[intake.id for intake in intakes]).update(
+            status=OrderIntake.PROCESSING, claimed_by=worker, claimed_at=now, attempts=F('attempts') + 1,
+        )
+    # Đọc user riêng (không JOIN trong SELECT ... FOR UPDATE)
+    users = User.objects.in_bulk({intake.user_id for intake in intakes})
+    for intake in intakes:
+        intake.user = users[intake.user_id]
+        intake.status = OrderIntake.PROCESSING
+        intake.claimed_by = worker
+        intake.claimed_at = now
+        intake.attempts += 1
+    return intakes
+
+
+def _finish(intake, **fields):
+    """Cập nhật kết quả nếu dòng vẫn thuộc worker này; trả về False nếu đã bị worker khác lấy lại"""
+    fields['finished_at'] = timezone.now()
+    updated = OrderIntake.objects.filter(
+        id=intake.id, status=OrderIntake.PROCESSING, claimed_by=intake.claimed_by, claimed_at=intake.claimed_at,
+    ).update(**fields)
+    if updated:
+        for name, value in fields.items():
+            setattr(intake, name, value)
+    return bool(updated)
+
+
+def process(intake):
+    """Tạo đơn cho một dòng đã nhận; trả về trạng thái mới"""
+    try:
+        with transaction.atomic():
+            order = place_order(intake.user, intake.payload)
+            if not _finish(intake, status=OrderIntake.DONE, order=order, error=''):
+                # Worker khác đã lấy lại dòng: hoàn tác đơn vừa tạo
+                transaction.set_rollback(True)
+                return intake.status
+    except OrderError as exc:
+        _finish(intake, status=OrderIntake.FAILED, error=exc.message)
+    except Exception as exc:
+        logger.exception('Lỗi khi tạo đơn cho %s', intake.id)
+        if intake.attempts >= MAX_ATTEMPTS:
+            _finish(intake, status=OrderIntake.FAILED, error='Không thể tạo đơn hàng, vui lòng thử lại')
+        else:
+            OrderIntake.objects.filter(id=intake.id, claimed_by=intake.claimed_by).update(
+                status=OrderIntake.PENDING, error=str(exc)[:1000],
+            )
+            intake.status = OrderIntake.PENDING
+    notify(intake)
+    return intake.status
+
+
+def process_batch(worker, batch_size=BATCH_SIZE):
+    """Nhận và xử lý một lô, trả về số dòng đã xử lý"""
+    intakes = claim_batch(worker, batch_size)
+    for intake in intakes:
+        try:
+            process(intake)
+        except Exception:
+            # Một dòng lỗi bất ngờ không dừng worker hay bỏ dở phần còn lại của lô;
+            # dòng đó được worker khác lấy lại sau CLAIM_TIMEOUT nếu chưa có kết quả
+            logger.exception('Worker %s không xử lý được dòng %s', worker, intake.id)
+    return len(intakes)
+
+
+def run_worker(batch_size=BATCH_SIZE, idle_sleep=0.5, once=False, worker=None):
+    """Vòng lặp của một worker; once=True thì dừng khi hàng đợi trống. Trả về tổng số dòng đã xử lý"""
+    worker = worker or worker_name()
+    total = 0
+    while True:
+        close_old_connections()
+        try:
+            processed = process_batch(worker, batch_size)
+        except DatabaseError:
+            # Lock wait timeout/mất kết nối khi nhận lô: các dòng chưa bị đổi trạng thái, thử lại sau
+            logger.warning('Worker %s không nhận được lô đơn hàng', worker, exc_info=True)
+            time.sleep(idle_sleep)
+            continue
+        total += processed
+        if not processed:
+            if once:
+                return total
+            time.sleep(idle_sleep)
+
+
+def describe(intake):
+    """Trạng thái trả cho client"""
+    data = {'ticket': str(intake.id), 'status': intake.status}
+    if intake.status == OrderIntake.DONE:
+        data['order_id'] = intake.order_id
+    elif intake.status == OrderIntake.FAILED:
+        data['error'] = intake.error
+    else:
+        # Vị trí gần đúng trong hàng đợi
+        data['position'] = OrderIntake.objects.filter(
+            status=OrderIntake.PENDING, created_at__lt=intake.created_at,
+        ).count()
+    return data
+
+
+def notify(intake):
+    """Gửi trạng thái mới tới websocket đang theo dõi vé; lỗi channel layer không làm hỏng worker"""
+    if intake.status not in (OrderIntake.DONE, OrderIntake.FAILED):
+        return
+    try:
+        # Backend của CHANNEL_LAYERS chưa cài/không kết nối được cũng chỉ được ghi log
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        async_to_sync(channel_layer.group_send)(
+            group_name(intake.id), {'type': 'intake_status', 'data': describe(intake)},
+        )
+    except Exception:
+        logger.warning('Không gửi được trạng thái đơn %s qua channel layer', intake.id, exc_info=True)
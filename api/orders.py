@@ -0,0 +1,307 @@
+"""
+Tạo đơn hàng và trừ tồn kho.
+
+Sản phẩm và biến thể của cả đơn được đọc bằng hai truy vấn. Tồn kho được trừ bằng UPDATE có
+điều kiện (stock >= qty) trên từng dòng, nên hai lượt checkout đồng thời không thể cùng đọc một
+giá trị rồi ghi đè lên nhau; dòng nào không đủ hàng thì cả transaction (đơn, địa chỉ, các dòng
+đã trừ) được hoàn tác. Các dòng tồn kho được cập nhật theo thứ tự khóa cố định để tránh deadlock.
+Hàng đã được giữ cho giỏ hàng (api.reservations) được chuyển thành hàng bán mà không cần
+cập nhật lại dòng tồn kho.
+
+Khi đơn được thanh toán (mark_paid), số đã bán của các sản phẩm được cộng bằng một UPDATE
+với F() và tổng hợp doanh số (api.sales_rollups) được cập nhật; đơn chỉ được đánh dấu và cộng
+một lần dù có nhiều request thanh toán đồng thời.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from api import catalog_cache, sales_rollups, storage
+from api.models import (
+    Coupon, Order, OrderItem, Product, ProductSummary, ProductVariant, ShippingAddress, StockReservation,
+)
+
+
+class OrderError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def _quantity(item):
+    qty = item.get('qty')
+    if isinstance(qty, bool) or not isinstance(qty, int) or qty < 1:
+        raise OrderError('Số lượng sản phẩm không hợp lệ')
+    return qty
+
+
+def apply_coupon(code, total_price):
+    """Trả về (coupon, tổng tiền sau giảm giá)"""
+    if not code:
+        return None, total_price
+    try:
+        coupon = Coupon.objects.get(code=code)
+    except Coupon.DoesNotExist:
+        raise OrderError('Mã giảm giá không tồn tại')
+    if not coupon.is_valid():
+        raise OrderError('Mã giảm giá không hợp lệ hoặc đã hết hạn')
+    if total_price < coupon.min_order_amount:
+        raise OrderError(f'Đơn hàng chưa đạt mức tối thiểu {coupon.min_order_amount} VND')
+    return coupon, max(0, total_price - coupon.discount_amount)
+
+
+def validate_checkout(data):
+    """Kiểm tra cấu trúc dữ liệu checkout mà không truy vấn DB"""
+    if not isinstance(data, dict):
+        raise OrderError('Dữ liệu đơn hàng không hợp lệ')
+    items = data.get('orderItems')
+    if not isinstance(items, list) or not items:
+        raise OrderError('No Order items')
+    for item in items:
+        if not isinstance(item, dict) or item.get('id') is None:
+            raise OrderError('Sản phẩm không tồn tại')
+        _quantity(item)
+    address = data.get('shippingAddress')
+    if not isinstance(address, dict) or not all(
+        address.get(field) for field in ('address', 'city', 'postalCode', 'country')
+    ):
+        raise OrderError('Thiếu địa chỉ giao hàng')
+    if any(data.get(field) is None for field in ('paymentMethod', 'taxPrice', 'shippingPrice', 'totalPrice')):
+        raise OrderError('Thiếu thông tin đơn hàng')
+
+
+def load_items(order_items):
+    """
+    Đọc sản phẩm/biến thể của đơn (2 truy vấn) và trả về danh sách
+    (item, product, variant, qty) theo thứ tự của đơn.
+    """
+    if not order_items:
+        raise OrderError('No Order items')
+    product_ids = {item.get('id') for item in order_items}
+    variant_ids = {item['variant_id'] for item in order_items if item.get('variant_id')}
+    products = Product.objects.in_bulk(product_ids)
+    variants = ProductVariant.objects.select_related('color', 'size').in_bulk(variant_ids) if variant_ids else {}
+
+    lines = []
+    for item in order_items:
+        product = products.get(item.get('id'))
+        if product is None:
+            raise OrderError('Sản phẩm không tồn tại')
+        variant = None
+        if item.get('variant_id'):
+            variant = variants.get(item['variant_id'])
+            if variant is None or variant.product_id != product.id:
+                raise OrderError('Biến thể sản phẩm không tồn tại')
+        lines.append((item, product, variant, _quantity(item)))
+    return lines
+
+
+def _shortage_message(product, variant):
+    if variant is not None:
+        stock = ProductVariant.objects.filter(id=variant.id).values_list('stock_quantity', flat=True).first() or 0
+        return (f'Không đủ hàng cho {product.name} - {variant.color.name} - {variant.size.name}. '
+                f'Chỉ còn {stock} sản phẩm.')
+    stock = Product.objects.filter(id=product.id).values_list('countInStock', flat=True).first() or 0
+    return f'Không đủ hàng cho {product.name}. Chỉ còn {stock} sản phẩm.'
+
+
+def stock_key(product, variant):
+    """Khóa của dòng tồn kho: biến thể, hoặc sản phẩm khi mua không theo biến thể"""
+    return ('variant', variant.id) if variant is not None else ('product', product.id)
+
+
+def reservation_key(reservation):
+    if reservation.product_variant_id:
+        return ('variant', reservation.product_variant_id)
+    return ('product', reservation.product_id)
+
+
+def summary_delta(product, variant, qty):
+    # Tổng tồn kho của sản phẩm có biến thể là tổng tồn kho biến thể (xem build_summaries)
+    return qty if (variant is not None) == bool(product.has_variants) else 0
+
+
+def take_stock(key, qty):
+    """Trừ qty khỏi dòng tồn kho nếu còn đủ (một UPDATE có điều kiện), trả về False nếu không đủ"""
+    kind, pk = key
+    if kind == 'variant':
+        return bool(ProductVariant.objects.filter(id=pk, stock_quantity__gte=qty).update(
+            stock_quantity=F('stock_quantity') - qty
+        ))
+    return bool(Product.objects.filter(id=pk, countInStock__gte=qty).update(
+        countInStock=F('countInStock') - qty
+    ))
+
+
+def return_stock(key, qty):
+    kind, pk = key
+    if kind == 'variant':
+        ProductVariant.objects.filter(id=pk).update(stock_quantity=F('stock_quantity') + qty)
+    else:
+        Product.objects.filter(id=pk).update(countInStock=F('countInStock') + qty)
+
+
+def decrement_stock(lines, user=None):
+    """
+    Trừ tồn kho cho các dòng (gọi trong transaction); gộp các dòng trùng biến thể/sản phẩm.
+    Hàng user đang giữ (StockReservation) đã được trừ khỏi kho nên chỉ cần xóa dòng giữ,
+    phần vượt quá số đang giữ mới phải tranh dòng tồn kho.
+    Ném OrderError nếu một dòng không đủ hàng, trả về {product_id: số lượng trừ khỏi tổng tồn kho}.
+    """
+    demand = Counter()
+    owners = {}
+    for item, product, variant, qty in lines:
+        key = stock_key(product, variant)
+        demand[key] += qty
+        owners[key] = (product, variant)
+
+    held = Counter()
+    if user is not None:
+        reservations = StockReservation.objects.select_for_update().filter(user=user).order_by('id')
+        consumed = []
+        for reservation in reservations:
+            key = reservation_key(reservation)
+            if key in demand:
+                held[key] += reservation.qty
+                consumed.append(reservation.id)
+        if consumed:
+            StockReservation.objects.filter(id__in=consumed).delete()
+
+    sold = Counter()
+    for key in sorted(demand):
+        product, variant = owners[key]
+        missing = demand[key] - held[key]
+        if missing > 0 and not take_stock(key, missing):
+            raise OrderError(_shortage_message(product, variant))
+        if missing < 0:
+            # Giữ nhiều hơn số mua: trả phần dư lại kho
+            return_stock(key, -missing)
+        sold[product.id] += summary_delta(product, variant, missing)
+    return sold
+
+
+def apply_stock_change(sold):
+    """
+    Cập nhật tổng tồn kho trong bảng tổng hợp sau khi trừ (số dương) hoặc trả (số âm)
+    kho bằng UPDATE, vì UPDATE không phát tín hiệu post_save
+    """
+    for product_id in sorted(product_id for product_id in sold if sold[product_id]):
+        ProductSummary.objects.filter(product_id=product_id).update(
+            total_stock=F('total_stock') - sold[product_id]
+        )
+    transaction.on_commit(lambda: _bump_catalog(sold))
+
+
+def _bump_catalog(product_ids):
+    catalog_cache.bump_catalog_version()
+    for product_id in product_ids:
+        catalog_cache.bump_product_version(product_id)
+
+
+def build_shipping_address(order, address):
+    return ShippingAddress(
+        order=order,
+        address=address['address'],
+        city=address['city'],
+        postalCode=address['postalCode'],
+        country=address['country'],
+    )
+
+
+def build_order_items(order, lines):
+    return [
+        OrderItem(
+            product=product,
+            product_variant=variant,
+            order=order,
+            productName=product.name,
+            qty=qty,
+            price=variant.price if variant is not None else product.price,
+            image=product.image.name,
+            color_name=variant.color.name if variant is not None else None,
+            size_name=variant.size.name if variant is not None else None,
+        )
+        for item, product, variant, qty in lines
+    ]
+
+
+def save_order_items(items):
+    """bulk_create các dòng đơn hàng (có thể của nhiều đơn) và tăng số tham chiếu ảnh"""
+    OrderItem.objects.bulk_create(items)
+    # bulk_create không phát post_save: tự tăng số tham chiếu của ảnh
+    images = defaultdict(int)
+    for item in items:
+        images[item.image.name] += 1
+    for name, count in images.items():
+        storage.acquire(name, count)
+    return items
+
+
+def place_order(user, data):
+    """Tạo đơn hàng từ dữ liệu checkout, ném OrderError nếu dữ liệu không hợp lệ hoặc hết hàng"""
+    validate_checkout(data)
+    lines = load_items(data.get('orderItems'))
+    coupon, total_price = apply_coupon(data.get('coupon_code'), data['totalPrice'])
+
+    with transaction.atomic():
+        # Trừ kho trước khi tạo dòng đơn hàng: INSERT OrderItem lấy khóa chia sẻ (khóa ngoại) trên
+        # dòng sản phẩm/biến thể, UPDATE tồn kho sau đó phải nâng lên khóa ghi và gây deadlock trên MySQL
+        sold = decrement_stock(lines, user)
+        apply_stock_change(sold)
+        order = Order.objects.create(
+            user=user,
+            paymentMethod=data['paymentMethod'],
+            taxPrice=data['taxPrice'],
+            shippingPrice=data['shippingPrice'],
+            totalPrice=total_price,
+            coupon=coupon
+        )
+        build_shipping_address(order, data['shippingAddress']).save()
+        save_order_items(build_order_items(order, lines))
+    return order
+
+
+def record_sales(order_id):
+    """Cộng số lượng của đơn vào Product.total_sold: một truy vấn đọc và một UPDATE cho cả đơn"""
+    rows = (
+        OrderItem.objects.filter(order_id=order_id, product__isnull=False)
+        .values('product_id').annotate(qty=Sum('qty'))
+    )
+    sold = {row['product_id']: row['qty'] for row in rows if row['qty']}
+    if not sold:
+        return
+    Product.objects.filter(id__in=sold).update(total_sold=F('total_sold') + Case(
+        *[When(id=product_id, then=Value(qty)) for product_id, qty in sold.items()], default=Value(0),
+    ))
+    transaction.on_commit(lambda: _bump_catalog(sold))
+
+
+def mark_paid(order, payment_method=None):
+    """
+    Đánh dấu đơn đã thanh toán và cộng số đã bán, trong transaction của người gọi.
+    Trả về False nếu đơn đã được thanh toán trước đó (không thay đổi gì).
+    """
+    fields = {'isPaid': True, 'paidAt': timezone.now()}
+    if payment_method:
+        fields['paymentMethod'] = payment_method
+    with transaction.atomic():
+        if not Order.objects.filter(id=order.id, isPaid=False).update(**fields):
+            return False
+        for name, value in fields.items():
+            setattr(order, name, value)
+        record_sales(order.id)
+        sales_rollups.record_paid(order)
+    return True
+
+
+def mark_refunded(order):
+    """Đánh dấu đơn đã hoàn tiền và cập nhật tổng hợp doanh số; trả về False nếu đơn đã được hoàn tiền"""
+    with transaction.atomic():
+        if not Order.objects.filter(id=order.id, isRefunded=False).update(isRefunded=True):
+            return False
+        order.isRefunded = True
+        if order.isPaid:
+            sales_rollups.record_refund(order)
+    return True
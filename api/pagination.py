@@ -0,0 +1,59 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param
+
+
+class ProductCursorPagination(CursorPagination):
+    """Phân trang theo con trỏ (keyset) cho danh sách sản phẩm, mới nhất trước"""
+    ordering = ('-createdAt', '-id')
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_ids(self, ids, request):
+        """
+        Một trang của danh sách id đã sắp xếp sẵn (lọc/sắp xếp theo chỉ mục facet), với cùng dạng
+        phản hồi và liên kết ?cursor= như danh sách thường; con trỏ giữ vị trí trong danh sách.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            start = 0
+        elif cursor.position is not None and cursor.position.isdigit():
+            start = int(cursor.position)
+        else:
+            raise NotFound(self.invalid_cursor_message)
+        end = start + self.page_size
+        self.id_links = (
+            self._position_link(end) if end < len(ids) else None,
+            self._position_link(max(start - self.page_size, 0)) if start > 0 else None,
+        )
+        return ids[start:end]
+
+    def _position_link(self, position):
+        if not position:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+
+    def get_ids_paginated_response(self, data, **extra):
+        next_link, previous_link = self.id_links
+        return Response({'next': next_link, 'previous': previous_link, 'results': data, **extra})
+
+
+class OrderCursorPagination(CursorPagination):
+    """Phân trang theo con trỏ cho danh sách đơn hàng, mới nhất trước"""
+    ordering = ('-createdAt', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class WalletTransactionCursorPagination(CursorPagination):
+    """Phân trang theo con trỏ cho sao kê ví, mới nhất trước"""
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
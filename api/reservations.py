@@ -0,0 +1,130 @@
+"""
+Giữ hàng cho giỏ hàng trong thời gian ngắn.
+
+Khi giỏ hàng thay đổi, số lượng chênh lệch được trừ khỏi stock_quantity/countInStock bằng UPDATE
+có điều kiện và ghi vào StockReservation, nên tồn kho mà catalog trả về đã là số còn bán được
+(không cần cộng trừ các dòng giữ khi đọc). placeOrder chỉ xóa dòng giữ thay vì cập nhật lại
+dòng tồn kho đang bị tranh chấp. Dòng giữ hết hạn được trả lại kho theo lô bởi
+release_expired (lệnh release_expired_reservations).
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Product, ProductVariant, StockReservation
+from api.orders import (
+    apply_stock_change, load_items, reservation_key, return_stock, stock_key, summary_delta, take_stock,
+)
+
+TTL = timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_MINUTES', 15))
+
+
+def _owners(reservations):
+    """{khóa tồn kho: (product, variant)} của các dòng giữ, đọc riêng (không JOIN trong SELECT ... FOR UPDATE
+    để không khóa luôn dòng sản phẩm/biến thể)"""
+    products = Product.objects.in_bulk({reservation.product_id for reservation in reservations})
+    variant_ids = {reservation.product_variant_id for reservation in reservations if reservation.product_variant_id}
+    variants = ProductVariant.objects.in_bulk(variant_ids) if variant_ids else {}
+    return {
+        reservation_key(reservation): (products[reservation.product_id], variants.get(reservation.product_variant_id))
+        for reservation in reservations
+    }
+
+
+def reserve_cart(user, items):
+    """
+    Đồng bộ hàng đang giữ của user với giỏ hàng (danh sách {id, variant_id, qty}) và gia hạn
+    tất cả dòng giữ. Trả về (expires_at, results) với một kết quả cho mỗi sản phẩm/biến thể trong giỏ;
+    dòng không đủ hàng giữ nguyên số lượng đang giữ và có thêm 'error'.
+    """
+    lines = load_items(items) if items else []
+    demand = Counter()
+    owners = {}
+    for item, product, variant, qty in lines:
+        key = stock_key(product, variant)
+        demand[key] += qty
+        owners[key] = (product, variant)
+
+    expires_at = timezone.now() + TTL
+    results = []
+    with transaction.atomic():
+        holds = {}
+        for reservation in StockReservation.objects.select_for_update().filter(user=user).order_by('id'):
+            key = reservation_key(reservation)
+            if key in holds:
+                # Không để một khóa có nhiều dòng giữ
+                holds[key].qty += reservation.qty
+                reservation.delete()
+            else:
+                holds[key] = reservation
+
+        owners = {**_owners([hold for key, hold in holds.items() if key not in demand]), **owners}
+        changed = Counter()
+        for key in sorted(set(demand) | set(holds)):
+            hold = holds.get(key)
+            held = hold.qty if hold else 0
+            wanted = demand.get(key, 0)
+            product, variant = owners[key]
+            error = None
+            if wanted > held and not take_stock(key, wanted - held):
+                error = f'Không đủ hàng cho {product.name}'
+                wanted = held
+            elif wanted < held:
+                return_stock(key, held - wanted)
+            changed[product.id] += summary_delta(product, variant, wanted - held)
+
+            if wanted == 0:
+                if hold:
+                    hold.delete()
+            elif hold:
+                hold.qty = wanted
+                hold.expires_at = expires_at
+                hold.save(update_fields=['qty', 'expires_at'])
+            else:
+                StockReservation.objects.create(
+                    user=user, product=product, product_variant=variant, qty=wanted, expires_at=expires_at,
+                )
+
+            if key in demand:
+                result = {'id': product.id, 'variant_id': variant.id if variant else None,
+                          'qty': demand[key], 'held': wanted}
+                if error:
+                    result['error'] = error
+                results.append(result)
+        apply_stock_change(changed)
+    return expires_at, results
+
+
+def release_cart(user):
+    reserve_cart(user, [])
+
+
+def release_expired(batch_size=500, now=None):
+    """Trả hàng của các dòng giữ đã hết hạn về kho, mỗi lô một transaction; trả về số dòng đã xử lý"""
+    now = now or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            # skip_locked: bỏ qua dòng đang được placeOrder/giỏ hàng xử lý
+            reservations = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now).order_by('id')[:batch_size]
+            )
+            if not reservations:
+                return total
+            returned = Counter()
+            for reservation in reservations:
+                returned[reservation_key(reservation)] += reservation.qty
+            owners = _owners(reservations)
+            StockReservation.objects.filter(id__in=[reservation.id for reservation in reservations]).delete()
+
+            changed = Counter()
+            for key in sorted(returned):
+                return_stock(key, returned[key])
+                product, variant = owners[key]
+                changed[product.id] -= summary_delta(product, variant, returned[key])
+            apply_stock_change(changed)
+        total += len(reservations)
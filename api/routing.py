@@ -1,6 +1,11 @@
 from django.urls import re_path
 from chat.consumers import ChatConsumer
+from api.consumers import OrderIntakeConsumer
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<user_id>\d+)/$', ChatConsumer.as_asgi()),
-]
\ No newline at end of file
+]
+
+order_intake_urlpatterns = [
+    re_path(r'ws/orders/intake/(?P<ticket>[0-9a-f-]{36})/$', OrderIntakeConsumer.as_asgi()),
+]
@@ -0,0 +1,79 @@
+"""
+Tính lại Product.total_sold từ các đơn đã thanh toán.
+
+Các luồng thanh toán cộng số đã bán ngay khi đơn được thanh toán (orders.mark_paid); lệnh
+update_product_sales dùng module này để sửa sai lệch (đơn được đánh dấu thanh toán trong admin,
+dữ liệu cũ...). Số đã bán của các sản phẩm được tính bằng một truy vấn GROUP BY rồi ghi bằng
+bulk_update, chỉ cho các sản phẩm có giá trị thay đổi. Chế độ tăng dần chỉ tính lại các sản phẩm
+có trong đơn được thanh toán sau mốc (Watermark) của lần chạy trước.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from api import catalog_cache
+from api.models import OrderItem, Product, Watermark
+
+WATERMARK = 'product_sales'
+# Đơn có paidAt trước mốc nhưng commit sau khi lần chạy trước đọc xong vẫn được tính lại
+OVERLAP = timedelta(minutes=5)
+BATCH_SIZE = 500
+
+
+def get_watermark(name):
+    return Watermark.objects.filter(name=name).values_list('value', flat=True).first()
+
+
+def set_watermark(name, value):
+    Watermark.objects.update_or_create(name=name, defaults={'value': value})
+
+
+def sold_totals(product_ids=None):
+    """{product_id: tổng số lượng đã bán} từ các đơn đã thanh toán, một truy vấn GROUP BY"""
+    items = OrderItem.objects.filter(order__isPaid=True, product__isnull=False)
+    if product_ids is not None:
+        items = items.filter(product_id__in=product_ids)
+    return {
+        row['product_id']: row['total'] or 0
+        for row in items.values('product_id').annotate(total=Sum('qty'))
+    }
+
+
+def rebuild_total_sold(product_ids=None):
+    """Ghi lại total_sold cho các sản phẩm (tất cả nếu product_ids là None); trả về số sản phẩm đã đổi"""
+    totals = sold_totals(product_ids)
+    products = Product.objects.only('id', 'total_sold')
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    changed = []
+    for product in products.iterator(chunk_size=BATCH_SIZE):
+        total = totals.get(product.id, 0)
+        if product.total_sold != total:
+            product.total_sold = total
+            changed.append(product)
+    with transaction.atomic():
+        Product.objects.bulk_update(changed, ['total_sold'], batch_size=BATCH_SIZE)
+        if changed:
+            transaction.on_commit(catalog_cache.bump_catalog_version)
+    return len(changed)
+
+
+def sync_total_sold():
+    """
+    Chế độ tăng dần: tính lại các sản phẩm có trong đơn được thanh toán từ mốc trước.
+    Lần chạy đầu tiên (chưa có mốc) tính lại toàn bộ. Trả về (số sản phẩm đã đổi, mốc mới).
+    """
+    started = timezone.now()
+    since = get_watermark(WATERMARK)
+    if since is None:
+        changed = rebuild_total_sold()
+    else:
+        product_ids = set(
+            OrderItem.objects.filter(order__isPaid=True, order__paidAt__gte=since - OVERLAP, product__isnull=False)
+            .values_list('product_id', flat=True).distinct()
+        )
+        changed = rebuild_total_sold(product_ids) if product_ids else 0
+    set_watermark(WATERMARK, started)
+    return changed, started
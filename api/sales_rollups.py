@@ -0,0 +1,200 @@
+"""
+Bảng tổng hợp doanh số (SalesRollup) theo ngày thanh toán và theo chiều: tổng, danh mục,
+thương hiệu, phương thức thanh toán.
+
+Khi đơn được thanh toán hoặc hoàn tiền (orders.mark_paid/mark_refunded), các dòng tổng hợp của
+ngày thanh toán được cộng bằng UPDATE với F() trong cùng transaction, nên API thống kê chỉ đọc
+vài trăm dòng tổng hợp thay vì quét Order/OrderItem. Hoàn tiền được tính vào ngày thanh toán của
+đơn (cột refunded_*). compute_rollups tính lại một khoảng ngày từ dữ liệu gốc bằng các truy vấn
+GROUP BY, dùng cho lệnh backfill_sales_rollups và verify_sales_rollups.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from api.models import Brand, Category, Order, OrderItem, SalesRollup
+
+METRICS = ('orders', 'units', 'revenue', 'refunded_orders', 'refunded_units', 'refunded_revenue')
+DIMENSIONS = (SalesRollup.TOTAL, SalesRollup.CATEGORY, SalesRollup.BRAND, SalesRollup.PAYMENT_METHOD)
+ITEM_DIMENSIONS = {SalesRollup.CATEGORY: 'product__category_id', SalesRollup.BRAND: 'product__brand_id'}
+
+
+def _empty():
+    return dict.fromkeys(METRICS, 0)
+
+
+def order_deltas(order, refunded=False):
+    """{(chiều, khóa): {chỉ số: giá trị}} mà đơn đóng góp vào tổng hợp; một truy vấn đọc dòng đơn"""
+    prefix = 'refunded_' if refunded else ''
+    items = list(
+        OrderItem.objects.filter(order_id=order.id)
+        .values_list('qty', 'price', 'product__category_id', 'product__brand_id')
+    )
+    units = sum(qty or 0 for qty, *_ in items)
+    deltas = defaultdict(_empty)
+    for key in ((SalesRollup.TOTAL, ''), (SalesRollup.PAYMENT_METHOD, order.paymentMethod or '')):
+        deltas[key].update({prefix + 'orders': 1, prefix + 'units': units, prefix + 'revenue': order.totalPrice})
+
+    for dimension, position in ((SalesRollup.CATEGORY, 2), (SalesRollup.BRAND, 3)):
+        seen = set()
+        for item in items:
+            if item[position] is None:
+                continue
+            key = (dimension, str(item[position]))
+            qty = item[0] or 0
+            deltas[key][prefix + 'units'] += qty
+            deltas[key][prefix + 'revenue'] += item[1] * qty
+            if key not in seen:
+                seen.add(key)
+                deltas[key][prefix + 'orders'] += 1
+    return deltas
+
+
+def _apply(day, deltas):
+    """Cộng deltas vào các dòng tổng hợp của ngày; theo thứ tự khóa cố định để tránh deadlock"""
+    for dimension, key in sorted(deltas):
+        values = {metric: value for metric, value in deltas[dimension, key].items() if value}
+        if not values:
+            continue
+        rows = SalesRollup.objects.filter(day=day, dimension=dimension, key=key)
+        changes = {metric: F(metric) + value for metric, value in values.items()}
+        if rows.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                SalesRollup.objects.create(day=day, dimension=dimension, key=key, **values)
+        except IntegrityError:
+            # Request khác vừa tạo dòng này
+            rows.update(**changes)
+
+
+def record_paid(order):
+    _apply(timezone.localdate(order.paidAt), order_deltas(order))
+
+
+def record_refund(order):
+    if order.paidAt is not None:
+        _apply(timezone.localdate(order.paidAt), order_deltas(order, refunded=True))
+
+
+def _day_range(start, end):
+    """Khoảng thời gian [đầu ngày start, đầu ngày sau end) theo múi giờ hiện tại"""
+    lower = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+    upper = timezone.make_aware(datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return lower, upper
+
+
+def _aggregates(amount, refunded_field, order_count):
+    """Số đơn và doanh thu (tổng và phần đã hoàn tiền) cho một truy vấn GROUP BY"""
+    revenue = DecimalField(max_digits=16, decimal_places=0)
+    refunded = Q(**{refunded_field: True})
+    return {
+        'orders': order_count(),
+        'refunded_orders': order_count(filter=refunded),
+        'revenue': Sum(amount, output_field=revenue),
+        'refunded_revenue': Sum(amount, filter=refunded, output_field=revenue),
+    }
+
+
+def compute_rollups(start, end):
+    """Tính tổng hợp cho các ngày start..end từ Order/OrderItem; trả về {(ngày, chiều, khóa): {chỉ số: giá trị}}"""
+    lower, upper = _day_range(start, end)
+    tz = timezone.get_current_timezone()
+    # order_by(): bỏ Meta.ordering của Order khỏi GROUP BY
+    orders = Order.objects.filter(isPaid=True, paidAt__gte=lower, paidAt__lt=upper).annotate(
+        day=TruncDate('paidAt', tzinfo=tz)).order_by()
+    items = OrderItem.objects.filter(order__isPaid=True, order__paidAt__gte=lower, order__paidAt__lt=upper).annotate(
+        day=TruncDate('order__paidAt', tzinfo=tz)).order_by()
+    units = {'units': Sum('qty'), 'refunded_units': Sum('qty', filter=Q(order__isRefunded=True))}
+
+    result = defaultdict(_empty)
+
+    def collect(dimension, rows, key_field=None):
+        for row in rows:
+            key = '' if key_field is None else row[key_field]
+            key = '' if key is None else str(key)
+            target = result[row['day'], dimension, key]
+            for metric in METRICS:
+                if metric in row:
+                    target[metric] = row[metric] or 0
+
+    # Số đơn và doanh thu theo đơn (tổng, phương thức thanh toán)
+    order_metrics = _aggregates('totalPrice', 'isRefunded', lambda **kw: Count('id', **kw))
+    collect(SalesRollup.TOTAL, orders.values('day').annotate(**order_metrics))
+    collect(SalesRollup.PAYMENT_METHOD, orders.values('day', 'paymentMethod').annotate(**order_metrics),
+            'paymentMethod')
+    collect(SalesRollup.TOTAL, items.values('day').annotate(**units))
+    collect(SalesRollup.PAYMENT_METHOD, items.values('day', 'order__paymentMethod').annotate(**units),
+            'order__paymentMethod')
+
+    # Doanh thu theo dòng đơn (danh mục, thương hiệu)
+    line_total = F('price') * F('qty')
+    item_metrics = {
+        **_aggregates(line_total, 'order__isRefunded', lambda **kw: Count('order_id', distinct=True, **kw)),
+        **units,
+    }
+    for dimension, field in ITEM_DIMENSIONS.items():
+        rows = items.filter(**{f'{field}__isnull': False}).values('day', field).annotate(**item_metrics)
+        collect(dimension, rows, field)
+
+    return {key: metrics for key, metrics in result.items() if any(metrics.values())}
+
+
+def stored_rollups(start, end):
+    rows = SalesRollup.objects.filter(day__gte=start, day__lte=end).values('day', 'dimension', 'key', *METRICS)
+    return {(row['day'], row['dimension'], row['key']): {metric: row[metric] for metric in METRICS} for row in rows}
+
+
+def backfill(start, end):
+    """Xóa và tính lại tổng hợp của các ngày start..end; trả về số dòng đã ghi"""
+    computed = compute_rollups(start, end)
+    with transaction.atomic():
+        SalesRollup.objects.filter(day__gte=start, day__lte=end).delete()
+        SalesRollup.objects.bulk_create([
+            SalesRollup(day=day, dimension=dimension, key=key, **metrics)
+            for (day, dimension, key), metrics in computed.items()
+        ], batch_size=500)
+    return len(computed)
+
+
+def verify(start, end):
+    """So sánh tổng hợp đã lưu với số tính lại từ dữ liệu gốc; trả về danh sách sai lệch"""
+    expected = compute_rollups(start, end)
+    stored = stored_rollups(start, end)
+    diffs = []
+    for key in sorted(set(expected) | set(stored)):
+        want = expected.get(key, _empty())
+        have = stored.get(key, _empty())
+        for metric in METRICS:
+            if Decimal(want[metric]) != Decimal(have[metric]):
+                day, dimension, dimension_key = key
+                diffs.append({'day': day, 'dimension': dimension, 'key': dimension_key, 'metric': metric,
+                              'stored': have[metric], 'expected': want[metric]})
+    return diffs
+
+
+def _labels(dimension, keys):
+    model = {SalesRollup.CATEGORY: Category, SalesRollup.BRAND: Brand}.get(dimension)
+    if model is None:
+        return {key: key for key in keys}
+    objects = model.objects.in_bulk([int(key) for key in keys if key.isdigit()])
+    return {key: objects[int(key)].title if key.isdigit() and int(key) in objects else key for key in keys}
+
+
+def query(start, end, dimension=SalesRollup.TOTAL, by_day=True):
+    """Đọc tổng hợp cho API thống kê: theo từng ngày, hoặc cộng dồn cả khoảng theo khóa"""
+    rows = SalesRollup.objects.filter(dimension=dimension, day__gte=start, day__lte=end)
+    if by_day:
+        rows = list(rows.order_by('day', 'key').values('day', 'key', *METRICS))
+    else:
+        rows = list(rows.values('key').annotate(**{metric: Sum(metric) for metric in METRICS}).order_by('key'))
+    labels = _labels(dimension, {row['key'] for row in rows})
+    for row in rows:
+        row['label'] = labels[row['key']]
+        row['net_revenue'] = row['revenue'] - row['refunded_revenue']
+    return rows
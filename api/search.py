@@ -0,0 +1,124 @@
+"""
+Chỉ mục tìm kiếm sản phẩm (inverted index) lưu trong bảng ProductSearchTerm.
+Văn bản được bỏ dấu tiếng Việt trước khi tách từ nên "ao thun" khớp với "Áo thun".
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, When
+
+from api.models import Product, ProductSearchTerm
+
+# Trọng số theo trường: tên sản phẩm quan trọng nhất, mô tả ít quan trọng nhất
+FIELD_WEIGHTS = {
+    'name': 8,
+    'brand': 4,
+    'category': 4,
+    'description': 1,
+}
+
+# Khớp trọn từ được cộng thêm điểm so với chỉ khớp tiền tố
+EXACT_MATCH_BONUS = 2
+
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def fold_text(text):
+    """Bỏ dấu và chuyển về chữ thường: 'Áo Thun Đẹp' -> 'ao thun dep'"""
+    if not text:
+        return ''
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in _TOKEN_RE.findall(fold_text(text))]
+
+
+def build_terms(product):
+    """Trả về {term: weight} cho một sản phẩm (brand/category cần được select_related)"""
+    sources = {
+        'name': product.name,
+        'brand': product.brand.title if product.brand_id else '',
+        'category': product.category.title if product.category_id else '',
+        'description': product.description,
+    }
+    weights = defaultdict(int)
+    for field, text in sources.items():
+        for token in tokenize(text):
+            weights[token] = max(weights[token], FIELD_WEIGHTS[field])
+    return weights
+
+
+def index_products(products):
+    """Ghi lại các dòng chỉ mục cho danh sách sản phẩm trong một transaction"""
+    products = list(products)
+    if not products:
+        return
+    rows = [
+        ProductSearchTerm(product=product, term=term, weight=weight)
+        for product in products
+        for term, weight in build_terms(product).items()
+    ]
+    with transaction.atomic():
+        ProductSearchTerm.objects.filter(product__in=products).delete()
+        ProductSearchTerm.objects.bulk_create(rows, batch_size=1000)
+
+
+def index_product(product):
+    index_products([product])
+
+
+def search_product_ids(query, limit=50):
+    """
+    Trả về danh sách (product_id, score) theo thứ tự liên quan giảm dần.
+
+    Mọi từ trong truy vấn đều phải khớp (AND) theo tiền tố; khớp trọn từ
+    được nhân thêm EXACT_MATCH_BONUS.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+
+    scores = None
+    for term in terms:
+        rows = (
+            ProductSearchTerm.objects.filter(term__startswith=term)
+            .values('product_id')
+            .annotate(score=Max(Case(
+                When(term=term, then=F('weight') * EXACT_MATCH_BONUS),
+                default=F('weight'),
+                output_field=IntegerField(),
+            )))
+        )
+        term_scores = {row['product_id']: row['score'] for row in rows}
+        if scores is None:
+            scores = term_scores
+        else:
+            scores = {pk: scores[pk] + score for pk, score in term_scores.items() if pk in scores}
+        if not scores:
+            return []
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+    return ranked[:limit]
+
+
+def rebuild_index(batch_size=500):
+    """Xây lại toàn bộ chỉ mục theo từng lô, trả về số sản phẩm đã xử lý"""
+    total = 0
+    last_id = 0
+    queryset = Product.objects.select_related('brand', 'category').order_by('id')
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        index_products(batch)
+        total += len(batch)
+        last_id = batch[-1].id
+    return total
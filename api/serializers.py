@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from .models import Coupon
 from api.models import RefundRequest
+from api.images import derivative_urls
 
 from api.models import RefundRequest
 
@@ -46,16 +47,32 @@ class SizeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'order')
 
 
-class ProductVariantSerializer(serializers.ModelSerializer):
+class ImageUrlsMixin:
+    """Trường image_urls: URL ảnh phái sinh (thumbnail/card/detail, kèm WebP) của obj.image"""
+
+    def get_image_urls(self, obj):
+        urls = derivative_urls(obj.image.name) if obj.image else None
+        request = self.context.get('request')
+        if urls and request is not None:
+            urls = {
+                size: {fmt: request.build_absolute_uri(url) for fmt, url in formats.items()}
+                for size, formats in urls.items()
+            }
+        return urls
+
+
+class ProductVariantSerializer(ImageUrlsMixin, serializers.ModelSerializer):
     color = ColorSerializer(read_only=True)
     size = SizeSerializer(read_only=True)
     color_id = serializers.IntegerField(write_only=True)
     size_id = serializers.IntegerField(write_only=True)
     product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), write_only=True)
+    image_urls = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductVariant
-        fields = ('id', 'product', 'color', 'size', 'color_id', 'size_id', 'price', 'stock_quantity', 'sku', 'image')
+        fields = ('id', 'product', 'color', 'size', 'color_id', 'size_id', 'price', 'stock_quantity', 'sku', 'image',
+                  'image_urls')
         read_only_fields = ('sku',)
 
     def validate(self, data):
@@ -88,13 +105,32 @@ class ProductVariantSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class ProductVariantBulkRowSerializer(serializers.Serializer):
+    """Một dòng của API upsert hàng loạt; màu/size nhận id hoặc tên"""
+    product = serializers.IntegerField()
+    color_id = serializers.IntegerField(required=False)
+    color = serializers.CharField(max_length=50, required=False)
+    size_id = serializers.IntegerField(required=False)
+    size = serializers.CharField(max_length=10, required=False)
+    price = serializers.DecimalField(max_digits=12, decimal_places=0, required=False)
+    stock_quantity = serializers.IntegerField(required=False)
+    sku = serializers.CharField(max_length=100, required=False, allow_blank=True)
+
+    def validate(self, data):
+        if 'color_id' not in data and 'color' not in data:
+            raise serializers.ValidationError("Color is required")
+        if 'size_id' not in data and 'size' not in data:
+            raise serializers.ValidationError("Size is required")
+        return data
+
+
 class BrandSerializer(serializers.ModelSerializer):
     class Meta:
         model = Brand
         fields = ('id', 'title', 'description', 'featured_product', 'image')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(ImageUrlsMixin, serializers.ModelSerializer):
     reviews = ReviewSerializer(read_only=True, many=True, source='review_set')
     is_favorite = serializers.SerializerMethodField()
     variants = ProductVariantSerializer(read_only=True, many=True)
@@ -102,30 +138,56 @@ class ProductSerializer(serializers.ModelSerializer):
     available_sizes = serializers.SerializerMethodField()
     min_price = serializers.SerializerMethodField()
     total_stock = serializers.SerializerMethodField()
+    image_urls = serializers.SerializerMethodField()
+
+    # Các trường của một dòng tóm tắt trong danh sách sản phẩm
+    SUMMARY_FIELDS = ('id', 'name', 'image', 'image_urls', 'brand', 'category', 'rating', 'numReviews',
+                      'price', 'countInStock', 'createdAt', 'is_favorite', 'total_sold',
+                      'has_variants', 'min_price', 'total_stock')
+
+    # Các trường lồng nhau chỉ trả về khi client yêu cầu qua ?expand=
+    EXPANDABLE_FIELDS = ('reviews', 'variants', 'available_colors', 'available_sizes')
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'image', 'brand', 'category', 'description',
+        fields = ('id', 'name', 'image', 'image_urls', 'brand', 'category', 'description',
                   'rating', 'numReviews', 'price', 'countInStock', 'createdAt',
                   'reviews', 'is_favorite', 'total_sold', 'has_variants', 'variants',
                   'available_colors', 'available_sizes', 'min_price', 'total_stock')
 
+    def __init__(self, *args, **kwargs):
+        # fields: danh sách trường cần giữ lại, expand: các trường lồng nhau cần thêm vào
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            keep = set(fields) | (set(expand or ()) & set(self.EXPANDABLE_FIELDS))
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
     def get_is_favorite(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return Favorite.objects.filter(user=request.user, product=obj).exists()
+            # Tải danh sách ID yêu thích một lần cho cả request (context dùng chung giữa các phần tử)
+            if 'favorite_ids' not in self.context:
+                self.context['favorite_ids'] = set(
+                    Favorite.objects.filter(user=request.user).values_list('product_id', flat=True)
+                )
+            return obj.id in self.context['favorite_ids']
         return False
 
     def get_available_colors(self, obj):
         if obj.has_variants:
-            colors = Color.objects.filter(productvariant__product=obj).distinct()
-            return ColorSerializer(colors, many=True).data
+            # Dùng biến thể đã prefetch (kèm color) thay vì truy vấn lại
+            colors = {variant.color_id: variant.color for variant in obj.variants.all()}
+            return ColorSerializer(sorted(colors.values(), key=lambda color: color.id), many=True).data
         return []
 
     def get_available_sizes(self, obj):
         if obj.has_variants:
-            sizes = Size.objects.filter(productvariant__product=obj).distinct().order_by('order', 'name')
-            return SizeSerializer(sizes, many=True).data
+            sizes = {variant.size_id: variant.size for variant in obj.variants.all()}
+            return SizeSerializer(sorted(sizes.values(), key=lambda size: (size.order, size.name)), many=True).data
         return []
 
     def get_min_price(self, obj):
@@ -221,13 +283,14 @@ class PayboxTransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = PayboxTransaction
         fields = [
-            'id', 'wallet', 'wallet_info', 'transaction_type', 'transaction_type_display',
+            'id', 'wallet', 'wallet_info', 'sequence', 'transaction_type', 'transaction_type_display',
             'amount', 'status', 'status_display', 'description', 'order', 'order_info',
             'stripe_payment_intent_id', 'balance_before', 'balance_after',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['wallet', 'balance_before', 'balance_after', 'created_at', 'updated_at']
+        read_only_fields = ['wallet', 'sequence', 'balance_before', 'balance_after', 'created_at', 'updated_at']
 
+    # Dùng với select_related('wallet__user', 'order') để không truy vấn thêm mỗi dòng
     def get_wallet_info(self, obj):
         return {
             'user_username': obj.wallet.user.username,
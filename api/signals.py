@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from api.models import Brand, Category, Color, Product, ProductVariant, Review, Size
+from api import catalog_cache, search
+from api.images import generate_derivatives
+from api import storage
+from api.summaries import refresh_product_summary
+
+# Chỉ các trường này ảnh hưởng tới chỉ mục tìm kiếm
+SEARCH_FIELDS = {'name', 'description', 'brand', 'category'}
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not SEARCH_FIELDS & set(update_fields):
+        return
+    search.index_product(instance)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def reindex_products_of_group(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    lookup = 'brand' if sender is Brand else 'category'
+    products = Product.objects.select_related('brand', 'category').filter(**{lookup: instance})
+    search.index_products(products)
+
+
+@receiver(post_save, sender=Product)
+def refresh_summary_on_product_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_product_summary(instance.id, create=True)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def refresh_summary_on_child_change(sender, instance, raw=False, **kwargs):
+    if not raw and instance.product_id:
+        refresh_product_summary(instance.product_id)
+
+
+def _bump_after_commit(product_ids):
+    """
+    Tăng phiên bản sau khi transaction commit: tăng trong transaction thì request khác có thể
+    đọc dữ liệu cũ và cache lại dưới phiên bản mới trước khi commit.
+    """
+    def bump():
+        catalog_cache.bump_catalog_version()
+        for product_id in product_ids:
+            catalog_cache.bump_product_version(product_id)
+
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_cache(sender, instance, raw=False, **kwargs):
+    """Tăng phiên bản catalog (cache danh sách, chỉ mục facet) và phiên bản của sản phẩm bị ảnh hưởng"""
+    if raw:
+        return
+    product_id = instance.id if sender is Product else getattr(instance, 'product_id', None)
+    _bump_after_commit([product_id] if product_id else [])
+
+
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+def invalidate_products_of_attribute(sender, instance, raw=False, **kwargs):
+    """Đổi tên/mã màu hoặc size làm thay đổi ma trận biến thể của các sản phẩm dùng nó"""
+    if raw:
+        return
+    lookup = 'color' if sender is Color else 'size'
+    product_ids = ProductVariant.objects.filter(**{lookup: instance.id}).values_list('product_id', flat=True).distinct()
+    _bump_after_commit(list(product_ids))
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductVariant)
+def detect_image_upload(sender, instance, raw=False, **kwargs):
+    # File vừa upload chưa được ghi vào storage (_committed=False) trước khi lưu model
+    instance._image_uploaded = not raw and bool(instance.image) and not instance.image._committed
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+def generate_image_derivatives(sender, instance, **kwargs):
+    if getattr(instance, '_image_uploaded', False):
+        generate_derivatives(instance.image.name)
+
+
+def _image_name(instance):
+    # Đọc giá trị thô, tránh truy vấn thêm khi trường image bị defer (.only()/.defer())
+    value = instance.__dict__.get('image')
+    return getattr(value, 'name', value) or None
+
+
+def remember_image(sender, instance, **kwargs):
+    instance._original_image = _image_name(instance)
+
+
+def count_image_reference(sender, instance, created=False, raw=False, **kwargs):
+    if raw or 'image' not in instance.__dict__:
+        return
+    # Với dòng mới, giá trị lúc khởi tạo chưa nằm trong DB nên chưa được tính
+    old = None if created else getattr(instance, '_original_image', None)
+    new = _image_name(instance)
+    if old != new:
+        storage.acquire(new)
+        storage.release(old)
+        instance._original_image = new
+
+
+def release_image_reference(sender, instance, **kwargs):
+    storage.release(_image_name(instance))
+
+
+for model in storage.image_models():
+    post_init.connect(remember_image, sender=model, dispatch_uid=f'remember_image_{model.__name__}')
+    post_save.connect(count_image_reference, sender=model, dispatch_uid=f'count_image_{model.__name__}')
+    post_delete.connect(release_image_reference, sender=model, dispatch_uid=f'release_image_{model.__name__}')
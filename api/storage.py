@@ -0,0 +1,206 @@
+"""
+Lưu media theo địa chỉ nội dung: tên file là SHA-256 của nội dung nên cùng một ảnh
+upload nhiều lần chỉ được lưu một lần, và URL không bao giờ đổi nội dung (cache vĩnh viễn).
+
+Mỗi file có một dòng MediaBlob với ref_count = số dòng dữ liệu đang dùng file; file không
+còn ai dùng được dọn bởi lệnh gc_media_blobs (sau một khoảng chờ, vì ảnh vừa upload
+chưa kịp gắn vào sản phẩm cũng có ref_count = 0).
+"""
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from PIL import Image
+
+BLOB_DIR = 'blobs'
+# Đuôi file của blob theo định dạng ảnh mà Pillow nhận ra, không theo tên file client gửi
+IMAGE_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+
+def write_atomic(path, chunks):
+    """Ghi qua file tạm rồi đổi tên để request đồng thời không đọc phải file ghi dở"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            for chunk in chunks:
+                handle.write(chunk)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def image_extension(content):
+    """Đuôi file theo định dạng ảnh thật của nội dung (file hoặc đường dẫn), '' nếu không phải ảnh được hỗ trợ"""
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    # Image.open chỉ đọc header; kích thước quá lớn bị Pillow chặn (DecompressionBombError)
+    try:
+        with Image.open(content) as image:
+            image_format = image.format
+    except (OSError, Image.DecompressionBombError):
+        image_format = None
+    finally:
+        if hasattr(content, 'seek'):
+            content.seek(0)
+    return IMAGE_EXTENSIONS.get(image_format, '')
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}{extension.lower()}'
+
+
+def is_blob(name):
+    return str(name or '').lstrip('/').startswith(BLOB_DIR + '/')
+
+
+def blob_digest(name):
+    """SHA-256 nằm trong tên file blob, None với file lưu theo cách cũ"""
+    if not is_blob(name):
+        return None
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def _save(self, name, content):
+        sha = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks():
+            sha.update(chunk)
+            size += len(chunk)
+        digest = sha.hexdigest()
+        # Đuôi theo nội dung: file không phải ảnh không có đuôi và được phục vụ như dữ liệu nhị phân
+        name = blob_name(digest, image_extension(content))
+
+        self._register(name, digest, size)
+        if not self.exists(name):
+            write_atomic(self.path(name), content.chunks())
+        return name
+
+    def save_file(self, path, extension, digest, size):
+        """Chuyển một file tạm đã biết hash vào kho blob mà không đọc lại nội dung, trả về tên blob"""
+        name = blob_name(digest, extension)
+        self._register(name, digest, size)
+        if self.exists(name):
+            os.remove(path)
+        else:
+            target = self.path(name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.chmod(path, 0o644)
+            # Cùng filesystem thì chỉ là đổi tên; khác filesystem thì chép qua file tạm cạnh đích
+            try:
+                os.replace(path, target)
+            except OSError:
+                with open(path, 'rb') as handle:
+                    write_atomic(target, iter(lambda: handle.read(64 * 1024), b''))
+                os.remove(path)
+        return name
+
+    def _register(self, name, digest, size):
+        from api.models import MediaBlob
+
+        # Ghi nhận lần upload trước khi kiểm tra file để gc_media_blobs không xóa blob đang được upload lại
+        if not MediaBlob.objects.filter(name=name).update(uploaded_at=timezone.now()):
+            try:
+                with transaction.atomic():
+                    MediaBlob.objects.create(name=name, sha256=digest, size=size)
+            except IntegrityError:
+                # Request khác vừa tạo cùng blob
+                pass
+
+    def get_available_name(self, name, max_length=None):
+        # Cùng tên nghĩa là cùng nội dung, không cần thêm hậu tố
+        return name
+
+    def delete(self, name):
+        # File blob có thể đang được dòng khác dùng; chỉ gc_media_blobs mới xóa
+        if is_blob(name):
+            release(name)
+            return
+        super().delete(name)
+
+
+def _normalize(name):
+    return str(name or '').lstrip('/')
+
+
+def acquire(name, count=1):
+    from api.models import MediaBlob
+
+    if is_blob(name):
+        MediaBlob.objects.filter(name=_normalize(name)).update(ref_count=F('ref_count') + count)
+
+
+def release(name, count=1):
+    from api.models import MediaBlob
+
+    if is_blob(name):
+        MediaBlob.objects.filter(name=_normalize(name), ref_count__gt=0).update(
+            ref_count=Greatest(F('ref_count') - count, 0)
+        )
+
+
+def image_models():
+    """Các model có trường image trỏ tới file media (OrderItem chép tên ảnh của sản phẩm)"""
+    from api.models import Brand, Category, OrderItem, Product, ProductVariant
+
+    return (Brand, Category, Product, ProductVariant, OrderItem)
+
+
+def recount_references(batch_size=1000):
+    """Tính lại ref_count từ dữ liệu (sau bulk_create/update() không phát tín hiệu), trả về số blob thay đổi"""
+    from api.models import MediaBlob
+
+    counts = {}
+    for model in image_models():
+        rows = model.objects.filter(image__startswith=BLOB_DIR + '/').values('image').annotate(n=Count('id'))
+        for row in rows.values_list('image', 'n'):
+            counts[row[0]] = counts.get(row[0], 0) + row[1]
+
+    changed = []
+    for blob in MediaBlob.objects.only('id', 'name', 'ref_count').iterator(chunk_size=batch_size):
+        if blob.ref_count != counts.get(blob.name, 0):
+            blob.ref_count = counts.get(blob.name, 0)
+            changed.append(blob)
+    MediaBlob.objects.bulk_update(changed, ['ref_count'], batch_size=batch_size)
+    return len(changed)
+
+
+def collect_garbage(grace=timedelta(hours=24), dry_run=False):
+    """Xóa blob không còn được dùng (kèm ảnh phái sinh) đã upload lâu hơn grace, trả về danh sách tên"""
+    from api.images import DERIVATIVE_SIZES, derivative_name, fallback_format
+    from api.models import MediaBlob
+
+    removed = []
+    cutoff = timezone.now() - grace
+    for blob in MediaBlob.objects.filter(ref_count__lte=0, uploaded_at__lt=cutoff).iterator():
+        removed.append(blob.name)
+        if dry_run:
+            continue
+        # Xóa dòng trước (chỉ khi vẫn chưa được dùng/upload lại) rồi mới xóa file
+        deleted, _ = MediaBlob.objects.filter(id=blob.id, ref_count__lte=0, uploaded_at__lt=cutoff).delete()
+        if not deleted:
+            removed.pop()
+            continue
+        paths = [blob.name] + [
+            derivative_name(blob.name, size, fmt)
+            for size in DERIVATIVE_SIZES
+            for fmt in (fallback_format(blob.name), 'webp')
+        ]
+        for path in paths:
+            try:
+                os.remove(os.path.join(settings.MEDIA_ROOT, path))
+            except FileNotFoundError:
+                pass
+    return removed
@@ -0,0 +1,187 @@
+"""
+Nhận webhook Stripe và áp dụng các thanh toán thành công.
+
+Stripe gửi sự kiện tới /api/stripe/webhook/; view chỉ kiểm tra chữ ký (HMAC với
+STRIPE_WEBHOOK_SECRET, không gọi ra ngoài) rồi lưu sự kiện vào bảng StripeEvent với id của sự
+kiện làm khóa chính, nên Stripe gửi lại cùng sự kiện không tạo dòng mới. Worker (lệnh
+apply_stripe_events) lấy từng lô sự kiện đang chờ bằng SELECT ... FOR UPDATE SKIP LOCKED và áp
+dụng payment_intent.succeeded vào đơn hàng (metadata order_id, orders.mark_paid) hoặc ví
+(metadata transaction_type=DEPOSIT, wallets.credit) trong cùng transaction với trạng thái của
+sự kiện, nên mỗi sự kiện được áp dụng đúng một lần. Trong một lô, các sự kiện nạp ví được áp
+dụng trước (theo user) rồi tới đơn hàng (theo id), cùng thứ tự khóa với api.wallets, để hai
+worker không deadlock.
+
+Các API xác nhận (orders/<id>/pay/, paybox/deposit/confirm/) chỉ tra bảng này: sự kiện đã tới
+mà worker chưa xử lý thì được áp dụng ngay, chưa tới thì client nhận 202 và hỏi lại.
+"""
+import json
+import logging
+import time
+
+import stripe
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from api import wallets
+from api.models import Order, PayboxTransaction, StripeEvent
+from api.orders import mark_paid
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'STRIPE_EVENT_BATCH_SIZE', 100)
+HANDLED_TYPES = ('payment_intent.succeeded',)
+# Độ lệch tối đa giữa thời điểm ký và lúc nhận (giây), như mặc định của Stripe
+SIGNATURE_TOLERANCE = 300
+
+DEPOSIT = 0
+ORDER = 1
+
+
+class EventError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def verify(payload, signature):
+    """Kiểm tra header Stripe-Signature của body (bytes) và trả về sự kiện; ném ValueError nếu không hợp lệ"""
+    secret = getattr(settings, 'STRIPE_WEBHOOK_SECRET', None)
+    if not secret:
+        raise ValueError('STRIPE_WEBHOOK_SECRET chưa được cấu hình')
+    try:
+        stripe.WebhookSignature.verify_header(payload.decode('utf-8'), signature, secret, SIGNATURE_TOLERANCE)
+    except stripe.error.SignatureVerificationError as exc:
+        raise ValueError(str(exc)) from exc
+    event = json.loads(payload)
+    if not isinstance(event, dict) or not event.get('id') or not event.get('type'):
+        raise ValueError('Sự kiện không hợp lệ')
+    return event
+
+
+def ingest(event):
+    """Lưu sự kiện đã kiểm tra chữ ký; trả về False nếu đã nhận trước đó"""
+    intent = (event.get('data') or {}).get('object') or {}
+    handled = event['type'] in HANDLED_TYPES and intent.get('object') == 'payment_intent'
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(
+                id=event['id'],
+                type=event['type'],
+                payment_intent_id=intent.get('id', '') if handled else '',
+                payload=event,
+                status=StripeEvent.PENDING if handled else StripeEvent.IGNORED,
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def _intent(event):
+    return event.payload['data']['object']
+
+
+def _target(event):
+    """(DEPOSIT, user_id) hoặc (ORDER, order_id) theo metadata của payment intent; None nếu không xác định được"""
+    metadata = _intent(event).get('metadata') or {}
+    try:
+        if metadata.get('transaction_type') == 'DEPOSIT':
+            return DEPOSIT, int(metadata['user_id'])
+        return ORDER, int(metadata['order_id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _lock_order(event):
+    return _target(event) or (ORDER + 1, 0)
+
+
+def _apply(event):
+    intent = _intent(event)
+    target = _target(event)
+    if target is None:
+        raise EventError('Không xác định được đơn hàng hoặc ví của thanh toán')
+    kind, target_id = target
+    amount = intent.get('amount_received') or intent.get('amount') or 0
+
+    if kind == DEPOSIT:
+        user = User.objects.filter(id=target_id).first()
+        if user is None:
+            raise EventError('Không tìm thấy người dùng nạp tiền')
+        wallet = wallets.get_wallet(user)
+        wallets.lock_wallet(wallet)
+        # Payment intent có thể đã được nạp trước khi có webhook
+        if PayboxTransaction.objects.filter(stripe_payment_intent_id=intent['id']).exists():
+            return
+        wallets.credit(
+            wallet, amount, 'DEPOSIT',
+            description=f'Nạp tiền qua Stripe - {intent["id"]}',
+            stripe_payment_intent_id=intent['id'],
+        )
+        return
+
+    order = Order.objects.filter(id=target_id).first()
+    if order is None:
+        raise EventError('Không tìm thấy đơn hàng')
+    if amount != int(order.totalPrice):
+        raise EventError('Số tiền thanh toán không khớp với đơn hàng')
+    mark_paid(order)
+
+
+def _apply_locked(event):
+    """Áp dụng một sự kiện đang bị khóa và ghi trạng thái trong cùng transaction"""
+    try:
+        with transaction.atomic():
+            _apply(event)
+        event.status, event.error = StripeEvent.APPLIED, ''
+    except (EventError, wallets.WalletError) as exc:
+        event.status, event.error = StripeEvent.FAILED, exc.message
+    event.applied_at = timezone.now()
+    StripeEvent.objects.filter(id=event.id).update(
+        status=event.status, error=event.error, applied_at=event.applied_at,
+    )
+
+
+def apply_batch(batch_size=BATCH_SIZE):
+    """Áp dụng một lô sự kiện đang chờ (cũ nhất trước) trong một transaction; trả về số sự kiện đã xử lý"""
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=StripeEvent.PENDING).order_by('created_at')[:batch_size]
+        )
+        for event in sorted(events, key=_lock_order):
+            _apply_locked(event)
+    return len(events)
+
+
+def apply_for_intent(payment_intent_id):
+    """
+    Sự kiện thanh toán thành công của payment intent, được áp dụng ngay nếu còn đang chờ;
+    None nếu Stripe chưa gửi tới. Sự kiện đang bị worker giữ được trả về với trạng thái đang chờ.
+    """
+    events = StripeEvent.objects.filter(payment_intent_id=payment_intent_id, type__in=HANDLED_TYPES)
+    with transaction.atomic():
+        event = events.select_for_update(skip_locked=True).order_by('created_at').first()
+        if event is not None and event.status == StripeEvent.PENDING:
+            _apply_locked(event)
+    return event or events.order_by('created_at').first()
+
+
+def run_worker(batch_size=BATCH_SIZE, idle_sleep=0.5, once=False):
+    """Vòng lặp áp dụng sự kiện; once=True thì dừng khi không còn sự kiện chờ. Trả về tổng số đã xử lý"""
+    total = 0
+    while True:
+        close_old_connections()
+        try:
+            processed = apply_batch(batch_size)
+        except DatabaseError:
+            # Deadlock/mất kết nối: cả lô được hoàn tác, sự kiện vẫn đang chờ
+            logger.warning('Không áp dụng được lô sự kiện Stripe', exc_info=True)
+            time.sleep(idle_sleep)
+            continue
+        total += processed
+        if not processed:
+            if once:
+                return total
+            time.sleep(idle_sleep)
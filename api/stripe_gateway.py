@@ -0,0 +1,265 @@
+"""
+Gọi API Stripe với giới hạn thời gian, thử lại có giới hạn và ngắt mạch.
+
+Mọi lời gọi Stripe của ứng dụng đi qua StripeGateway (get_gateway()):
+- một requests.Session với pool kết nối (STRIPE_POOL_SIZE) dùng chung cho các luồng, và thời
+  gian chờ cho từng lời gọi (STRIPE_TIMEOUT, có thể truyền timeout riêng);
+- lỗi mạng, timeout, 429 và 5xx được thử lại tối đa STRIPE_MAX_RETRIES lần, chờ ngẫu nhiên
+  (full jitter) tăng dần giữa các lần; POST luôn kèm Idempotency-Key giữ nguyên qua các lần thử
+  nên Stripe không tạo trùng payment intent;
+- sau STRIPE_CIRCUIT_FAILURES lời gọi thất bại liên tiếp, mạch mở: các lời gọi bị từ chối ngay
+  (GatewayUnavailable, view trả 503) thay vì giữ worker chờ Stripe, tới khi hết
+  STRIPE_CIRCUIT_RESET_SECONDS thì cho một lời gọi thử;
+- số lời gọi, lỗi, lần thử lại và độ trễ được đếm theo từng thao tác (metrics, theo process).
+
+Các hàm *_async chạy lời gọi trong thread pool (sync_to_async), dùng được từ view/consumer ASGI
+mà không chặn event loop. Thử với server Stripe giả: manage.py fake_stripe_server hoặc
+bench_stripe_gateway.
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+from urllib.parse import quote
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe import api_requestor, http_client, util
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = getattr(settings, 'STRIPE_TIMEOUT', 10)
+MAX_RETRIES = getattr(settings, 'STRIPE_MAX_RETRIES', 2)
+# Thời gian chờ trước lần thử lại thứ n: ngẫu nhiên trong [0, min(BACKOFF_CAP, BACKOFF * 2^n)]
+BACKOFF = getattr(settings, 'STRIPE_RETRY_BACKOFF', 0.25)
+BACKOFF_CAP = 2.0
+POOL_SIZE = getattr(settings, 'STRIPE_POOL_SIZE', 20)
+CIRCUIT_FAILURES = getattr(settings, 'STRIPE_CIRCUIT_FAILURES', 5)
+CIRCUIT_RESET_SECONDS = getattr(settings, 'STRIPE_CIRCUIT_RESET_SECONDS', 30)
+
+
+class GatewayError(Exception):
+    """Stripe từ chối request (tham số sai, thẻ bị từ chối...); thử lại không có tác dụng"""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class GatewayUnavailable(GatewayError):
+    """Stripe không trả lời được (hết lần thử hoặc mạch đang mở); retry_after: số giây nên chờ"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURES, reset_timeout=CIRCUIT_RESET_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        return max(0, int(self.opened_at + self.reset_timeout - self.clock()) + 1)
+
+    def before_call(self):
+        """Ném GatewayUnavailable nếu mạch đang mở; hết thời gian chờ thì cho đúng một lời gọi thử"""
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return
+            if self.state != self.CLOSED:
+                raise GatewayUnavailable('Cổng thanh toán đang gián đoạn, vui lòng thử lại sau', self.retry_after())
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning('Mở mạch Stripe sau %s lỗi liên tiếp', self.failures)
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                self._trial = False
+
+
+class Metrics:
+    """Số lời gọi theo kết quả, số lần thử lại và độ trễ (ms) theo từng thao tác"""
+    OUTCOMES = ('ok', 'client_error', 'error', 'rejected')
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def _get(self, operation):
+        data = self._operations.get(operation)
+        if data is None:
+            data = self._operations[operation] = {
+                **dict.fromkeys(self.OUTCOMES, 0), 'retries': 0, 'latency_ms_total': 0.0, 'latency_ms_max': 0.0,
+                'latency_buckets': [0] * (len(self.BUCKETS_MS) + 1),
+            }
+        return data
+
+    def observe(self, operation, seconds, outcome):
+        ms = seconds * 1000
+        with self._lock:
+            data = self._get(operation)
+            data[outcome] += 1
+            data['latency_ms_total'] += ms
+            data['latency_ms_max'] = max(data['latency_ms_max'], ms)
+            bucket = next((i for i, bound in enumerate(self.BUCKETS_MS) if ms <= bound), len(self.BUCKETS_MS))
+            data['latency_buckets'][bucket] += 1
+
+    def retry(self, operation):
+        with self._lock:
+            self._get(operation)['retries'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for operation, data in self._operations.items():
+                calls = sum(data[outcome] for outcome in self.OUTCOMES)
+                result[operation] = {
+                    **{key: value for key, value in data.items() if key != 'latency_buckets'},
+                    'calls': calls,
+                    'latency_ms_avg': round(data['latency_ms_total'] / calls, 1) if calls else 0,
+                    'latency_ms_buckets': dict(zip([*map(str, self.BUCKETS_MS), 'inf'], data['latency_buckets'])),
+                }
+            return result
+
+
+def _retryable(exc):
+    if isinstance(exc, (stripe.error.APIConnectionError, stripe.error.RateLimitError)):
+        return True
+    return isinstance(exc, stripe.error.APIError) and (exc.http_status is None or exc.http_status >= 500)
+
+
+class StripeGateway:
+    def __init__(self, api_key=None, api_base=None, timeout=TIMEOUT, max_retries=MAX_RETRIES, backoff=BACKOFF,
+                 pool_size=POOL_SIZE, breaker=None, metrics=None, sleep=time.sleep):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or Metrics()
+        self.sleep = sleep
+        # Một pool kết nối dùng chung cho mọi luồng; thư viện stripe không tự thử lại (max_network_retries = 0)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _requestor(self, timeout):
+        with self._lock:
+            client = self._clients.get(timeout)
+            if client is None:
+                client = self._clients[timeout] = http_client.RequestsClient(timeout=timeout, session=self.session)
+        return api_requestor.APIRequestor(
+            key=self.api_key or stripe.api_key, client=client, api_base=self.api_base or stripe.api_base,
+        )
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(BACKOFF_CAP, self.backoff * 2 ** attempt))
+
+    def call(self, operation, method, url, params=None, timeout=None):
+        """Gọi API Stripe và trả về StripeObject; ném GatewayError/GatewayUnavailable"""
+        started = time.perf_counter()
+        try:
+            self.breaker.before_call()
+        except GatewayUnavailable:
+            self.metrics.observe(operation, 0, 'rejected')
+            raise
+        headers = {'Idempotency-Key': str(uuid.uuid4())} if method == 'post' else None
+        try:
+            requestor = self._requestor(timeout or self.timeout)
+            return self._attempt(operation, requestor, method, url, params, headers, started)
+        except GatewayError:
+            raise
+        except Exception:
+            # Lỗi ngoài StripeError (lỗi requests không được bọc, phản hồi không đọc được...) cũng là một
+            # lần thất bại, để lời gọi thử ở trạng thái half-open không giữ mạch mãi
+            self.breaker.record_failure()
+            self.metrics.observe(operation, time.perf_counter() - started, 'error')
+            raise
+
+    def _attempt(self, operation, requestor, method, url, params, headers, started):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response, api_key = requestor.request(method, url, params, headers)
+            except stripe.error.StripeError as exc:
+                if not _retryable(exc):
+                    # Stripe vẫn trả lời bình thường, lỗi nằm ở request
+                    self.breaker.record_success()
+                    self.metrics.observe(operation, time.perf_counter() - started, 'client_error')
+                    raise GatewayError(exc.user_message or str(exc)) from exc
+                if attempt == self.max_retries:
+                    self.breaker.record_failure()
+                    self.metrics.observe(operation, time.perf_counter() - started, 'error')
+                    logger.warning('Stripe %s thất bại sau %s lần thử: %s', operation, attempt + 1, exc)
+                    raise GatewayUnavailable('Cổng thanh toán đang gián đoạn, vui lòng thử lại sau',
+                                             self.breaker.retry_after()) from exc
+                self.metrics.retry(operation)
+                self.sleep(self._delay(attempt))
+                continue
+            result = util.convert_to_stripe_object(response, api_key, None, None)
+            self.breaker.record_success()
+            self.metrics.observe(operation, time.perf_counter() - started, 'ok')
+            return result
+
+    def create_payment_intent(self, amount, currency='vnd', metadata=None, timeout=None, **params):
+        params = {'amount': amount, 'currency': currency, 'metadata': metadata or {}, **params}
+        return self.call('payment_intent.create', 'post', '/v1/payment_intents', params, timeout)
+
+    def retrieve_payment_intent(self, intent_id, timeout=None):
+        return self.call('payment_intent.retrieve', 'get', f'/v1/payment_intents/{quote(intent_id)}', None, timeout)
+
+    async def create_payment_intent_async(self, *args, **kwargs):
+        return await sync_to_async(self.create_payment_intent, thread_sensitive=False)(*args, **kwargs)
+
+    async def retrieve_payment_intent_async(self, *args, **kwargs):
+        return await sync_to_async(self.retrieve_payment_intent, thread_sensitive=False)(*args, **kwargs)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Gateway dùng chung của process, cấu hình từ settings"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = StripeGateway(api_key=settings.STRIPE_API_KEY, api_base=settings.STRIPE_API_BASE)
+        return _gateway
+
+
+def reset_gateway():
+    """Tạo lại gateway ở lần gọi get_gateway() sau (đổi settings trong test)"""
+    global _gateway
+    with _gateway_lock:
+        _gateway = None
@@ -0,0 +1,91 @@
+"""
+Cập nhật bảng đọc ProductSummary: giá thấp nhất/cao nhất, tổng tồn kho,
+danh sách màu/size còn bán và điểm đánh giá trung bình của từng sản phẩm.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from api.models import Product, ProductSummary, ProductVariant, Review
+
+
+def build_summaries(product_ids):
+    """Tính ProductSummary (chưa lưu) cho danh sách sản phẩm bằng 3 truy vấn"""
+    products = Product.objects.filter(id__in=product_ids).values_list('id', 'has_variants', 'price', 'countInStock')
+
+    variants = defaultdict(list)
+    for row in ProductVariant.objects.filter(product_id__in=product_ids).values_list(
+        'product_id', 'price', 'stock_quantity', 'color_id', 'size_id'
+    ):
+        variants[row[0]].append(row[1:])
+
+    reviews = {
+        row['product_id']: row
+        for row in Review.objects.filter(product_id__in=product_ids)
+        .values('product_id').annotate(count=Count('id'), avg=Avg('rating'))
+    }
+
+    summaries = {}
+    for product_id, has_variants, price, count_in_stock in products:
+        rows = variants.get(product_id, [])
+        if has_variants and rows:
+            prices = [row[0] for row in rows]
+            min_price, max_price = min(prices), max(prices)
+            total_stock = sum(row[1] for row in rows)
+        else:
+            min_price = max_price = price
+            total_stock = 0 if has_variants else (count_in_stock or 0)
+
+        review = reviews.get(product_id)
+        summaries[product_id] = ProductSummary(
+            product_id=product_id,
+            min_price=min_price,
+            max_price=max_price,
+            total_stock=total_stock,
+            color_ids=sorted({row[2] for row in rows}) if has_variants else [],
+            size_ids=sorted({row[3] for row in rows}) if has_variants else [],
+            review_count=review['count'] if review else 0,
+            rating_avg=Decimal(str(round(review['avg'], 2))) if review else None,
+        )
+    return summaries
+
+
+def refresh_product_summary(product_id, create=False):
+    """
+    Tính lại tổng hợp của một sản phẩm trong transaction hiện tại.
+    Chỉ tạo dòng mới khi create=True (khi lưu Product), để các tín hiệu xóa
+    biến thể/đánh giá trong lúc xóa sản phẩm không tạo lại dòng đã bị xóa.
+    """
+    with transaction.atomic():
+        # Khóa dòng tổng hợp để các lần cập nhật đồng thời không ghi đè lẫn nhau
+        exists = ProductSummary.objects.select_for_update().filter(product_id=product_id).exists()
+        if not exists and not create:
+            return None
+        summary = build_summaries([product_id]).get(product_id)
+        if summary is not None:
+            summary.save()
+        return summary
+
+
+def refresh_summaries(product_ids):
+    """Tính lại tổng hợp cho nhiều sản phẩm (sau các thao tác ghi hàng loạt không phát tín hiệu)"""
+    summaries = build_summaries(product_ids)
+    with transaction.atomic():
+        ProductSummary.objects.filter(product_id__in=product_ids).delete()
+        ProductSummary.objects.bulk_create(summaries.values())
+
+
+def rebuild_summaries(batch_size=1000):
+    """Xây lại toàn bộ bảng tổng hợp theo từng lô, trả về số sản phẩm đã xử lý"""
+    total = 0
+    last_id = 0
+    while True:
+        ids = list(Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        refresh_summaries(ids)
+        total += len(ids)
+        last_id = ids[-1]
+    return total
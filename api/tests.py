@@ -1,3 +1,1358 @@
-# from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+import stripe
+from rest_framework.test import APIClient
+
+from api import catalog_cache, facets, fake_stripe, flash_sale, order_intake, sales, sales_rollups, stripe_events, stripe_gateway, wallets
+
+from api.models import (
+    Brand, Category, Color, Favorite, MediaBlob, Order, OrderItem, Product, ProductSummary, ProductVariant, Review,
+    ShippingAddress, Size,
+    FlashSale, IdempotencyKey, OrderIntake, PayboxTransaction, PayboxWallet, RefundRequest, SalesRollup,
+    StockReservation, StripeEvent, WalletSnapshot,
+)
+from api.orders import mark_paid, mark_refunded
+
+
+class ProductListQueryCountTests(TestCase):
+    """Số truy vấn của một trang sản phẩm phải cố định, không tăng theo số sản phẩm"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='secret')
+        cls.brand = Brand.objects.create(title='Nike')
+        cls.category = Category.objects.create(title='Áo')
+        cls.colors = [Color.objects.create(name=name, hex_code='#000000') for name in ('Đỏ', 'Đen')]
+        cls.sizes = [Size.objects.create(name=name, order=order) for order, name in enumerate(('M', 'L'))]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                name=f'Áo thun {i}', brand=self.brand, category=self.category,
+                price=100000, countInStock=5, has_variants=True,
+            )
+            for color in self.colors:
+                for size in self.sizes:
+                    ProductVariant.objects.create(
+                        product=product, color=color, size=size, price=90000 + i, stock_quantity=3,
+                    )
+            Review.objects.create(product=product, user=self.user, name='buyer', rating=5, comment='Tốt')
+            Favorite.objects.create(user=self.user, product=product)
+
+    def test_expanded_page_has_fixed_query_count(self):
+        self.create_products(3)
+        # sản phẩm + biến thể + đánh giá + danh sách yêu thích
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/products/?expand=reviews,variants,available_colors,available_sizes')
+        self.assertEqual(len(response.data['results']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_products(20)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/products/?expand=reviews,variants,available_colors,available_sizes')
+        self.assertEqual(len(response.data['results']), 23)
+
+        product = response.data['results'][0]
+        self.assertTrue(product['is_favorite'])
+        self.assertEqual(product['total_stock'], 12)
+        self.assertEqual(len(product['available_colors']), 2)
+        self.assertEqual([size['name'] for size in product['available_sizes']], ['M', 'L'])
+
+    def test_summary_page_skips_prefetch(self):
+        self.create_products(10)
+        # sản phẩm + danh sách yêu thích
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products/')
+        self.assertNotIn('variants', response.data['results'][0])
+
+    def test_favorites_have_fixed_query_count(self):
+        self.create_products(10)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/favorites/')
+        self.assertEqual(len(response.data), 10)
+        self.assertTrue(all(product['is_favorite'] for product in response.data))
+
+
+class ProductListPaginationTests(TestCase):
+    """Danh sách sản phẩm: phân trang theo con trỏ, ?fields= và ?expand="""
+
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Nike')
+        category = Category.objects.create(title='Áo')
+        red = Color.objects.create(name='Đỏ', hex_code='#FF0000')
+        size = Size.objects.create(name='M', order=1)
+        cls.products = [
+            Product.objects.create(name=f'Áo {i}', brand=brand, category=category, price=100000, has_variants=True)
+            for i in range(5)
+        ]
+        # Hai sản phẩm trùng createdAt: thứ tự phải được giữ bằng id
+        Product.objects.filter(id__in=[cls.products[1].id, cls.products[2].id]).update(
+            createdAt=cls.products[1].createdAt
+        )
+        ProductVariant.objects.create(product=cls.products[0], color=red, size=size, price=90000, stock_quantity=2)
+        cls.expected = list(Product.objects.order_by('-createdAt', '-id').values_list('id', flat=True))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_cursor_pages_cover_every_product_once(self):
+        data = self.get('/api/products/', {'page_size': 2})
+        self.assertIsNone(data['previous'])
+        self.assertIn('cursor=', data['next'])
+        self.assertNotIn('count', data)
+
+        pages = [[item['id'] for item in data['results']]]
+        while data['next']:
+            data = self.get(data['next'])
+            pages.append([item['id'] for item in data['results']])
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), self.expected)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.get('/api/products/', {'page_size': 2})
+        second = self.get(first['next'])
+        self.assertIsNotNone(second['previous'])
+        previous = self.get(second['previous'])
+        self.assertEqual([item['id'] for item in previous['results']], [item['id'] for item in first['results']])
+
+    def test_fields_trims_and_ignores_unknown_names(self):
+        data = self.get('/api/products/', {'fields': 'id,name,khong_ton_tai'})
+        self.assertEqual([set(item) for item in data['results']], [{'id', 'name'}] * 5)
+
+        item = self.get(f'/api/products/{self.products[0].id}/', {'fields': 'id,price'})
+        self.assertEqual(set(item), {'id', 'price'})
+
+    def test_summary_by_default_and_expand_embeds_related(self):
+        item = self.get('/api/products/')['results'][-1]
+        self.assertEqual(item['id'], self.products[0].id)
+        self.assertNotIn('variants', item)
+        self.assertNotIn('description', item)
+
+        data = self.get('/api/products/', {'fields': 'id', 'expand': 'variants,available_colors,khong_ton_tai'})
+        item = data['results'][-1]
+        self.assertEqual(set(item), {'id', 'variants', 'available_colors'})
+        self.assertEqual([variant['price'] for variant in item['variants']], ['90000'])
+        self.assertEqual([color['name'] for color in item['available_colors']], ['Đỏ'])
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Uniqlo')
+        category = Category.objects.create(title='Áo khoác')
+        cls.tshirt = Product.objects.create(name='Áo thun cổ tròn', brand=brand, category=category, price=1)
+        cls.jacket = Product.objects.create(
+            name='Khoác gió', brand=brand, category=category, price=1, description='Chất liệu thun co giãn'
+        )
+        cls.shoes = Product.objects.create(name='Giày thể thao', brand=brand, category=Category.objects.create(title='Giày'), price=1)
+
+    def search(self, query):
+        response = APIClient().get('/api/products/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_accent_insensitive_and_ranked(self):
+        self.assertEqual(self.search('ao thun'), [self.tshirt.id, self.jacket.id])
+
+    def test_prefix_match(self):
+        self.assertEqual(self.search('giay th'), [self.shoes.id])
+
+    def test_limit_must_be_positive(self):
+        for limit in ('0', '-1', 'abc'):
+            response = APIClient().get('/api/products/search/', {'q': 'ao thun', 'limit': limit})
+            self.assertEqual(response.status_code, 400)
+        response = APIClient().get('/api/products/search/', {'q': 'ao thun', 'limit': 1})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.tshirt.id])
+
+    def test_index_follows_product_and_category_updates(self):
+        self.shoes.name = 'Dép quai ngang'
+        self.shoes.save()
+        self.assertEqual(self.search('giay the thao'), [])
+        self.assertEqual(self.search('dep'), [self.shoes.id])
+
+        category = self.shoes.category
+        category.title = 'Sandal'
+        category.save()
+        self.assertEqual(self.search('sandal'), [self.shoes.id])
+
+
+@mock.patch('api.facets.REBUILD_INTERVAL', 0)
+class ProductFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        nike = Brand.objects.create(title='Nike')
+        cls.zara = Brand.objects.create(title='Zara')
+        category = Category.objects.create(title='Áo')
+        cls.red = Color.objects.create(name='Đỏ', hex_code='#FF0000')
+        cls.black = Color.objects.create(name='Đen', hex_code='#000000')
+        cls.size_l = Size.objects.create(name='L', order=1)
+
+        cls.cheap = Product.objects.create(name='A', brand=nike, category=category, price=50000, countInStock=3)
+        cls.red_shirt = Product.objects.create(name='B', brand=nike, category=category, price=900000, has_variants=True)
+        ProductVariant.objects.create(product=cls.red_shirt, color=cls.red, size=cls.size_l, price=250000, stock_quantity=2)
+        cls.black_shirt = Product.objects.create(name='C', brand=cls.zara, category=category, price=400000, has_variants=True)
+        ProductVariant.objects.create(product=cls.black_shirt, color=cls.black, size=cls.size_l, price=400000, stock_quantity=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, **params):
+        response = APIClient().get('/api/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_sort_by_variant_min_price(self):
+        data = self.get(ordering='price')
+        self.assertEqual([item['id'] for item in data['results']], [self.cheap.id, self.red_shirt.id, self.black_shirt.id])
+        data = self.get(ordering='-price', page_size=1)
+        self.assertEqual([item['id'] for item in data['results']], [self.black_shirt.id])
+        self.assertIsNotNone(data['next'])
+
+    def test_products_without_price_sort_last(self):
+        unpriced = Product.objects.create(name='D', brand=self.zara, category=self.cheap.category, price=None)
+        data = self.get(ordering='price')
+        self.assertEqual([item['id'] for item in data['results']][-1], unpriced.id)
+        data = self.get(ordering='-price')
+        self.assertEqual([item['id'] for item in data['results']],
+                         [self.black_shirt.id, self.red_shirt.id, self.cheap.id, unpriced.id])
+
+    def test_filtered_list_uses_cursor_links(self):
+        client = APIClient()
+        response = client.get('/api/products/', {'ordering': 'price', 'page_size': 2})
+        data = response.data
+        self.assertEqual(list(data), ['next', 'previous', 'results', 'count', 'facets'])
+        self.assertIsNone(data['previous'])
+        self.assertIn('cursor=', data['next'])
+        self.assertEqual(data['count'], 3)
+
+        second = client.get(data['next']).data
+        self.assertEqual([item['id'] for item in second['results']], [self.black_shirt.id])
+        self.assertIsNone(second['next'])
+        first = client.get(second['previous']).data
+        self.assertEqual([item['id'] for item in first['results']], [self.cheap.id, self.red_shirt.id])
+        self.assertNotIn('cursor=', second['previous'])
+
+        self.assertEqual(client.get('/api/products/', {'ordering': 'price', 'cursor': 'khong-hop-le'}).status_code, 404)
+
+    def test_invalid_filter_value(self):
+        response = APIClient().get('/api/products/', {'brand': 'nike'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Giá trị bộ lọc không hợp lệ')
+
+    def test_non_finite_price_bound_rejected(self):
+        for params in ({'min_price': 'nan'}, {'max_price': 'sNaN'}, {'min_price': 'Infinity'}):
+            response = APIClient().get('/api/products/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['detail'], 'Giá trị bộ lọc không hợp lệ')
+
+    def test_filters_and_facet_counts(self):
+        data = self.get(color=self.red.id)
+        self.assertEqual([item['id'] for item in data['results']], [self.red_shirt.id])
+        self.assertEqual(data['facets']['color'], {self.red.id: 1, self.black.id: 1})
+        self.assertEqual(data['facets']['brand'], {self.red_shirt.brand_id: 1})
+        self.assertEqual(data['facets']['price']['100k-300k'], 1)
+
+        data = self.get(min_price=200000, max_price=500000, in_stock='true')
+        self.assertEqual([item['id'] for item in data['results']], [self.red_shirt.id])
+        self.assertEqual(data['facets']['in_stock'], 1)
+
+    def test_index_follows_variant_changes(self):
+        self.assertEqual(self.get(brand=self.zara.id, in_stock='1')['count'], 0)
+        variant = ProductVariant.objects.get(product=self.black_shirt)
+        variant.stock_quantity = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.save()
+        self.assertEqual(self.get(brand=self.zara.id, in_stock='1')['count'], 1)
+
+
+class ProductSummaryTests(TestCase):
+    def test_summary_follows_variant_and_review_writes(self):
+        user = User.objects.create_user(username='buyer', password='secret')
+        product = Product.objects.create(
+            name='Áo', brand=Brand.objects.create(title='Nike'), category=Category.objects.create(title='Áo'),
+            price=100000, countInStock=7,
+        )
+        self.assertEqual((product.summary.min_price, product.summary.total_stock), (100000, 7))
+
+        product.has_variants = True
+        product.save()
+        red = Color.objects.create(name='Đỏ', hex_code='#FF0000')
+        size = Size.objects.create(name='M', order=1)
+        variant = ProductVariant.objects.create(product=product, color=red, size=size, price=80000, stock_quantity=4)
+        ProductVariant.objects.create(product=product, color=red, size=Size.objects.create(name='L', order=2), price=95000, stock_quantity=1)
+        Review.objects.create(product=product, user=user, rating=4)
+        Review.objects.create(product=product, user=user, rating=5)
+
+        summary = Product.objects.with_stock_summary().get(id=product.id).summary
+        self.assertEqual((summary.min_price, summary.max_price, summary.total_stock), (80000, 95000, 5))
+        self.assertEqual(summary.color_ids, [red.id])
+        self.assertEqual((summary.review_count, summary.rating_avg), (2, Decimal('4.50')))
+
+        variant.delete()
+        product.refresh_from_db()
+        self.assertEqual(product.get_min_price(), 95000)
+        self.assertEqual(product.get_total_stock(), 1)
+
+        product.delete()
+        self.assertFalse(ProductSummary.objects.exists())
+
+
+class ProductResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', password='secret')
+        cls.bob = User.objects.create_user(username='bob', password='secret')
+        cls.product = Product.objects.create(
+            name='Áo', brand=Brand.objects.create(title='Nike'), category=Category.objects.create(title='Áo'), price=1,
+        )
+        Favorite.objects.create(user=cls.alice, product=cls.product)
+
+    def setUp(self):
+        cache.clear()
+
+    def client_for(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def test_cached_detail_revalidates_with_etag(self):
+        url = f'/api/products/{self.product.id}/'
+        response = self.client_for().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            cached = self.client_for().get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, user=self.bob, rating=5, comment='Tốt')
+        fresh = self.client_for().get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(len(fresh.data['reviews']), 1)
+
+    def test_is_favorite_is_per_user_on_shared_entry(self):
+        alice = self.client_for(self.alice).get('/api/products/')
+        with self.assertNumQueries(1):
+            bob = self.client_for(self.bob).get('/api/products/')
+        self.assertTrue(alice.data['results'][0]['is_favorite'])
+        self.assertFalse(bob.data['results'][0]['is_favorite'])
+        self.assertNotEqual(alice['ETag'], bob['ETag'])
+
+    def test_brand_change_invalidates_list(self):
+        first = self.client_for().get('/api/products/')
+        with self.assertNumQueries(0):
+            self.client_for().get('/api/products/')
+
+        self.product.brand.title = 'Adidas'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.brand.save()
+        with self.assertNumQueries(1):
+            second = self.client_for().get('/api/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+        # Dữ liệu danh sách không đổi nên ETag vẫn khớp sau khi dựng lại
+        self.assertEqual(second.status_code, 304)
+
+    @mock.patch.dict(facets._state, {'index': None, 'built_at': 0})
+    def test_filtered_list_from_stale_facet_index_is_not_cached(self):
+        # Giữ REBUILD_INTERVAL thật, chỉ giả lập đồng hồ của chỉ mục
+        params = {'brand': self.product.brand_id, 'in_stock': '1'}
+        with mock.patch('api.facets.time') as clock:
+            clock.monotonic.return_value = 1000
+            self.assertEqual(self.client_for().get('/api/products/', params).data['count'], 0)
+
+            self.product.countInStock = 3
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.save()
+            clock.monotonic.return_value = 1001
+            # Chỉ mục chưa được xây lại nên kết quả còn cũ, nhưng không được cache dưới phiên bản mới
+            self.assertEqual(self.client_for().get('/api/products/', params).data['count'], 0)
+
+            clock.monotonic.return_value = 1000 + facets.REBUILD_INTERVAL
+            self.assertEqual(self.client_for().get('/api/products/', params).data['count'], 1)
+
+
+class VariantMatrixTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            name='Áo', brand=Brand.objects.create(title='Nike'), category=Category.objects.create(title='Áo'),
+            price=1, has_variants=True,
+        )
+        cls.red = Color.objects.create(name='Đỏ', hex_code='#FF0000')
+        cls.blue = Color.objects.create(name='Xanh', hex_code='#0000FF')
+        cls.size_m = Size.objects.create(name='M', order=1)
+        cls.size_l = Size.objects.create(name='L', order=2)
+        cls.red_l = ProductVariant.objects.create(product=cls.product, color=cls.red, size=cls.size_l, price=120000, stock_quantity=4)
+        ProductVariant.objects.create(product=cls.product, color=cls.blue, size=cls.size_m, price=100000, stock_quantity=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_matrix(self):
+        response = APIClient().get(f'/api/products/{self.product.id}/variant-matrix/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def cell(self, data, color, size):
+        colors = [item['id'] for item in data['colors']]
+        sizes = [item['id'] for item in data['sizes']]
+        index = data['grid'][colors.index(color.id) * len(sizes) + sizes.index(size.id)]
+        return dict(zip(data['fields'], data['variants'][index])) if index >= 0 else None
+
+    def test_grid_cells(self):
+        data = self.get_matrix()
+        self.assertEqual([size['name'] for size in data['sizes']], ['M', 'L'])
+        self.assertEqual(len(data['grid']), 4)
+        self.assertEqual(self.cell(data, self.red, self.size_l), {
+            'id': self.red_l.id, 'price': 120000, 'stock': 4, 'sku': self.red_l.sku,
+        })
+        self.assertIsNone(self.cell(data, self.red, self.size_m))
+
+    def test_cached_until_variant_changes(self):
+        self.get_matrix()
+        with self.assertNumQueries(0):
+            self.get_matrix()
+
+        self.red_l.stock_quantity = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            self.red_l.save()
+        self.assertEqual(self.cell(self.get_matrix(), self.red, self.size_l)['stock'], 1)
+
+    def test_unknown_product(self):
+        self.assertEqual(APIClient().get('/api/products/999999/variant-matrix/').status_code, 404)
+
+    def test_versions_bumped_after_commit(self):
+        keys = (catalog_cache.CATALOG_VERSION_KEY, catalog_cache.PRODUCT_VERSION_KEY.format(self.product.id))
+        versions = cache.get_many(keys)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.red.name = 'Đỏ tươi'
+            self.red.save()
+        # Trong transaction, request khác không được thấy phiên bản mới trước dữ liệu mới
+        self.assertEqual(cache.get_many(keys), versions)
+
+        for callback in callbacks:
+            callback()
+        bumped = cache.get_many(keys)
+        for key in keys:
+            self.assertNotEqual(bumped.get(key), versions.get(key))
+
+
+class VariantBulkUpsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', password='secret', is_staff=True)
+        cls.product = Product.objects.create(
+            name='Áo', brand=Brand.objects.create(title='Nike'), category=Category.objects.create(title='Áo'),
+            price=1, has_variants=True,
+        )
+        cls.red = Color.objects.create(name='Đỏ', hex_code='#FF0000')
+        cls.size_m = Size.objects.create(name='M', order=1)
+        cls.size_l = Size.objects.create(name='L', order=2)
+        cls.existing = ProductVariant.objects.create(product=cls.product, color=cls.red, size=cls.size_m, price=100000, stock_quantity=1)
+
+    def post(self, rows):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        return client.post('/api/product-variants/', rows, format='json')
+
+    def test_creates_and_updates_in_one_request(self):
+        # Số truy vấn cố định theo lô: đọc màu/size/biến thể/SKU, ghi hàng loạt, tính lại tổng hợp
+        with self.assertNumQueries(17):
+            response = self.post([
+                {'product': self.product.id, 'color_id': self.red.id, 'size_id': self.size_m.id, 'stock_quantity': 9},
+                {'product': self.product.id, 'color': 'Đỏ', 'size': 'L', 'price': 150000, 'stock_quantity': 2},
+            ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assertEqual(response.data['results'][1]['sku'], f'{self.product.id}-ĐỎ-L')
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.price, self.existing.stock_quantity), (100000, 9))
+        self.assertEqual(ProductVariant.objects.get(id=response.data['results'][1]['id']).price, 150000)
+        summary = ProductSummary.objects.get(product=self.product)
+        self.assertEqual((summary.max_price, summary.total_stock), (150000, 11))
+
+    def test_invalid_row_rejects_whole_batch(self):
+        response = self.post([
+            {'product': self.product.id, 'color_id': self.red.id, 'size_id': self.size_l.id, 'price': 1},
+            {'product': self.product.id, 'color': 'Tím', 'size': 'L', 'price': 1},
+            {'product': self.product.id, 'color_id': self.red.id, 'size_id': self.size_l.id, 'sku': self.existing.sku},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result.get('status') for result in response.data['results']], [None, 'error', 'error'])
+        self.assertIn('color', response.data['results'][1]['errors'])
+        self.assertEqual(ProductVariant.objects.count(), 1)
+
+
+class ImportCatalogTests(TestCase):
+    CSV = (
+        'external_id,name,brand,category,price,color,color_hex,size,variant_price,stock_quantity\n'
+        'A1,Áo thun,Nike,Áo,200000,Đỏ,#FF0000,M,190000,3\n'
+        'A1,Áo thun,Nike,Áo,200000,Đỏ,#FF0000,L,,2\n'
+        'B1,Mũ,Nike,Phụ kiện,50000,,,,,\n'
+        ',Thiếu mã,Nike,Áo,1,,,,,\n'
+    )
+
+    def write(self, suffix, content):
+        handle = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8')
+        handle.write(content)
+        handle.close()
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command('import_catalog', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_import_is_idempotent(self):
+        path = self.write('.csv', self.CSV)
+        output = self.run_import(path)
+        self.assertIn('Dòng 5: thiếu external_id', output)
+
+        shirt = Product.objects.get(external_id='A1')
+        self.assertTrue(shirt.has_variants)
+        self.assertEqual(shirt.brand.title, 'Nike')
+        self.assertEqual(
+            sorted(shirt.variants.values_list('size__name', 'price', 'stock_quantity')),
+            [('L', 200000, 2), ('M', 190000, 3)],
+        )
+        self.assertEqual(shirt.summary.total_stock, 5)
+        self.assertEqual(Product.objects.get(external_id='B1').category.title, 'Phụ kiện')
+
+        self.run_import(path)
+        self.assertEqual((Product.objects.count(), ProductVariant.objects.count(), Brand.objects.count()), (2, 2, 1))
+
+    def test_ndjson_resume_skips_committed_batches(self):
+        lines = [
+            {'external_id': f'P{i}', 'name': f'Áo {i}', 'brand': 'Zara', 'category': 'Áo', 'price': 1000,
+             'variants': [{'color': 'Đen', 'size': 'M', 'stock_quantity': i}]}
+            for i in range(5)
+        ]
+        path = self.write('.ndjson', '\n'.join(json.dumps(line) for line in lines))
+        with open(path + '.import-state', 'w') as handle:
+            json.dump({'size': os.path.getsize(path), 'records': 3, 'stats': {'records': 3}}, handle)
+
+        self.run_import(path, '--resume', '--batch-size', '2')
+        self.assertEqual(sorted(Product.objects.values_list('external_id', flat=True)), ['P3', 'P4'])
+        self.assertFalse(os.path.exists(path + '.import-state'))
+
+    def test_import_counts_image_references(self):
+        old, new = (MediaBlob.objects.create(name=f'blobs/{c * 2}/{c * 64}.jpg', sha256=c * 64, size=1) for c in 'ab')
+        rows = 'external_id,name,brand,category,price,image\nA1,Áo,Nike,Áo,1,{}\nA2,Quần,Nike,Áo,1,{}\n'
+        self.run_import(self.write('.csv', rows.format(old.name, old.name)))
+        old.refresh_from_db()
+        self.assertEqual(old.ref_count, 2)
+
+        # Chạy lại không đổi ảnh thì không tăng; đổi ảnh thì trả tham chiếu cũ
+        self.run_import(self.write('.csv', rows.format(old.name, new.name)))
+        old.refresh_from_db()
+        new.refresh_from_db()
+        self.assertEqual((old.ref_count, new.ref_count), (1, 1))
+
+        call_command('gc_media_blobs', '--grace-hours', '0', stdout=StringIO())
+        self.assertEqual(MediaBlob.objects.count(), 2)
+
+
+class TempMediaRootMixin:
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+    def make_jpeg(self, size=(2000, 1500)):
+        buffer = BytesIO()
+        Image.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG', quality=95)
+        return buffer.getvalue()
+
+
+class ImageDerivativeTests(TempMediaRootMixin, TestCase):
+    def test_upload_generates_derivatives(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='admin', password='secret'))
+        upload = SimpleUploadedFile('shirt.jpg', self.make_jpeg(), content_type='image/jpeg')
+        response = client.post('/api/upload-image/', {'image': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        card = response.data['image_urls']['card']
+        path = os.path.join(self.media_root, card['webp'][len('/images/'):])
+        with Image.open(path) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (480, 360)))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, card['src'][len('/images/'):])))
+
+    def test_old_image_backfilled_on_first_request(self):
+        with open(os.path.join(self.media_root, 'old.jpg'), 'wb') as handle:
+            handle.write(self.make_jpeg((800, 800)))
+        Product.objects.create(
+            name='Áo', image='old.jpg', brand=Brand.objects.create(title='Nike'),
+            category=Category.objects.create(title='Áo'), price=1,
+        )
+        urls = APIClient().get('/api/products/').data['results'][0]['image_urls']
+        url = urls['thumbnail']['src'].replace('http://testserver', '')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (160, 160))
+
+        self.assertEqual(self.client.get('/images/derivatives/card/missing.jpg.webp').status_code, 404)
+        self.assertEqual(self.client.get('/images/derivatives/huge/old.jpg.webp').status_code, 404)
+
+
+class ContentAddressedStorageTests(TempMediaRootMixin, TestCase):
+    def upload(self, content):
+        client = APIClient()
+        client.force_authenticate(User.objects.get_or_create(username='admin')[0])
+        upload = SimpleUploadedFile('photo.jpg', content, content_type='image/jpeg')
+        response = client.post('/api/upload-image/', {'image': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data['image_url']
+
+    def test_identical_uploads_share_one_blob(self):
+        content = self.make_jpeg((300, 200))
+        first, second = self.upload(content), self.upload(content)
+        self.assertEqual(first, second)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 0)
+
+        name = first[len('/images/'):]
+        product = Product.objects.create(
+            name='Áo', image=name, brand=Brand.objects.create(title='Nike'),
+            category=Category.objects.create(title='Áo'), price=1,
+        )
+        order = Order.objects.create(user=User.objects.get(username='admin'), taxPrice=0, shippingPrice=0, totalPrice=1)
+        OrderItem.objects.create(order=order, product=product, price=1, image=product.image.name)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+
+        product.delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        call_command('gc_media_blobs', '--grace-hours', '0', stdout=StringIO())
+        self.assertTrue(MediaBlob.objects.exists())
+
+        OrderItem.objects.all().delete()
+        call_command('gc_media_blobs', '--grace-hours', '0', stdout=StringIO())
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_blob_served_immutable_with_strong_etag(self):
+        url = self.upload(self.make_jpeg((300, 200)))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], '"{}"'.format(MediaBlob.objects.get().sha256))
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_extension_follows_image_content_not_filename(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get_or_create(username='admin')[0])
+        page = SimpleUploadedFile('x.html', b'<script>alert(1)</script>', content_type='image/png')
+        response = client.post('/api/upload-image/', {'image': page}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MediaBlob.objects.exists())
+
+        buffer = BytesIO()
+        Image.new('RGB', (20, 20)).save(buffer, 'PNG')
+        image = SimpleUploadedFile('x.html', buffer.getvalue(), content_type='image/png')
+        url = client.post('/api/upload-image/', {'image': image}, format='multipart').data['image_url']
+        self.assertTrue(url.endswith('.png'))
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_non_image_media_is_served_as_download(self):
+        with open(os.path.join(self.media_root, 'old.html'), 'w') as handle:
+            handle.write('<script>alert(1)</script>')
+        response = self.client.get('/images/old.html')
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertTrue(response['Content-Disposition'].startswith('attachment'))
+
+
+class ChunkedUploadTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('api.uploads.TEMP_DIR', os.path.join(self.media_root, 'tmp'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='admin', password='secret'))
+
+    def start(self, content, filename='photo.jpg'):
+        response = self.client.post('/api/uploads/', {'filename': filename, 'size': len(content)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def send(self, upload_id, offset, chunk):
+        return self.client.generic(
+            'PATCH', f'/api/uploads/{upload_id}/', chunk,
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_upload_in_chunks_and_resume(self):
+        content = self.make_jpeg((1200, 900))
+        # Tên file client gửi không quyết định đuôi của blob
+        upload_id = self.start(content, filename='photo.png')
+        chunk = len(content) // 3 + 1
+
+        self.assertEqual(self.send(upload_id, 0, content[:chunk]).data['offset'], chunk)
+        # Gửi lại sai offset (mất phản hồi) -> 409 kèm offset hiện tại để client gửi tiếp
+        conflict = self.send(upload_id, 0, content[:chunk])
+        self.assertEqual((conflict.status_code, conflict.data['offset']), (409, chunk))
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['offset'], chunk)
+
+        for offset in range(chunk, len(content), chunk):
+            response = self.send(upload_id, offset, content[offset:offset + chunk])
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/', format='json')
+        self.assertEqual(response.status_code, 201)
+
+        blob = MediaBlob.objects.get()
+        self.assertEqual(response.data['image_url'], '/images/' + blob.name)
+        self.assertTrue(blob.name.endswith('.jpg'))
+        with open(os.path.join(self.media_root, blob.name), 'rb') as handle:
+            self.assertEqual(handle.read(), content)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.media_root, response.data['image_urls']['card']['webp'][len('/images/'):]
+        )))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'tmp')), [])
+
+    def test_rejects_non_image_and_incomplete_upload(self):
+        content = b'<?php echo 1; ?>' + b'x' * 100
+        upload_id = self.start(content)
+        self.assertEqual(self.send(upload_id, 0, content).status_code, 400)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['offset'], 0)
+
+        content = self.make_jpeg((300, 200))
+        upload_id = self.start(content)
+        self.send(upload_id, 0, content[:100])
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/').status_code, 409)
+        self.assertFalse(MediaBlob.objects.exists())
+
+
+class OrderListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', password='secret', is_staff=True)
+        cls.buyers = [User.objects.create_user(username=f'buyer{i}') for i in range(2)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_orders(self, user, count, **fields):
+        for _ in range(count):
+            order = Order.objects.create(user=user, taxPrice=0, shippingPrice=0, totalPrice=100, **fields)
+            ShippingAddress.objects.create(order=order, address='1 Lê Lợi', city='HCM', postalCode='1', country='VN')
+            for name in ('Áo', 'Quần'):
+                OrderItem.objects.create(order=order, productName=name, qty=1, price=50)
+
+    def test_page_has_fixed_query_count(self):
+        self.create_orders(self.buyers[0], 3)
+        # đơn (kèm user, địa chỉ) + các dòng đơn
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/')
+        self.assertEqual(len(response.data['results']), 3)
+
+        self.create_orders(self.buyers[1], 15)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/')
+        self.assertEqual(len(response.data['results']), 18)
+        self.assertEqual(len(response.data['results'][0]['orderItems']), 2)
+        self.assertEqual(response.data['results'][0]['shippingAddress']['city'], 'HCM')
+
+    def test_filters_and_pagination(self):
+        self.create_orders(self.buyers[0], 3, isPaid=True)
+        self.create_orders(self.buyers[1], 2)
+        Order.objects.filter(user=self.buyers[1]).update(createdAt=timezone.now() - timedelta(days=10))
+
+        self.assertEqual(len(self.client.get('/api/orders/?paid=true').data['results']), 3)
+        self.assertEqual(len(self.client.get(f'/api/orders/?user={self.buyers[1].id}').data['results']), 2)
+        day = (timezone.now() - timedelta(days=10)).date().isoformat()
+        response = self.client.get(f'/api/orders/?created_from={day}&created_to={day}&paid=false')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(self.client.get('/api/orders/?paid=maybe').status_code, 400)
+
+        page = self.client.get('/api/orders/?page_size=2').data
+        self.assertEqual(len(page['results']), 2)
+        self.assertEqual(len(self.client.get(page['next']).data['results']), 2)
+
+        # Người dùng thường chỉ thấy đơn của mình, ?user= bị bỏ qua
+        self.client.force_authenticate(self.buyers[1])
+        results = self.client.get(f'/api/orders/?user={self.buyers[0].id}').data['results']
+        self.assertEqual({order['user']['id'] for order in results}, {self.buyers[1].id})
+
+
+class CheckoutTestMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='secret')
+        cls.product = Product.objects.create(
+            name='Áo', brand=Brand.objects.create(title='Nike'), category=Category.objects.create(title='Áo'),
+            price=100, has_variants=True,
+        )
+        color = Color.objects.create(name='Đỏ', hex_code='#ff0000')
+        cls.variants = [
+            ProductVariant.objects.create(product=cls.product, color=color, size=Size.objects.create(name=name),
+                                          price=120, stock_quantity=5)
+            for name in ('M', 'L')
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place(self, *items):
+        return self.client.post('/api/placeorder/', {
+            'orderItems': [{'id': self.product.id, 'variant_id': variant.id, 'qty': qty} for variant, qty in items],
+            'paymentMethod': 'COD', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 240,
+            'shippingAddress': {'address': '1 Lê Lợi', 'city': 'HCM', 'postalCode': '70000', 'country': 'VN'},
+        }, format='json')
+
+    def stocks(self):
+        return list(ProductVariant.objects.filter(product=self.product).order_by('id').values_list('stock_quantity', flat=True))
+
+
+class PlaceOrderTests(CheckoutTestMixin, TestCase):
+    def test_decrements_stock_and_summary(self):
+        m, l = self.variants
+        response = self.place((m, 2), (l, 1), (m, 1))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stocks(), [2, 4])
+        self.assertEqual(ProductSummary.objects.get(product=self.product).total_stock, 6)
+        self.assertEqual(len(response.data['orderItems']), 3)
+
+    def test_shortage_rolls_back_whole_order(self):
+        m, l = self.variants
+        response = self.place((m, 1), (l, 6))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Chỉ còn 5', response.data['error'])
+        self.assertEqual(self.stocks(), [5, 5])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.place((m, -3)).status_code, 400)
+
+    def test_reservations_hold_stock_until_order_or_expiry(self):
+        m, l = self.variants
+        response = self.client.put('/api/cart/reservations/', {'items': [
+            {'id': self.product.id, 'variant_id': m.id, 'qty': 3},
+            {'id': self.product.id, 'variant_id': l.id, 'qty': 2},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stocks(), [2, 3])
+        self.assertEqual(ProductSummary.objects.get(product=self.product).total_stock, 5)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other'))
+        conflict = other.put('/api/cart/reservations/', {'items': [
+            {'id': self.product.id, 'variant_id': m.id, 'qty': 3},
+        ]}, format='json')
+        self.assertEqual((conflict.status_code, conflict.data['items'][0]['held']), (409, 0))
+
+        # Mua 2/3 cái M đang giữ: phần dư được trả lại kho, L vẫn được giữ
+        self.assertEqual(self.place((m, 2)).status_code, 201)
+        self.assertEqual(self.stocks(), [3, 3])
+        self.assertEqual(StockReservation.objects.get(user=self.user).qty, 2)
+
+        StockReservation.objects.update(expires_at=timezone.now())
+        call_command('release_expired_reservations', stdout=StringIO())
+        self.assertEqual(self.stocks(), [3, 5])
+        self.assertEqual(ProductSummary.objects.get(product=self.product).total_stock, 8)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class IdempotencyKeyTests(CheckoutTestMixin, TestCase):
+    def test_retry_with_same_key_replays_response(self):
+        m, l = self.variants
+        self.client.credentials(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        first = self.place((m, 2))
+        second = self.place((m, 2))
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.stocks(), [3, 5])
+
+        self.assertEqual(self.place((l, 1)).status_code, 422)
+        # Key khác là đơn khác; lỗi (hết hàng) không được lưu nên có thể thử lại cùng key
+        self.client.credentials(HTTP_IDEMPOTENCY_KEY='checkout-2')
+        self.assertEqual(self.place((l, 9)).status_code, 400)
+        self.assertEqual(self.place((l, 9)).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.filter(key='checkout-2').exists())
+
+    def test_duplicate_waits_for_request_in_progress(self):
+        m, l = self.variants
+        self.client.credentials(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.place((m, 1))
+        IdempotencyKey.objects.update(response_status=None, response_body=None)
+        with mock.patch('api.idempotency.WAIT_SECONDS', 0.1):
+            response = self.place((m, 1))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class ProductSalesTests(CheckoutTestMixin, TestCase):
+    def total_sold(self):
+        self.product.refresh_from_db()
+        return self.product.total_sold
+
+    def test_paybox_payment_counts_sales_once(self):
+        m, l = self.variants
+        order_id = self.place((m, 2), (l, 1)).data['id']
+        PayboxWallet.objects.create(user=self.user, balance=1000)
+        response = self.client.post('/api/paybox/payment/', {'order_id': order_id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.total_sold(), 3)
+        self.assertEqual(self.client.post('/api/paybox/payment/', {'order_id': order_id}, format='json').status_code, 400)
+        self.assertEqual(self.total_sold(), 3)
+        self.assertEqual(PayboxWallet.objects.get(user=self.user).balance, 760)
+
+    def test_mark_paid_is_applied_once(self):
+        m, l = self.variants
+        order = Order.objects.get(id=self.place((m, 2)).data['id'])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(mark_paid(order))
+        # Một UPDATE cộng số đã bán cho cả đơn
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "api_product"') for query in queries), 1)
+        self.assertFalse(mark_paid(Order.objects.get(id=order.id)))
+        self.assertEqual(self.total_sold(), 2)
+
+    def test_rebuild_and_incremental_sync(self):
+        m, l = self.variants
+        paid = Order.objects.get(id=self.place((m, 2)).data['id'])
+        Order.objects.filter(id=paid.id).update(isPaid=True, paidAt=timezone.now() - timedelta(days=2))
+        call_command('update_product_sales', stdout=StringIO())
+        self.assertEqual(self.total_sold(), 2)
+
+        # Đơn được đánh dấu thanh toán ngoài các luồng thanh toán: lần chạy tăng dần sửa lại
+        other = Order.objects.get(id=self.place((l, 1)).data['id'])
+        Order.objects.filter(id=other.id).update(isPaid=True, paidAt=timezone.now())
+        Product.objects.filter(id=self.product.id).update(total_sold=0)
+        self.assertEqual(sales.sync_total_sold()[0], 1)
+        self.assertEqual(self.total_sold(), 3)
+        self.assertEqual(sales.sync_total_sold()[0], 0)
+
+
+class WalletTests(CheckoutTestMixin, TestCase):
+    def test_debit_is_conditional_and_records_balances(self):
+        wallet = PayboxWallet.objects.create(user=self.user, balance=500)
+        first = wallets.debit(wallet, 300, 'PAYMENT')
+        self.assertEqual((first.balance_before, first.balance_after), (500, 200))
+        # Đối tượng ví cũ (số dư đọc trước đó) không làm sai số dư
+        stale = PayboxWallet.objects.get(id=wallet.id)
+        PayboxWallet.objects.filter(id=wallet.id).update(balance=100)
+        with self.assertRaises(wallets.InsufficientBalance) as raised:
+            wallets.debit(stale, 150, 'PAYMENT')
+        self.assertEqual(raised.exception.available, 100)
+        credit = wallets.credit(stale, 50, 'DEPOSIT')
+        self.assertEqual((credit.balance_before, credit.balance_after), (100, 150))
+        self.assertEqual(PayboxTransaction.objects.filter(wallet=wallet).count(), 2)
+
+    def test_payment_and_refund_go_through_wallet(self):
+        m, l = self.variants
+        order_id = self.place((m, 2)).data['id']
+        PayboxWallet.objects.create(user=self.user, balance=100)
+        response = self.client.post('/api/paybox/payment/', {'order_id': order_id}, format='json')
+        self.assertEqual((response.status_code, response.data['available']), (400, 100))
+        self.assertFalse(Order.objects.get(id=order_id).isPaid)
+
+        PayboxWallet.objects.filter(user=self.user).update(balance=1000)
+        self.assertEqual(self.client.post('/api/paybox/payment/', {'order_id': order_id}, format='json').status_code, 200)
+        RefundRequest.objects.create(order_id=order_id, user=self.user, reason='Hỏng')
+        self.client.force_authenticate(User.objects.create_user(username='admin', is_staff=True))
+        url = f'/api/admin/paybox/refund/{order_id}/approve/'
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assertEqual(PayboxWallet.objects.get(user=self.user).balance, 1000)
+        self.assertEqual(
+            list(PayboxTransaction.objects.order_by('id').values_list('transaction_type', 'balance_before', 'balance_after')),
+            [('PAYMENT', 1000, 760), ('REFUND', 760, 1000)],
+        )
+
+    @mock.patch.object(wallets, 'SNAPSHOT_EVERY', 3)
+    def test_ledger_sequences_snapshots_and_point_in_time_balance(self):
+        wallet = PayboxWallet.objects.create(user=self.user)
+        records = [wallets.credit(wallet, 100, 'DEPOSIT') for _ in range(7)]
+        self.assertEqual([record.sequence for record in records], list(range(1, 8)))
+        self.assertEqual(list(WalletSnapshot.objects.values_list('sequence', 'balance')), [(3, 300), (6, 600)])
+        self.assertEqual(wallets.balance_at(wallet), 700)
+        later = timezone.now() + timedelta(hours=1)
+        PayboxTransaction.objects.filter(sequence__gt=4).update(created_at=later)
+        WalletSnapshot.objects.filter(sequence__gt=4).update(as_of=later)
+        self.assertEqual(wallets.balance_at(wallet, timezone.now()), 400)
+        with self.assertRaises(ValueError):
+            records[0].save()
+
+    def test_compact_and_verify(self):
+        wallet = PayboxWallet.objects.create(user=self.user)
+        for _ in range(5):
+            wallets.credit(wallet, 100, 'DEPOSIT')
+        call_command('compact_wallet_ledger', '--min-tail', '2', '--verify', stdout=StringIO())
+        self.assertEqual(list(WalletSnapshot.objects.values_list('sequence', 'balance')), [(5, 500)])
+        wallets.debit(wallet, 200, 'PAYMENT')
+        self.assertEqual(wallets.compact(min_tail=2), 0)
+        self.assertEqual(wallets.balance_at(wallet), 300)
+        PayboxWallet.objects.filter(id=wallet.id).update(balance=999)
+        with self.assertRaises(CommandError):
+            call_command('compact_wallet_ledger', '--verify', stdout=StringIO())
+
+    def test_statement_pages_and_monthly_summary(self):
+        wallet = wallets.get_wallet(self.user)
+        for amount in (100, 200, 300):
+            wallets.credit(wallet, amount, 'DEPOSIT')
+        wallets.debit(wallet, 250, 'PAYMENT', order=Order.objects.get(id=self.place((self.variants[0], 1)).data['id']))
+        with self.assertNumQueries(2):
+            page = self.client.get('/api/paybox/transactions/?page_size=3').data
+        self.assertEqual([row['sequence'] for row in page['results']], [4, 3, 2])
+        self.assertEqual(page['results'][0]['order_info']['total_price'], 240)
+        rest = self.client.get(page['next']).data
+        self.assertEqual(([row['sequence'] for row in rest['results']], rest['next']), ([1], None))
+
+        month, = self.client.get('/api/paybox/statements/').data['results']
+        self.assertEqual((month['opening_balance'], month['closing_balance'], month['transaction_count']), (0, 350, 4))
+        self.assertEqual((month['totals']['DEPOSIT'], month['totals']['PAYMENT']), (600, 250))
+        call_command('rebuild_wallet_statements', stdout=StringIO())
+        self.assertEqual(self.client.get('/api/paybox/statements/').data['results'], [month])
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTests(CheckoutTestMixin, TestCase):
+    def deliver(self, event, secret='whsec_test'):
+        payload = json.dumps(event)
+        return self.client.post('/api/stripe/webhook/', payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=fake_stripe.sign(payload, secret))
+
+    def succeeded(self, amount, **metadata):
+        intent = {'id': f'pi_{amount}_{len(metadata)}', 'object': 'payment_intent', 'amount': amount,
+                  'amount_received': amount, 'status': 'succeeded', 'metadata': metadata}
+        return fake_stripe.build_event(intent)
+
+    def test_webhook_checks_signature_and_ignores_duplicates(self):
+        event = self.succeeded(240, order_id='1')
+        self.assertEqual(self.deliver(event, secret='whsec_other').status_code, 400)
+        self.assertFalse(self.deliver(event).data['duplicate'])
+        self.assertTrue(self.deliver(event).data['duplicate'])
+        self.deliver(fake_stripe.build_event({'object': 'charge'}, 'charge.refunded'))
+        self.assertEqual(
+            sorted(StripeEvent.objects.values_list('type', 'status')),
+            [('charge.refunded', StripeEvent.IGNORED), ('payment_intent.succeeded', StripeEvent.PENDING)],
+        )
+
+    def test_batch_applies_orders_and_deposits_once(self):
+        m, l = self.variants
+        order_id = self.place((m, 2)).data['id']
+        other_id = self.place((l, 1)).data['id']
+        self.deliver(self.succeeded(240, order_id=str(order_id)))
+        self.deliver(self.succeeded(999, order_id=str(other_id)))
+        deposit = self.succeeded(500, user_id=str(self.user.id), transaction_type='DEPOSIT')
+        self.deliver(deposit)
+        self.assertEqual(stripe_events.apply_batch(), 3)
+        self.deliver(deposit)
+        self.assertEqual(stripe_events.apply_batch(), 0)
+
+        self.assertTrue(Order.objects.get(id=order_id).isPaid)
+        self.assertFalse(Order.objects.get(id=other_id).isPaid)
+        self.assertEqual(StripeEvent.objects.get(payment_intent_id='pi_999_1').status, StripeEvent.FAILED)
+        self.assertEqual(PayboxWallet.objects.get(user=self.user).balance, 500)
+
+    def test_confirm_endpoints_are_local_lookups(self):
+        order_id = self.place((self.variants[0], 2)).data['id']
+        event = self.succeeded(240, order_id=str(order_id))
+        url = f'/api/orders/{order_id}/pay/'
+        self.assertEqual(self.client.post(url, {'payment_intent': 'pi_240_1'}, format='json').status_code, 202)
+        self.deliver(event)
+        self.assertEqual(self.client.post(url, {'payment_intent': 'pi_240_1'}, format='json').status_code, 200)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.APPLIED)
+
+        self.deliver(self.succeeded(300, user_id=str(self.user.id), transaction_type='DEPOSIT'))
+        confirm = {'payment_intent_id': 'pi_300_2'}
+        response = self.client.post('/api/paybox/deposit/confirm/', confirm, format='json')
+        self.assertEqual((response.status_code, response.data['new_balance']), (200, 300))
+        self.assertEqual(self.client.post('/api/paybox/deposit/confirm/', confirm, format='json').status_code, 200)
+        self.assertEqual(PayboxWallet.objects.get(user=self.user).balance, 300)
+
+    def test_fake_stripe_server_sends_signed_webhooks(self):
+        delivered = []
+        server = fake_stripe.make_server('127.0.0.1', 0, 'whsec_test', lambda *args: delivered.append(args) or 200)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        order_id = self.place((self.variants[0], 2)).data['id']
+        with mock.patch.multiple(stripe, api_base=fake_stripe.url(server), api_key='sk_test_fake'):
+            intent = stripe.PaymentIntent.create(amount=240, currency='vnd', metadata={'order_id': order_id})
+            stripe.PaymentIntent.confirm(intent['id'])
+            self.assertEqual(stripe.PaymentIntent.retrieve(intent['id'])['status'], 'succeeded')
+        server.stripe.outbox.join()
+        payload, signature = delivered[0]
+        self.client.post('/api/stripe/webhook/', payload, content_type='application/json',
+                         HTTP_STRIPE_SIGNATURE=signature)
+        stripe_events.apply_batch()
+        self.assertTrue(Order.objects.get(id=order_id).isPaid)
+
+
+class StripeGatewayTests(CheckoutTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = fake_stripe.make_server('127.0.0.1', 0, 'whsec_test', lambda *args: 200)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.now = 0.0
+        self.gateway = stripe_gateway.StripeGateway(
+            api_key='sk_test_fake', api_base=fake_stripe.url(self.server), timeout=1, max_retries=1,
+            breaker=stripe_gateway.CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: self.now),
+            sleep=lambda seconds: None,
+        )
+
+    def test_retries_reuse_idempotency_key(self):
+        self.server.stripe.fail_next(1)
+        intent = self.gateway.create_payment_intent(amount=240, metadata={'order_id': 1})
+        self.assertEqual((intent['amount'], intent['metadata']['order_id']), (240, '1'))
+        self.assertEqual(len(self.server.stripe.intents), 1)
+        metrics = self.gateway.metrics.snapshot()['payment_intent.create']
+        self.assertEqual((metrics['ok'], metrics['retries']), (1, 1))
+
+        # Lỗi do request không được thử lại và không làm mở mạch
+        with self.assertRaises(stripe_gateway.GatewayError) as raised:
+            self.gateway.retrieve_payment_intent('pi_missing')
+        self.assertNotIsInstance(raised.exception, stripe_gateway.GatewayUnavailable)
+        self.assertEqual(self.gateway.breaker.state, stripe_gateway.CircuitBreaker.CLOSED)
+
+    def test_circuit_opens_fails_fast_and_recovers(self):
+        intent = self.gateway.create_payment_intent(amount=100)
+        self.server.stripe.fail_next(4)
+        for _ in range(2):
+            with self.assertRaises(stripe_gateway.GatewayUnavailable):
+                self.gateway.retrieve_payment_intent(intent['id'])
+        requests_sent = self.server.stripe.requests
+        with self.assertRaises(stripe_gateway.GatewayUnavailable) as raised:
+            self.gateway.retrieve_payment_intent(intent['id'])
+        self.assertEqual((self.server.stripe.requests, raised.exception.retry_after), (requests_sent, 31))
+
+        self.client.force_authenticate(self.user)
+        order_id = self.place((self.variants[0], 2)).data['id']
+        with mock.patch.object(stripe_gateway, 'get_gateway', return_value=self.gateway):
+            response = self.client.post('/api/stripe-payment/', {'order': order_id}, format='json')
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '31'))
+
+        self.now += 30
+        retrieved = async_to_sync(self.gateway.retrieve_payment_intent_async)(intent['id'])
+        self.assertEqual(retrieved['id'], intent['id'])
+        self.assertEqual(self.gateway.breaker.state, stripe_gateway.CircuitBreaker.CLOSED)
+        metrics = self.gateway.metrics.snapshot()['payment_intent.retrieve']
+        self.assertEqual((metrics['ok'], metrics['error'], metrics['rejected']), (1, 2, 1))
+
+    def test_timeout_counts_as_failure(self):
+        self.server.stripe.latency = 0.3
+        self.gateway.timeout = 0.05
+        with self.assertRaises(stripe_gateway.GatewayUnavailable):
+            self.gateway.create_payment_intent(amount=100)
+        self.assertEqual(self.gateway.metrics.snapshot()['payment_intent.create']['error'], 1)
+
+    def test_unexpected_error_in_trial_call_reopens_circuit(self):
+        intent = self.gateway.create_payment_intent(amount=100)
+        self.server.stripe.fail_next(4)
+        for _ in range(2):
+            with self.assertRaises(stripe_gateway.GatewayUnavailable):
+                self.gateway.retrieve_payment_intent(intent['id'])
+
+        # Lời gọi thử ném lỗi không phải StripeError: mạch mở lại thay vì kẹt ở half-open
+        self.now += 30
+        with mock.patch('api.stripe_gateway.util.convert_to_stripe_object', side_effect=ValueError('hỏng')):
+            with self.assertRaises(ValueError):
+                self.gateway.retrieve_payment_intent(intent['id'])
+        self.assertEqual(self.gateway.breaker.state, stripe_gateway.CircuitBreaker.OPEN)
+        self.assertEqual(self.gateway.metrics.snapshot()['payment_intent.retrieve']['error'], 3)
+
+        self.now += 30
+        self.assertEqual(self.gateway.retrieve_payment_intent(intent['id'])['id'], intent['id'])
+        self.assertEqual(self.gateway.breaker.state, stripe_gateway.CircuitBreaker.CLOSED)
+
+
+class SalesRollupTests(CheckoutTestMixin, TestCase):
+    def pay(self, *items):
+        order = Order.objects.get(id=self.place(*items).data['id'])
+        mark_paid(order)
+        return order
+
+    def test_rollups_follow_payments_and_refunds(self):
+        m, l = self.variants
+        self.pay((m, 2))
+        refunded = self.pay((l, 1))
+        self.place((l, 1))  # chưa thanh toán, không được tính
+        self.assertTrue(mark_refunded(refunded))
+        self.assertFalse(mark_refunded(refunded))
+        self.assertEqual(sales_rollups.verify(timezone.localdate(), timezone.localdate()), [])
+
+        admin = User.objects.create_user(username='admin', is_staff=True)
+        self.assertEqual(self.client.get('/api/admin/analytics/sales/').status_code, 403)
+        self.client.force_authenticate(admin)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/admin/analytics/sales/?dimension=category&group=total')
+        row, = response.data['results']
+        self.assertEqual(row['label'], 'Áo')
+        self.assertEqual((row['orders'], row['units'], row['revenue']), (2, 3, 360))
+        self.assertEqual((row['refunded_orders'], row['refunded_revenue'], row['net_revenue']), (1, 120, 240))
+        day, = self.client.get('/api/admin/analytics/sales/').data['results']
+        self.assertEqual((day['orders'], day['revenue']), (2, 480))
+        self.assertEqual(self.client.get('/api/admin/analytics/sales/?dimension=user').status_code, 400)
+
+    def test_verify_detects_drift_and_backfill_repairs_it(self):
+        m, l = self.variants
+        self.pay((m, 1), (l, 1))
+        SalesRollup.objects.filter(dimension=SalesRollup.BRAND).update(units=7)
+        with self.assertRaises(CommandError):
+            call_command('verify_sales_rollups', stdout=StringIO())
+        call_command('backfill_sales_rollups', stdout=StringIO())
+        call_command('verify_sales_rollups', stdout=StringIO())
+        self.assertEqual(SalesRollup.objects.get(dimension=SalesRollup.BRAND).units, 2)
+
+
+@override_settings(ORDER_INTAKE_ASYNC=True)
+class OrderIntakeTests(CheckoutTestMixin, TestCase):
+    def drain(self):
+        # Một lô của worker (vòng lặp run_worker đóng kết nối DB giữa các lô)
+        order_intake.process_batch('test-worker')
+
+    def test_order_is_created_by_worker(self):
+        m, l = self.variants
+        response = self.place((m, 2), (l, 1))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], OrderIntake.PENDING)
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(self.stocks(), [5, 5])
+
+        self.drain()
+        status = self.client.get(response.data['status_url']).data
+        self.assertEqual(status['status'], OrderIntake.DONE)
+        order = Order.objects.get(id=status['order_id'])
+        self.assertEqual(order.user, self.user)
+        self.assertEqual(self.stocks(), [3, 4])
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other'))
+        self.assertEqual(other.get(response.data['status_url']).status_code, 404)
+
+    def test_invalid_payload_rejected_before_queueing(self):
+        response = self.client.post('/api/placeorder/', {'orderItems': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OrderIntake.objects.exists())
+
+    def test_shortage_marks_ticket_failed(self):
+        m, l = self.variants
+        first = self.place((m, 4)).data
+        second = self.place((m, 2)).data
+        self.drain()
+        self.assertEqual(self.client.get(first['status_url']).data['status'], OrderIntake.DONE)
+        failed = self.client.get(second['status_url']).data
+        self.assertEqual(failed['status'], OrderIntake.FAILED)
+        self.assertIn('error', failed)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.stocks(), [1, 5])
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer'}})
+    def test_unavailable_channel_layer_does_not_stop_worker(self):
+        m, l = self.variants
+        tickets = [self.place((m, 1)).data, self.place((l, 1)).data]
+        # Cấu hình của repo: channels_redis chưa cài hoặc Redis không chạy
+        self.drain()
+        statuses = [self.client.get(ticket['status_url']).data['status'] for ticket in tickets]
+        self.assertEqual(statuses, [OrderIntake.DONE, OrderIntake.DONE])
+
+    def test_unexpected_error_skips_only_that_intake(self):
+        m, l = self.variants
+        tickets = [self.place((m, 1)).data, self.place((l, 1)).data]
+        with mock.patch('api.order_intake.notify', side_effect=[RuntimeError('lỗi'), None]):
+            self.assertEqual(order_intake.process_batch('test-worker'), 2)
+        statuses = [self.client.get(ticket['status_url']).data['status'] for ticket in tickets]
+        self.assertEqual(statuses, [OrderIntake.DONE, OrderIntake.DONE])
+
+
+class FlashSaleTests(CheckoutTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['flash_sale'].clear()
+        patcher = mock.patch('api.flash_sale.writer', flash_sale.OrderWriter(background=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sale = FlashSale.objects.create(
+            product=self.product, starts_at=timezone.now() - timedelta(minutes=1),
+            ends_at=timezone.now() + timedelta(hours=1),
+        )
+        flash_sale.start_sale(self.sale.id)
+
+    def buy(self, variant, qty):
+        return self.client.post(f'/api/flash-sales/{self.sale.id}/purchase/', {
+            'orderItems': [{'id': self.product.id, 'variant_id': variant.id, 'qty': qty}],
+            'paymentMethod': 'COD', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 120 * qty,
+            'shippingAddress': {'address': '1 Lê Lợi', 'city': 'HCM', 'postalCode': '70000', 'country': 'VN'},
+        }, format='json')
+
+    def test_sale_admits_against_counter_and_reconciles(self):
+        m, l = self.variants
+        # Tồn kho được chuyển vào bộ đếm: checkout thường không bán được nữa
+        self.assertEqual(self.stocks(), [0, 0])
+        self.assertEqual(self.place((m, 1)).status_code, 400)
+
+        self.assertEqual(self.buy(m, 4).status_code, 201)
+        self.assertEqual(self.buy(m, 2).status_code, 409)
+        self.assertEqual(self.buy(m, 1).status_code, 201)
+        self.assertEqual(self.client.get(f'/api/flash-sales/{self.sale.id}/').data['remaining'],
+                         {f'variant:{m.id}': 0, f'variant:{l.id}': 5})
+        self.assertEqual(Order.objects.filter(flash_sale=self.sale).count(), 2)
+
+        report = flash_sale.reconcile_sale(self.sale.id, force=True)
+        self.assertEqual(report[f'variant:{m.id}'], {'allocated': 5, 'sold': 5, 'returned': 0, 'counter': 0})
+        self.assertEqual(self.stocks(), [0, 5])
+        self.assertEqual(ProductSummary.objects.get(product=self.product).total_stock, 5)
+        self.assertEqual(self.buy(l, 1).status_code, 409)
+
+    def test_counters_reload_from_orders(self):
+        m, l = self.variants
+        self.buy(m, 2)
+        caches['flash_sale'].clear()
+        self.assertEqual(self.buy(m, 4).status_code, 409)
+        self.assertEqual(self.buy(m, 3).status_code, 201)
+
+    @mock.patch('api.flash_sale.WRITE_TIMEOUT', 0.01)
+    def test_slow_write_returns_accepted(self):
+        m, l = self.variants
+        # Đơn đã được nhận nhưng chưa ghi xong: 202 và bộ đếm không được hoàn
+        with mock.patch.object(flash_sale.writer, 'submit', return_value=Future()):
+            response = self.buy(m, 2)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(f'/api/flash-sales/{self.sale.id}/').data['remaining'][f'variant:{m.id}'], 3)
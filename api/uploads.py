@@ -0,0 +1,183 @@
+"""
+Upload ảnh theo từng phần, có thể tiếp tục sau khi mất kết nối.
+
+    POST   /api/uploads/                {filename, size}        -> {id, offset, chunk_size}
+    PATCH  /api/uploads/<id>/           header Upload-Offset, body là byte của phần tiếp theo
+    GET    /api/uploads/<id>/           -> {offset}: client hỏi offset để gửi tiếp
+    POST   /api/uploads/<id>/finalize/  {sha256 (tùy chọn)}     -> {image_url, image_urls}
+    DELETE /api/uploads/<id>/
+
+Mỗi phần được đọc từ request theo từng khối nhỏ và ghi thẳng vào file tạm trên đĩa, nên bộ nhớ
+dùng cho một upload không vượt quá kích thước khối đọc. Phần đầu tiên phải có chữ ký của một
+định dạng ảnh được hỗ trợ; khi hoàn tất, Pillow chỉ đọc header (không giải mã ảnh) để kiểm tra.
+"""
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+
+from api.images import generate_derivatives
+from api.models import ImageUpload
+from api.storage import image_extension
+
+TEMP_DIR = getattr(settings, 'CHUNKED_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'tmp', 'uploads'))
+CHUNK_SIZE = getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+MAX_SIZE = getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 20 * 1024 * 1024)
+EXPIRY = timedelta(hours=getattr(settings, 'CHUNKED_UPLOAD_EXPIRY_HOURS', 24))
+
+# Kích thước mỗi lần đọc từ request/đĩa
+READ_SIZE = 64 * 1024
+
+ALLOWED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+# Số byte đầu file cần để nhận diện định dạng
+HEADER_SIZE = 12
+
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST, **extra):
+        super().__init__(message)
+        self.status_code = status_code
+        self.extra = extra
+
+
+def temp_path(upload):
+    return os.path.join(TEMP_DIR, f'{upload.id}.part')
+
+
+def has_image_signature(header):
+    return (
+        header.startswith(b'\xff\xd8\xff')
+        or header.startswith(b'\x89PNG\r\n\x1a\n')
+        or header[:6] in (b'GIF87a', b'GIF89a')
+        or (header[:4] == b'RIFF' and header[8:12] == b'WEBP')
+    )
+
+
+def start_upload(user, filename, size):
+    filename = os.path.basename(str(filename or ''))[:255]
+    if os.path.splitext(filename)[1].lower() not in ALLOWED_EXTENSIONS:
+        raise UploadError('Invalid file type. Only JPEG, PNG, GIF and WebP are allowed.')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('size must be an integer')
+    if not 0 < size <= MAX_SIZE:
+        raise UploadError(f'File too large. Maximum size is {MAX_SIZE // (1024 * 1024)}MB.',
+                          status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    upload = ImageUpload.objects.create(user=user, filename=filename, size=size)
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    open(temp_path(upload), 'wb').close()
+    return upload
+
+
+def _locked(upload_id, user):
+    """Khóa phiên upload chưa hoàn tất của user (gọi trong transaction)"""
+    return ImageUpload.objects.select_for_update().get(id=upload_id, user=user, blob='')
+
+
+def append_chunk(upload_id, user, offset, stream, length, expected_sha256=None):
+    """Ghi một phần vào file tạm tại offset, trả về (upload, sha256 của phần vừa ghi)"""
+    with transaction.atomic():
+        upload = _locked(upload_id, user)
+        if offset != upload.received:
+            raise UploadError('Upload-Offset does not match', status.HTTP_409_CONFLICT, offset=upload.received)
+        if length <= 0 or length > CHUNK_SIZE:
+            raise UploadError(f'Chunk size must be between 1 and {CHUNK_SIZE} bytes',
+                              status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if offset + length > upload.size:
+            raise UploadError('Chunk exceeds declared file size')
+
+        sha = hashlib.sha256()
+        written = 0
+        with open(temp_path(upload), 'r+b') as handle:
+            handle.seek(offset)
+            while written < length:
+                piece = stream.read(min(READ_SIZE, length - written))
+                if not piece:
+                    break
+                if offset == 0 and written == 0 and not has_image_signature(piece[:HEADER_SIZE]):
+                    raise UploadError('File is not a supported image')
+                sha.update(piece)
+                handle.write(piece)
+                written += len(piece)
+
+            digest = sha.hexdigest()
+            if written != length or (expected_sha256 and expected_sha256.lower() != digest):
+                # Bỏ phần ghi dở, client gửi lại từ offset cũ
+                handle.truncate(offset)
+                raise UploadError('Chunk incomplete or checksum mismatch', offset=offset)
+            handle.truncate(offset + written)
+
+        upload.received = offset + written
+        upload.save(update_fields=['received', 'updated_at'])
+    return upload, digest
+
+
+def _file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for piece in iter(lambda: handle.read(READ_SIZE), b''):
+            sha.update(piece)
+    return sha.hexdigest()
+
+
+def finalize_upload(upload_id, user, expected_sha256=None):
+    """Kiểm tra file đã đủ và là ảnh hợp lệ, chuyển vào kho media và tạo ảnh phái sinh"""
+    with transaction.atomic():
+        upload = _locked(upload_id, user)
+        path = temp_path(upload)
+        if upload.received != upload.size:
+            raise UploadError('Upload is incomplete', status.HTTP_409_CONFLICT, offset=upload.received)
+
+        # Đuôi của blob lấy theo định dạng ảnh thật, không theo tên file client gửi
+        extension = image_extension(path)
+        if not extension:
+            raise UploadError('File is not a supported image')
+
+        digest = _file_sha256(path)
+        if expected_sha256 and expected_sha256.lower() != digest:
+            raise UploadError('Checksum mismatch')
+
+        if hasattr(default_storage, 'save_file'):
+            name = default_storage.save_file(path, extension, digest, upload.size)
+        else:
+            with open(path, 'rb') as handle:
+                name = default_storage.save(upload.filename, File(handle))
+            os.remove(path)
+        upload.blob = name
+        upload.save(update_fields=['blob', 'updated_at'])
+
+    generate_derivatives(name)
+    return upload
+
+
+def abort_upload(upload_id, user):
+    with transaction.atomic():
+        upload = _locked(upload_id, user)
+        _remove_temp(upload)
+        upload.delete()
+
+
+def _remove_temp(upload):
+    try:
+        os.remove(temp_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def expire_uploads(older_than=EXPIRY):
+    """Xóa các phiên upload không hoạt động quá older_than (kèm file tạm), trả về số phiên đã xóa"""
+    expired = ImageUpload.objects.filter(updated_at__lt=timezone.now() - older_than)
+    count = 0
+    for upload in expired.iterator():
+        _remove_temp(upload)
+        upload.delete()
+        count += 1
+    return count
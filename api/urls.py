@@ -4,14 +4,17 @@ from rest_framework.routers import DefaultRouter
 from api.views import (
     BrandViewSet, CategoryViewSet, CouponViewSet, OrderViewSet, ProductViewSet,
     ColorViewSet, SizeViewSet, ProductVariantViewSet, ProductVariantDetailView,
-    ReviewView, ReviewViewSet, StripePaymentView,
-    placeOrder, update_order_to_paid, update_review,
-    PayboxWalletView, PayboxTransactionListView, PayboxDepositView,
+    ReviewView, ReviewViewSet, StripePaymentView, StripeWebhookView,
+    placeOrder, order_intake_status, update_order_to_paid, update_review, CartReservationView,
+    flash_sale_detail, flash_sale_purchase,
+    PayboxWalletView, PayboxTransactionListView, PayboxStatementView, PayboxDepositView,
     PayboxDepositConfirmView, PayboxPaymentView,
-    AdminPayboxWalletListView, AdminPayboxTransactionListView,
+    AdminPayboxWalletListView, AdminPayboxTransactionListView, AdminSalesAnalyticsView,
+    AdminPaymentGatewayMetricsView,
     RejectRefundRequestView, DeleteRefundRequestView, RefundRequestView,
     AdminRefundRequestListView, ApproveRefundRequestView,
-    FavoriteView, check_favorite, check_purchase
+    FavoriteView, check_favorite, check_purchase, ImageUploadView,
+    ChunkedUploadView, ChunkedUploadDetailView, ChunkedUploadFinalizeView
 )
 from chat.views import chat_history
 
@@ -29,9 +32,18 @@ router.register(r'coupons', CouponViewSet, basename='coupon')
 
 urlpatterns = [*router.urls,
     path('placeorder/', placeOrder, name='create-order'),
+    path('orders/intake/<uuid:pk>/', order_intake_status, name='order-intake'),
+    path('cart/reservations/', CartReservationView.as_view(), name='cart-reservations'),
+    path('flash-sales/<int:pk>/', flash_sale_detail, name='flash-sale'),
+    path('flash-sales/<int:pk>/purchase/', flash_sale_purchase, name='flash-sale-purchase'),
     path('orders/<str:pk>/pay/', update_order_to_paid, name="pay"),
     path('stripe-payment/', StripePaymentView.as_view(),
         name='stipe-payment'),
+    path('stripe/webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
+    path('upload-image/', ImageUploadView.as_view(), name='upload-image'),
+    path('uploads/', ChunkedUploadView.as_view(), name='chunked-upload'),
+    path('uploads/<uuid:pk>/', ChunkedUploadDetailView.as_view(), name='chunked-upload-detail'),
+    path('uploads/<uuid:pk>/finalize/', ChunkedUploadFinalizeView.as_view(), name='chunked-upload-finalize'),
     path('products/<str:pk>/reviews/', ReviewView.as_view(), name='product-reviews'),
     path('products/<str:pk>/reviews/<str:review_id>/', update_review, name='update-review'),
     path('products/<int:product_id>/variants/<int:color_id>/<int:size_id>/',
@@ -40,6 +52,7 @@ urlpatterns = [*router.urls,
     # Paybox endpoints
     path('paybox/wallet/', PayboxWalletView.as_view(), name='paybox-wallet'),
     path('paybox/transactions/', PayboxTransactionListView.as_view(), name='paybox-transactions'),
+    path('paybox/statements/', PayboxStatementView.as_view(), name='paybox-statements'),
     path('paybox/deposit/', PayboxDepositView.as_view(), name='paybox-deposit'),
     path('paybox/deposit/confirm/', PayboxDepositConfirmView.as_view(), name='paybox-deposit-confirm'),
     path('paybox/payment/', PayboxPaymentView.as_view(), name='paybox-payment'),
@@ -57,6 +70,8 @@ urlpatterns = [*router.urls,
     # Admin Paybox endpoints
     path('admin/paybox/wallets/', AdminPayboxWalletListView.as_view(), name='admin-paybox-wallets'),
     path('admin/paybox/transactions/', AdminPayboxTransactionListView.as_view(), name='admin-paybox-transactions'),
+    path('admin/analytics/sales/', AdminSalesAnalyticsView.as_view(), name='admin-sales-analytics'),
+    path('admin/payments/metrics/', AdminPaymentGatewayMetricsView.as_view(), name='admin-payment-metrics'),
 
     path('chat/messages/<str:room_name>/', chat_history),
     path('favorites/', FavoriteView.as_view(), name='favorites'),
@@ -0,0 +1,165 @@
+"""
+Upsert biến thể hàng loạt theo khóa (product, color, size).
+
+Màu, size, sản phẩm và biến thể hiện có được đọc bằng vài truy vấn cho cả lô, SKU được
+tạo trong bộ nhớ, sau đó ghi bằng bulk_create/bulk_update trong một transaction.
+Ghi hàng loạt không phát tín hiệu post_save nên tổng hợp sản phẩm và cache catalog
+được cập nhật một lần ở cuối.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+from rest_framework import serializers
+
+from api import catalog_cache
+from api.models import Color, Product, ProductVariant, Size
+from api.serializers import ProductVariantBulkRowSerializer
+from api.summaries import refresh_summaries
+
+BATCH_SIZE = 500
+UPDATE_FIELDS = ('price', 'stock_quantity', 'sku')
+# Giới hạn số tham số của một mệnh đề IN
+LOOKUP_CHUNK = 500
+
+
+def _chunks(items, size=LOOKUP_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _resolve(model, rows, id_field, name_field):
+    """Trả về (theo id, theo tên) cho màu hoặc size được dùng trong lô, một truy vấn"""
+    ids = {row[id_field] for row in rows if id_field in row}
+    names = {row[name_field] for row in rows if id_field not in row and name_field in row}
+    found = model.objects.filter(Q(id__in=ids) | Q(name__in=names)).order_by().values_list('id', 'name') if ids or names else []
+    by_id = dict(found)
+    return by_id, {name: pk for pk, name in by_id.items()}
+
+
+def _lookup(row, id_field, name_field, by_id, by_name):
+    if id_field in row:
+        return row[id_field] if row[id_field] in by_id else None
+    return by_name.get(row[name_field])
+
+
+def bulk_upsert_variants(rows, batch_size=BATCH_SIZE, refresh_catalog=True, validate=True):
+    """
+    Tạo mới hoặc cập nhật biến thể, trả về (ok, results) với một kết quả cho mỗi dòng.
+    Nếu có dòng lỗi thì không ghi gì cả. refresh_catalog=False khi bên gọi tự cập nhật
+    tổng hợp sản phẩm và cache, validate=False khi các dòng đã được chuẩn hóa kiểu dữ liệu
+    (ví dụ import catalog).
+    """
+    child = ProductVariantBulkRowSerializer()
+    results = []
+    valid = {}
+    for index, row in enumerate(rows):
+        results.append({'index': index})
+        if not validate:
+            valid[index] = row
+            continue
+        try:
+            valid[index] = child.run_validation(row)
+        except serializers.ValidationError as exc:
+            results[index].update(status='error', errors=exc.detail)
+
+    data = list(valid.values())
+    product_ids = {row['product'] for row in data}
+    existing_products = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True)) if product_ids else set()
+    colors, color_ids = _resolve(Color, data, 'color_id', 'color')
+    sizes, size_ids = _resolve(Size, data, 'size_id', 'size')
+
+    variants = {}
+    for chunk in _chunks(product_ids):
+        for variant in ProductVariant.objects.filter(product_id__in=chunk).only(
+            'id', 'product_id', 'color_id', 'size_id', 'price', 'stock_quantity', 'sku'
+        ):
+            variants[(variant.product_id, variant.color_id, variant.size_id)] = variant
+
+    planned = {}
+    for index, row in valid.items():
+        errors = {}
+        color_id = _lookup(row, 'color_id', 'color', colors, color_ids)
+        size_id = _lookup(row, 'size_id', 'size', sizes, size_ids)
+        if row['product'] not in existing_products:
+            errors['product'] = ['Sản phẩm không tồn tại']
+        if color_id is None:
+            errors['color'] = ['Màu không tồn tại']
+        if size_id is None:
+            errors['size'] = ['Size không tồn tại']
+        key = (row['product'], color_id, size_id)
+        if not errors and key in planned:
+            errors['non_field_errors'] = ['Trùng (product, color, size) với dòng {}'.format(planned[key][0])]
+        if not errors and key not in variants and 'price' not in row:
+            errors['price'] = ['Giá là bắt buộc khi tạo biến thể mới']
+        if errors:
+            results[index].update(status='error', errors=errors)
+            continue
+
+        variant = variants.get(key)
+        if variant is None:
+            variant = ProductVariant(product_id=key[0], color_id=color_id, size_id=size_id, stock_quantity=0)
+        before = [getattr(variant, field) for field in UPDATE_FIELDS]
+        for field in ('price', 'stock_quantity'):
+            if field in row:
+                setattr(variant, field, row[field])
+        variant.sku = row.get('sku') or variant.sku or ProductVariant.make_sku(key[0], colors[color_id], sizes[size_id])
+        # Chỉ ghi lại các trường thật sự thay đổi
+        variant.changed_fields = tuple(
+            field for field, old in zip(UPDATE_FIELDS, before) if getattr(variant, field) != old
+        )
+        planned[key] = (index, variant)
+
+    # SKU là duy nhất trên toàn bảng: kiểm tra trùng trong lô và với biến thể khác
+    by_index = dict(planned.values())
+    owners = {}
+    for index, variant in planned.values():
+        if variant.sku in owners:
+            results[index].update(status='error', errors={'sku': ['SKU trùng với dòng {}'.format(owners[variant.sku])]})
+        else:
+            owners[variant.sku] = index
+    for chunk in _chunks(owners):
+        for sku, variant_id in ProductVariant.objects.filter(sku__in=chunk).values_list('sku', 'id'):
+            index = owners[sku]
+            if by_index[index].pk != variant_id:
+                results[index].update(status='error', errors={'sku': ['SKU đã được dùng cho biến thể khác']})
+
+    if any(result.get('status') == 'error' for result in results):
+        return False, results
+
+    created = {index for index, variant in by_index.items() if variant.pk is None}
+    to_create = [by_index[index] for index in created]
+    to_update = defaultdict(list)
+    for index, variant in by_index.items():
+        if index not in created and variant.changed_fields:
+            to_update[variant.changed_fields].append(variant)
+    with transaction.atomic():
+        ProductVariant.objects.bulk_create(to_create, batch_size=batch_size)
+        # Gom theo tập trường thay đổi để CASE WHEN của bulk_update chỉ chứa các cột cần ghi
+        for fields, group in to_update.items():
+            ProductVariant.objects.bulk_update(group, fields, batch_size=batch_size)
+
+        # MySQL không trả về id sau bulk_create, lấy lại theo SKU
+        missing = {variant.sku: variant for variant in to_create if variant.pk is None}
+        for chunk in _chunks(missing):
+            for sku, variant_id in ProductVariant.objects.filter(sku__in=chunk).values_list('sku', 'id'):
+                missing[sku].pk = variant_id
+
+        touched = {variant.product_id for variant in to_create}
+        touched.update(variant.product_id for group in to_update.values() for variant in group)
+        if touched and refresh_catalog:
+            refresh_summaries(touched)
+
+    for index, variant in by_index.items():
+        results[index].update(
+            status='created' if index in created else 'updated' if variant.changed_fields else 'unchanged',
+            id=variant.pk,
+            sku=variant.sku,
+        )
+
+    if refresh_catalog:
+        catalog_cache.bump_catalog_version()
+        for product_id in touched:
+            catalog_cache.bump_product_version(product_id)
+    return True, results
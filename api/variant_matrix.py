@@ -0,0 +1,42 @@
+"""
+Ma trận biến thể màu × size của một sản phẩm, dạng nén để trang sản phẩm chỉ cần một request.
+
+    colors:   [{id, name, hex_code}, ...]        (chỉ số hàng)
+    sizes:    [{id, name}, ...]                  (chỉ số cột, theo Size.order)
+    fields:   ["id", "price", "stock", "sku"]
+    variants: [[id, price, stock, sku], ...]
+    grid:     mảng phẳng len(colors) * len(sizes), ô (c, s) ở vị trí c * len(sizes) + s,
+              giá trị là chỉ số trong variants hoặc -1 nếu không có biến thể
+"""
+from api.models import Color, ProductVariant, Size
+
+FIELDS = ('id', 'price', 'stock', 'sku')
+
+
+def build_variant_matrix(product_id):
+    rows = list(
+        ProductVariant.objects.filter(product_id=product_id)
+        .order_by('id')
+        .values_list('id', 'color_id', 'size_id', 'price', 'stock_quantity', 'sku')
+    )
+    color_ids = {row[1] for row in rows}
+    size_ids = {row[2] for row in rows}
+    colors = list(Color.objects.filter(id__in=color_ids).order_by('id').values('id', 'name', 'hex_code')) if rows else []
+    sizes = list(Size.objects.filter(id__in=size_ids).values('id', 'name')) if rows else []
+
+    color_index = {color['id']: i for i, color in enumerate(colors)}
+    size_index = {size['id']: i for i, size in enumerate(sizes)}
+    grid = [-1] * (len(colors) * len(sizes))
+    variants = []
+    for variant_id, color_id, size_id, price, stock, sku in rows:
+        grid[color_index[color_id] * len(sizes) + size_index[size_id]] = len(variants)
+        variants.append([variant_id, int(price), stock, sku])
+
+    return {
+        'product': product_id,
+        'colors': colors,
+        'sizes': sizes,
+        'fields': list(FIELDS),
+        'variants': variants,
+        'grid': grid,
+    }
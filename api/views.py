@@ -1,27 +1,58 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 from django.conf import settings
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.urls import reverse
 from .models import Coupon
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .serializers import CouponSerializer
+import hashlib
+import mimetypes
 import os
+from functools import lru_cache
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.views import APIView
+from rest_framework.generics import ListAPIView
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin, UpdateModelMixin
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status, viewsets, permissions
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
-from api.models import Brand, Category, Order, OrderItem, Product, Review, ShippingAddress, PayboxWallet, PayboxTransaction, RefundRequest, Favorite, Color, Size, ProductVariant
+from rest_framework.exceptions import ValidationError
+from api.models import Brand, Category, Order, OrderItem, Product, Review, ShippingAddress, PayboxWallet, PayboxTransaction, RefundRequest, Favorite, Color, Size, ProductVariant, ImageUpload, StockReservation, FlashSale, OrderIntake, SalesRollup, StripeEvent
 from api.permissions import IsAdminUserOrReadOnly
+from api.pagination import OrderCursorPagination, ProductCursorPagination, WalletTransactionCursorPagination
+from api.search import search_product_ids
+from api.facets import get_facet_index, is_current
+from api.catalog_cache import cached_response
+from api.variant_matrix import build_variant_matrix
+from api.variant_bulk import bulk_upsert_variants
+from api.orders import OrderError, mark_paid, mark_refunded, place_order
+from api.reservations import release_cart, reserve_cart
+from api import flash_sale, order_intake, sales_rollups, stripe_events, stripe_gateway, wallets
+from api.idempotency import idempotent
+from api.images import DERIVATIVES_DIR, derivative_urls, find_source, generate_derivatives
+from api.storage import blob_digest, image_extension, is_blob
+from api import uploads
 from api.serializers import BrandSerializer, CategorySerializer, OrderSerializer, ProductSerializer, ReviewSerializer, PayboxWalletSerializer, PayboxTransactionSerializer, ColorSerializer, SizeSerializer, ProductVariantSerializer
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.http import FileResponse, Http404, HttpResponseNotModified
 from django.shortcuts import get_object_or_404, redirect
+from django.utils._os import safe_join
+from django.utils.http import http_date
 from django.utils import timezone
-import stripe
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
 
+# Số dòng tối đa của một request upsert biến thể hàng loạt
+BULK_VARIANT_LIMIT = 10000
+
+MEDIA_IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+MEDIA_CACHE = 'public, max-age=86400'
+MEDIA_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+# Python cũ không có sẵn kiểu của .webp
+mimetypes.add_type('image/webp', '.webp')
 
 
 class BrandViewSet(ModelViewSet):
@@ -93,16 +124,150 @@ class ProductVariantViewSet(ModelViewSet):
             queryset = queryset.filter(product=product_id)
         return queryset
 
+    def create(self, request, *args, **kwargs):
+        # Body là danh sách: upsert hàng loạt theo (product, color, size)
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        if len(request.data) > BULK_VARIANT_LIMIT:
+            return Response({'detail': f'Tối đa {BULK_VARIANT_LIMIT} dòng mỗi request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            ok, results = bulk_upsert_variants(request.data)
+        except IntegrityError:
+            # Một request khác vừa ghi cùng biến thể/SKU, client có thể gửi lại
+            return Response({'detail': 'Biến thể đã bị thay đổi đồng thời, vui lòng thử lại'}, status=status.HTTP_409_CONFLICT)
+        return Response({
+            'created': sum(1 for result in results if result.get('status') == 'created'),
+            'updated': sum(1 for result in results if result.get('status') == 'updated'),
+            'unchanged': sum(1 for result in results if result.get('status') == 'unchanged'),
+            'errors': sum(1 for result in results if result.get('status') == 'error'),
+            'results': results,
+        }, status=status.HTTP_200_OK if ok else status.HTTP_400_BAD_REQUEST)
+
 
 class ProductViewSet(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminUserOrReadOnly]
+    pagination_class = ProductCursorPagination
+
+    def get_queryset(self):
+        queryset = Product.objects.with_stock_summary()
+        # Chỉ prefetch biến thể/đánh giá khi các trường lồng nhau thực sự được trả về
+        fields = self._get_serializer_fields()
+        if fields is None or (set(fields[0]) | set(fields[1])) & set(ProductSerializer.EXPANDABLE_FIELDS):
+            queryset = queryset.with_related()
+        return queryset
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
+        if self.request is not None and self.request.method == 'GET':
+            # Phản hồi GET được cache dùng chung, is_favorite được ghép sau trong cached_response
+            context['favorite_ids'] = set()
         return context
 
+    def get_serializer(self, *args, **kwargs):
+        # Danh sách mặc định chỉ trả về dòng tóm tắt; ?fields= và ?expand= chọn trường cần lấy
+        fields = self._get_serializer_fields()
+        if fields is not None:
+            kwargs['fields'], kwargs['expand'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def _get_serializer_fields(self):
+        """Trả về (fields, expand) khi cần thu gọn dữ liệu, None nếu trả về đầy đủ"""
+        if self.request is None or self.request.method != 'GET':
+            return None
+        fields = self._get_list_param('fields')
+        expand = self._get_list_param('expand')
+        if self.action in ('list', 'search') or fields or expand:
+            return fields or ProductSerializer.SUMMARY_FIELDS, expand
+        return None
+
+    def _get_list_param(self, name):
+        value = self.request.query_params.get(name, '')
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, lambda: self._list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response(request, lambda: super(ProductViewSet, self).retrieve(request, *args, **kwargs),
+                               product_id=kwargs[self.lookup_field])
+
+    def _list(self, request, *args, **kwargs):
+        filters = self._get_facet_filters()
+        ordering = request.query_params.get('ordering', '-createdAt')
+        if not filters and ordering not in ('price', '-price') and not request.query_params.get('facets'):
+            return super().list(request, *args, **kwargs)
+
+        # Lọc, đếm facet và sắp xếp theo giá trên chỉ mục bitset thay vì join biến thể;
+        # phản hồi cùng dạng phân trang con trỏ, thêm count và facets
+        index = get_facet_index()
+        matched = index.ordered_ids(index.filter(filters), ordering)
+        page_ids = self.paginator.paginate_ids(matched, request)
+        products = self.get_queryset().in_bulk(page_ids)
+        serializer = self.get_serializer([products[pk] for pk in page_ids if pk in products], many=True)
+        response = self.paginator.get_ids_paginated_response(
+            serializer.data, count=len(matched), facets=index.facet_counts(filters),
+        )
+        response.stale = not is_current(index)
+        return response
+
+    def _get_facet_filters(self):
+        params = self.request.query_params
+        filters = {}
+        try:
+            for dimension in ('brand', 'category', 'color', 'size'):
+                values = self._get_list_param(dimension)
+                if values:
+                    filters[dimension] = [int(value) for value in values]
+            for bound in ('min_price', 'max_price'):
+                if params.get(bound):
+                    filters[bound] = Decimal(params[bound])
+                    # Decimal nhận cả nan/sNaN/inf, so sánh với NaN làm chỉ mục ném InvalidOperation
+                    if not filters[bound].is_finite():
+                        raise ValueError(bound)
+        except (ValueError, InvalidOperation):
+            raise ValidationError({'detail': 'Giá trị bộ lọc không hợp lệ'})
+        if params.get('in_stock', '').lower() in ('1', 'true'):
+            filters['in_stock'] = True
+        return filters
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """Tìm kiếm theo tên, mô tả, thương hiệu, danh mục (không phân biệt dấu), xếp theo độ liên quan"""
+        return cached_response(request, lambda: self._search(request))
+
+    def _search(self, request):
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 100)
+        except ValueError:
+            return Response({'detail': 'limit phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'detail': 'limit phải lớn hơn 0'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ranked = search_product_ids(query, limit=limit)
+        scores = dict(ranked)
+        products = self.get_queryset().in_bulk(list(scores))
+        results = [products[pk] for pk, _ in ranked if pk in products]
+
+        serializer = self.get_serializer(results, many=True)
+        data = serializer.data
+        for item in data:
+            item['score'] = scores[item['id']]
+        return Response({'query': query, 'count': len(data), 'results': data})
+
+    @action(detail=True, methods=['get'], url_path='variant-matrix')
+    def variant_matrix(self, request, pk=None):
+        """Toàn bộ lưới màu × size của sản phẩm trong một request (thay cho từng lần gọi biến thể)"""
+        return cached_response(request, lambda: self._variant_matrix(pk), product_id=pk)
+
+    def _variant_matrix(self, pk):
+        if not str(pk).isdigit() or not Product.objects.filter(id=pk).exists():
+            return Response({'detail': 'Không tìm thấy sản phẩm'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(build_variant_matrix(int(pk)))
+
 
 class ProductVariantDetailView(APIView):
     """API để lấy thông tin chi tiết biến thể sản phẩm"""
@@ -182,119 +347,155 @@ class ReviewView(APIView):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def placeOrder(request):
-    user = request.user
-    data = request.data
-    orderItems = data['orderItems']
+    if settings.ORDER_INTAKE_ASYNC:
+        # Đưa vào hàng đợi, worker process_order_intake tạo đơn (xem api.order_intake)
+        try:
+            intake = order_intake.enqueue(request.user, request.data)
+        except OrderError as exc:
+            return Response({'error': exc.message}, status=status.HTTP_400_BAD_REQUEST)
+        data = order_intake.describe(intake)
+        data['status_url'] = reverse('order-intake', kwargs={'pk': intake.id})
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+    try:
+        order = place_order(request.user, request.data)
+    except OrderError as exc:
+        return Response({'error': exc.message}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = OrderSerializer(order)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    if not orderItems or len(orderItems) == 0:
-        return Response({'detail': 'No Order items'}, status=status.HTTP_400_BAD_REQUEST)
 
-    totalPrice = data['totalPrice']
-    coupon_code = data.get('coupon_code')
-    discount = 0
-    coupon = None
-    if coupon_code:
-        try:
-            coupon = Coupon.objects.get(code=coupon_code)
-            if not coupon.is_valid():
-                return Response({'error': 'Mã giảm giá không hợp lệ hoặc đã hết hạn'}, status=status.HTTP_400_BAD_REQUEST)
-            if totalPrice < coupon.min_order_amount:
-                return Response(
-                    {'error': f'Đơn hàng chưa đạt mức tối thiểu {coupon.min_order_amount} VND'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            discount = coupon.discount_amount
-        except Coupon.DoesNotExist:
-            return Response({'error': 'Mã giảm giá không tồn tại'}, status=status.HTTP_400_BAD_REQUEST)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def order_intake_status(request, pk):
+    """Trạng thái của vé đặt hàng bất đồng bộ: pending/processing (kèm vị trí), done (kèm order_id) hoặc failed"""
+    intake = OrderIntake.objects.filter(id=pk, user=request.user).first()
+    if intake is None:
+        return Response({'error': 'Không tìm thấy yêu cầu đặt hàng'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(order_intake.describe(intake))
 
-    totalPrice = max(0, totalPrice - discount)
 
-    with transaction.atomic():
-        order = Order.objects.create(
-            user=user,
-            paymentMethod=data['paymentMethod'],
-            taxPrice=data['taxPrice'],
-            shippingPrice=data['shippingPrice'],
-            totalPrice=totalPrice,
-            coupon=coupon
-        )
+class CartReservationView(APIView):
+    """Giữ hàng cho giỏ hàng của user trong thời gian ngắn (xem api.reservations)"""
+    permission_classes = [IsAuthenticated]
 
-        shippingAddress = ShippingAddress.objects.create(
-            order=order,
-            address=data['shippingAddress']['address'],
-            city=data['shippingAddress']['city'],
-            postalCode=data['shippingAddress']['postalCode'],
-            country=data['shippingAddress']['country'],
-        )
+    def get(self, request):
+        reservations = StockReservation.objects.filter(user=request.user, expires_at__gt=timezone.now())
+        return Response([
+            {'id': reservation.product_id, 'variant_id': reservation.product_variant_id,
+             'held': reservation.qty, 'expires_at': reservation.expires_at}
+            for reservation in reservations
+        ])
+
+    def put(self, request):
+        """Body {"items": [{id, variant_id, qty}, ...]} là toàn bộ giỏ hàng"""
+        items = request.data.get('items') if isinstance(request.data, dict) else None
+        if not isinstance(items, list):
+            return Response({'error': 'items phải là danh sách'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            expires_at, results = reserve_cart(request.user, items)
+        except OrderError as exc:
+            return Response({'error': exc.message}, status=status.HTTP_400_BAD_REQUEST)
+        ok = not any('error' in result for result in results)
+        return Response({'expires_at': expires_at, 'items': results},
+                        status=status.HTTP_200_OK if ok else status.HTTP_409_CONFLICT)
 
-        for x in orderItems:
-            product = Product.objects.get(id=x['id'])
+    def delete(self, request):
+        release_cart(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-            # Xử lý biến thể sản phẩm
-            product_variant = None
-            color_name = None
-            size_name = None
-            item_price = product.price
 
-            if 'variant_id' in x and x['variant_id']:
-                # Nếu có variant_id, sử dụng biến thể
-                try:
-                    product_variant = ProductVariant.objects.get(id=x['variant_id'])
-                    color_name = product_variant.color.name
-                    size_name = product_variant.size.name
-                    item_price = product_variant.price
-
-                    # Kiểm tra tồn kho biến thể
-                    if product_variant.stock_quantity < x['qty']:
-                        return Response(
-                            {'error': f'Không đủ hàng cho {product.name} - {color_name} - {size_name}. Chỉ còn {product_variant.stock_quantity} sản phẩm.'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                    # Trừ tồn kho biến thể
-                    product_variant.stock_quantity -= x['qty']
-                    product_variant.save()
-
-                except ProductVariant.DoesNotExist:
-                    return Response(
-                        {'error': 'Biến thể sản phẩm không tồn tại'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            else:
-                # Sản phẩm không có biến thể, sử dụng tồn kho chính
-                if product.countInStock < x['qty']:
-                    return Response(
-                        {'error': f'Không đủ hàng cho {product.name}. Chỉ còn {product.countInStock} sản phẩm.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                product.countInStock -= x['qty']
-                product.save()
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def flash_sale_purchase(request, pk):
+    try:
+        order_id = flash_sale.purchase(request.user, int(pk), request.data)
+    except FlashSale.DoesNotExist:
+        return Response({'error': 'Flash sale không tồn tại'}, status=status.HTTP_404_NOT_FOUND)
+    except OrderError as exc:
+        return Response({'error': exc.message}, status=status.HTTP_409_CONFLICT)
+    except flash_sale.WriteTimeout:
+        return Response({'detail': 'Đơn hàng đang được xử lý'}, status=status.HTTP_202_ACCEPTED)
+    return Response({'id': order_id}, status=status.HTTP_201_CREATED)
 
-            # Tạo OrderItem
-            item = OrderItem.objects.create(
-                product=product,
-                product_variant=product_variant,
-                order=order,
-                productName=product.name,
-                qty=x['qty'],
-                price=item_price,
-                image=product.image.name,
-                color_name=color_name,
-                size_name=size_name
-            )
 
-        serializer = OrderSerializer(order)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def flash_sale_detail(request, pk):
+    try:
+        sale = flash_sale.get_sale(int(pk))
+    except FlashSale.DoesNotExist:
+        return Response({'error': 'Flash sale không tồn tại'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        'id': sale.id,
+        'product': sale.product_id,
+        'starts_at': sale.starts_at,
+        'ends_at': sale.ends_at,
+        'status': sale.status,
+        'remaining': flash_sale.remaining(sale) if sale.status == FlashSale.RUNNING else {},
+    })
 
 
 class OrderViewSet(GenericViewSet, ListModelMixin, RetrieveModelMixin, UpdateModelMixin):
-    def get_queryset(self):
-        if (self.request.user.is_staff):
-            return Order.objects.all()
-        return Order.objects.filter(user=self.request.user)
+    """
+    Danh sách đơn (mới nhất trước, phân trang theo con trỏ) với bộ lọc ?paid=, ?delivered=,
+    ?refunded= (true/false), ?created_from=, ?created_to= (ngày hoặc thời điểm ISO) và ?user= (chỉ admin)
+    """
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
+
+    def get_queryset(self):
+        queryset = Order.objects.select_related('user', 'shippingAddress').prefetch_related('orderitem_set')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        if self.action == 'list':
+            queryset = queryset.filter(**self._get_filters())
+        return queryset
+
+    def _get_filters(self):
+        params = self.request.query_params
+        filters = {}
+        for param, field in (('paid', 'isPaid'), ('delivered', 'isDelivered'), ('refunded', 'isRefunded')):
+            value = params.get(param, '').lower()
+            if value in ('1', 'true'):
+                filters[field] = True
+            elif value in ('0', 'false'):
+                filters[field] = False
+            elif value:
+                raise ValidationError({'detail': f'Invalid {param} value'})
+        if params.get('created_from'):
+            filters['createdAt__gte'] = self._parse_bound(params['created_from'])
+        if params.get('created_to'):
+            # Ngày kết thúc được tính trọn ngày
+            value = params['created_to']
+            bound = self._parse_bound(value)
+            if parse_datetime(value) is None:
+                filters['createdAt__lt'] = bound + timedelta(days=1)
+            else:
+                filters['createdAt__lte'] = bound
+        if params.get('user') and self.request.user.is_staff:
+            try:
+                filters['user_id'] = int(params['user'])
+            except ValueError:
+                raise ValidationError({'detail': 'Invalid user value'})
+        return filters
+
+    @staticmethod
+    def _parse_bound(value):
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                moment = day and datetime.combine(day, datetime.min.time())
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({'detail': 'Invalid date value'})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
 
 
 class ReviewViewSet(ModelViewSet):
@@ -303,45 +504,54 @@ class ReviewViewSet(ModelViewSet):
     permission_classes = [IsAdminUserOrReadOnly]
 
 
-stripe.api_key = settings.STRIPE_API_KEY
+def gateway_error_response(exc, key='error'):
+    """Phản hồi cho lỗi của cổng thanh toán: 503 kèm Retry-After khi Stripe gián đoạn, 400 khi Stripe từ chối"""
+    if isinstance(exc, stripe_gateway.GatewayUnavailable):
+        return Response({key: exc.message}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': str(exc.retry_after)})
+    return Response({key: exc.message}, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def update_order_to_paid(request, pk):
-    try:
-        # Lấy PaymentIntent từ Stripe
-        payment_intent = stripe.PaymentIntent.retrieve(request.data.get('payment_intent'))
-
-        if payment_intent.status == "succeeded":
-            order = get_object_or_404(Order, id=pk)
+    """
+    Trạng thái thanh toán Stripe của đơn, tra từ các sự kiện webhook đã nhận (api.stripe_events):
+    200 khi đơn đã thanh toán, 202 khi Stripe chưa gửi sự kiện tới (client hỏi lại sau)
+    """
+    order = get_object_or_404(Order, id=pk)
 
-            # Kiểm tra xem đơn hàng có phải của user hoặc admin không
-            if order.user != request.user and not request.user.is_staff:
-                return Response({'detail': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
+    # Kiểm tra xem đơn hàng có phải của user hoặc admin không
+    if order.user != request.user and not request.user.is_staff:
+        return Response({'detail': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
 
-            # Cập nhật trạng thái đơn hàng
-            order.isPaid = True
-            order.paidAt = datetime.now()
-            order.save()
+    event = None
+    payment_intent_id = request.data.get('payment_intent')
+    if not order.isPaid and payment_intent_id:
+        event = stripe_events.apply_for_intent(payment_intent_id)
+        order.refresh_from_db(fields=['isPaid'])
 
-            # Cập nhật số lượng total_sold cho từng sản phẩm
-            with transaction.atomic():
-                for item in order.orderitem_set.all():
-                    product = item.product
-                    product.total_sold += item.qty
-                    product.save()
+    if order.isPaid:
+        return Response({'detail': 'Thanh toán thành công, đơn hàng của bạn đã được cập nhật!'}, status=status.HTTP_200_OK)
+    if event is not None and event.status == StripeEvent.FAILED:
+        return Response({'detail': event.error}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'detail': 'Đang chờ xác nhận thanh toán từ Stripe'}, status=status.HTTP_202_ACCEPTED)
 
-            return Response({'detail': 'Thanh toán thành công, đơn hàng của bạn đã được cập nhật!'}, status=status.HTTP_200_OK)
 
-        else:
-            return Response({'detail': 'Payment not successful yet.'}, status=status.HTTP_400_BAD_REQUEST)
-
-    except stripe.error.StripeError as e:
-        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+class StripeWebhookView(APIView):
+    """
+    Webhook của Stripe: kiểm tra chữ ký rồi lưu sự kiện, worker apply_stripe_events áp dụng theo lô
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
 
-    except Exception as e:
-        return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    def post(self, request):
+        try:
+            event = stripe_events.verify(request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        created = stripe_events.ingest(event)
+        return Response({'received': True, 'duplicate': not created})
 
 
 class StripePaymentView(APIView):
@@ -349,15 +559,19 @@ class StripePaymentView(APIView):
         try:
             # print(request.data)
             order = get_object_or_404(Order, id=request.data['order'])
-            intent = stripe.PaymentIntent.create(
+            intent = stripe_gateway.get_gateway().create_payment_intent(
                 amount=int(order.totalPrice),  # VND doesn't use cents like USD/EUR
                 currency='vnd',
+                # Webhook payment_intent.succeeded tìm lại đơn qua metadata
+                metadata={'order_id': order.id},
                 automatic_payment_methods={
                     'enabled': True,
                 }
             )
 
             return Response({'clientSecret': intent['client_secret']})
+        except stripe_gateway.GatewayError as e:
+            return gateway_error_response(e)
         except Exception as e:
             print(e)
             return Response({'error': 'Something went wrong while creating stripe checkout session!'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -429,19 +643,23 @@ class ImageUploadView(APIView):
                 return Response({'error': 'File too large. Maximum size is 5MB.'},
                               status=status.HTTP_400_BAD_REQUEST)
 
-            # Generate unique filename
-            import uuid
-            file_extension = os.path.splitext(image_file.name)[1]
-            unique_filename = f"products/{uuid.uuid4()}{file_extension}"
+            # content_type do client gửi: kiểm tra nội dung thật bằng Pillow
+            if not image_extension(image_file):
+                return Response({'error': 'Invalid file type. Only JPEG, PNG, and GIF are allowed.'},
+                              status=status.HTTP_400_BAD_REQUEST)
 
-            # Save file
-            file_path = default_storage.save(unique_filename, ContentFile(image_file.read()))
+            # Storage đặt tên theo hash nội dung: ảnh trùng chỉ được lưu một lần
+            file_path = default_storage.save(image_file.name, image_file)
+
+            # Tạo sẵn ảnh phái sinh (thumbnail/card/detail + WebP)
+            generate_derivatives(file_path)
 
             # Return the file URL
             file_url = default_storage.url(file_path)
 
             return Response({
                 'image_url': file_url,
+                'image_urls': derivative_urls(file_path),
                 'message': 'Image uploaded successfully'
             }, status=status.HTTP_201_CREATED)
 
@@ -449,6 +667,136 @@ class ImageUploadView(APIView):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _upload_error(exc):
+    return Response({'error': str(exc), **exc.extra}, status=exc.status_code)
+
+
+class ChunkedUploadView(APIView):
+    """Bắt đầu một phiên upload ảnh theo từng phần (xem api.uploads)"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            upload = uploads.start_upload(request.user, request.data.get('filename'), request.data.get('size'))
+        except uploads.UploadError as exc:
+            return _upload_error(exc)
+        return Response({
+            'id': upload.id,
+            'offset': upload.received,
+            'size': upload.size,
+            'chunk_size': uploads.CHUNK_SIZE,
+        }, status=status.HTTP_201_CREATED)
+
+
+class ChunkedUploadDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        upload = get_object_or_404(ImageUpload, id=pk, user=request.user)
+        return Response({'id': upload.id, 'offset': upload.received, 'size': upload.size, 'complete': bool(upload.blob)})
+
+    def patch(self, request, pk):
+        """Body là byte thô của phần tiếp theo, header Upload-Offset là vị trí bắt đầu"""
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({'error': 'Upload-Offset header is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload, digest = uploads.append_chunk(
+                pk, request.user, offset, request._request, length,
+                expected_sha256=request.headers.get('Upload-Checksum'),
+            )
+        except ImageUpload.DoesNotExist:
+            raise Http404('Không tìm thấy phiên upload')
+        except uploads.UploadError as exc:
+            return _upload_error(exc)
+        return Response({'offset': upload.received, 'size': upload.size, 'chunk_sha256': digest})
+
+    def delete(self, request, pk):
+        try:
+            uploads.abort_upload(pk, request.user)
+        except ImageUpload.DoesNotExist:
+            raise Http404('Không tìm thấy phiên upload')
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChunkedUploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        try:
+            upload = uploads.finalize_upload(pk, request.user, expected_sha256=request.data.get('sha256'))
+        except ImageUpload.DoesNotExist:
+            raise Http404('Không tìm thấy phiên upload')
+        except uploads.UploadError as exc:
+            return _upload_error(exc)
+        return Response({
+            'image_url': default_storage.url(upload.blob),
+            'image_urls': derivative_urls(upload.blob),
+            'message': 'Image uploaded successfully'
+        }, status=status.HTTP_201_CREATED)
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(path, mtime_ns, size):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _media_response(request, full_path, name):
+    """
+    File media kèm ETag mạnh (hash nội dung) và Cache-Control.
+    File blob (tên theo hash) và ảnh phái sinh của nó không bao giờ đổi nội dung nên được cache vĩnh viễn.
+    """
+    stat = os.stat(full_path)
+    source = name.split('/', 2)[-1] if name.startswith(DERIVATIVES_DIR + '/') else name
+    digest = blob_digest(name) or _file_digest(full_path, stat.st_mtime_ns, stat.st_size)
+    headers = {
+        'ETag': f'"{digest}"',
+        'Cache-Control': MEDIA_IMMUTABLE_CACHE if is_blob(source) else MEDIA_CACHE,
+        'Last-Modified': http_date(stat.st_mtime),
+        'X-Content-Type-Options': 'nosniff',
+    }
+
+    if_none_match = request.headers.get('If-None-Match', '')
+    if headers['ETag'] in [tag.strip() for tag in if_none_match.split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        # Chỉ phục vụ ảnh inline từ origin của ứng dụng; file khác (vd .html) được tải về như dữ liệu nhị phân
+        content_type = mimetypes.guess_type(full_path)[0]
+        if content_type in MEDIA_IMAGE_TYPES:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        else:
+            response = FileResponse(open(full_path, 'rb'), as_attachment=True,
+                                    content_type='application/octet-stream')
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def serve_media(request, path):
+    full_path = safe_join(settings.MEDIA_ROOT, path)
+    if not os.path.isfile(full_path):
+        raise Http404('Không tìm thấy file')
+    return _media_response(request, full_path, path)
+
+
+def serve_derivative(request, size, path):
+    """
+    Trả về ảnh phái sinh từ cache trên đĩa; ảnh cũ chưa có bản phái sinh được tạo ở lần đầu.
+    Khi chạy sau web server, file đã có được phục vụ trực tiếp và chỉ lần thiếu mới tới đây.
+    """
+    full_path = safe_join(settings.MEDIA_ROOT, DERIVATIVES_DIR, size, path)
+    if not os.path.isfile(full_path):
+        name = find_source(size, path)
+        if name is None or not generate_derivatives(name):
+            raise Http404('Không tìm thấy ảnh')
+    return _media_response(request, full_path, f'{DERIVATIVES_DIR}/{size}/{path}')
+
 # ==================== PAYBOX WALLET VIEWS ====================
 
 class PayboxWalletView(APIView):
@@ -477,32 +825,35 @@ class PayboxWalletView(APIView):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class PayboxTransactionListView(APIView):
+class PayboxTransactionListView(ListAPIView):
     """
-    API để xem lịch sử giao dịch của ví
+    Sao kê giao dịch của ví người dùng hiện tại, phân trang theo con trỏ (mới nhất trước)
     """
     permission_classes = [IsAuthenticated]
+    serializer_class = PayboxTransactionSerializer
+    pagination_class = WalletTransactionCursorPagination
 
-    def get(self, request):
-        """Lấy danh sách giao dịch của người dùng hiện tại"""
-        try:
-            print(f"PayboxTransactionListView: User = {request.user}")
-
-            wallet, created = PayboxWallet.objects.get_or_create(user=request.user)
-            print(f"PayboxTransactionListView: Wallet = {wallet}")
+    def get_queryset(self):
+        wallet = wallets.get_wallet(self.request.user)
+        return PayboxTransaction.objects.filter(wallet=wallet).select_related('wallet__user', 'order')
 
-            transactions = PayboxTransaction.objects.filter(wallet=wallet)
-            print(f"PayboxTransactionListView: Found {transactions.count()} transactions")
 
-            serializer = PayboxTransactionSerializer(transactions, many=True)
-            print(f"PayboxTransactionListView: Serialized {len(serializer.data)} transactions")
+class PayboxStatementView(APIView):
+    """
+    Sao kê theo tháng của ví (số dư đầu/cuối tháng, tổng theo loại giao dịch), ?months= (mặc định 12)
+    """
+    permission_classes = [IsAuthenticated]
+    MAX_MONTHS = 120
 
-            return Response(serializer.data)
-        except Exception as e:
-            print(f"PayboxTransactionListView: Error = {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    def get(self, request):
+        try:
+            months = int(request.query_params.get('months', 12))
+        except ValueError:
+            raise ValidationError({'detail': 'Invalid months value'})
+        if not 1 <= months <= self.MAX_MONTHS:
+            raise ValidationError({'detail': 'Invalid months value'})
+        wallet = wallets.get_wallet(request.user)
+        return Response({'balance': wallet.balance, 'results': wallets.statement(wallet, months)})
 
 
 class PayboxDepositView(APIView):
@@ -525,7 +876,7 @@ class PayboxDepositView(APIView):
 
             # Tạo Stripe payment intent
             print(f"PayboxDepositView: Creating Stripe payment intent for amount {amount}")
-            intent = stripe.PaymentIntent.create(
+            intent = stripe_gateway.get_gateway().create_payment_intent(
                 amount=int(amount),  # VND không dùng cents
                 currency='vnd',
                 metadata={
@@ -546,6 +897,8 @@ class PayboxDepositView(APIView):
             print(f"PayboxDepositView: Returning response = {response_data}")
 
             return Response(response_data)
+        except stripe_gateway.GatewayError as e:
+            return gateway_error_response(e)
         except Exception as e:
             print(f"PayboxDepositView: Error = {str(e)}")
             import traceback
@@ -560,56 +913,21 @@ class PayboxDepositConfirmView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        """Xác nhận và cập nhật số dư ví sau khi thanh toán Stripe thành công"""
-        try:
-            payment_intent_id = request.data.get('payment_intent_id')
-            if not payment_intent_id:
-                return Response({'error': 'Payment intent ID is required'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Lấy thông tin payment intent từ Stripe
-            intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-
-            if intent['status'] != 'succeeded':
-                return Response({'error': 'Payment not completed'}, status=status.HTTP_400_BAD_REQUEST)
-
-            amount = intent['amount']
-
-            with transaction.atomic():
-                # Lấy hoặc tạo ví
-                wallet, created = PayboxWallet.objects.get_or_create(user=request.user)
-
-                # Kiểm tra xem giao dịch đã được xử lý chưa
-                existing_transaction = PayboxTransaction.objects.filter(
-                    stripe_payment_intent_id=payment_intent_id
-                ).first()
-
-                if existing_transaction:
-                    return Response({'error': 'Transaction already processed'}, status=status.HTTP_400_BAD_REQUEST)
-
-                # Lưu số dư trước giao dịch
-                balance_before = wallet.balance
-
-                # Cập nhật số dư ví
-                wallet.add_balance(amount)
-
-                # Tạo giao dịch
-                PayboxTransaction.objects.create(
-                    wallet=wallet,
-                    transaction_type='DEPOSIT',
-                    amount=amount,
-                    status='COMPLETED',
-                    description=f'Nạp tiền qua Stripe - {payment_intent_id}',
-                    stripe_payment_intent_id=payment_intent_id,
-                    balance_before=balance_before,
-                    balance_after=wallet.balance
-                )
-
+        """Trạng thái nạp tiền, tra từ sổ giao dịch và các sự kiện webhook đã nhận (api.stripe_events)"""
+        payment_intent_id = request.data.get('payment_intent_id')
+        if not payment_intent_id:
+            return Response({'error': 'Payment intent ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        event = stripe_events.apply_for_intent(payment_intent_id)
+        wallet = wallets.get_wallet(request.user)
+        if PayboxTransaction.objects.filter(wallet=wallet, stripe_payment_intent_id=payment_intent_id).exists():
             return Response({
                 'message': 'Nạp tiền thành công',
                 'new_balance': wallet.balance
             })
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if event is not None and event.status == StripeEvent.FAILED:
+            return Response({'error': event.error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'message': 'Đang chờ xác nhận thanh toán từ Stripe'}, status=status.HTTP_202_ACCEPTED)
 
 
 class PayboxPaymentView(APIView):
@@ -618,6 +936,7 @@ class PayboxPaymentView(APIView):
     """
     permission_classes = [IsAuthenticated]
 
+    @method_decorator(idempotent)
     def post(self, request):
         """Thanh toán đơn hàng bằng số dư ví Paybox"""
         try:
@@ -632,53 +951,92 @@ class PayboxPaymentView(APIView):
                 return Response({'error': 'Đơn hàng đã được thanh toán'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Lấy ví của người dùng
-            wallet, created = PayboxWallet.objects.get_or_create(user=request.user)
-
-            # Kiểm tra số dư
-            if not wallet.has_sufficient_balance(float(order.totalPrice)):
-                return Response({
-                    'error': 'Số dư không đủ để thanh toán đơn hàng',
-                    'required': float(order.totalPrice),
-                    'available': float(wallet.balance)
-                }, status=status.HTTP_400_BAD_REQUEST)
+            wallet = wallets.get_wallet(request.user)
 
             with transaction.atomic():
-                # Lưu số dư trước giao dịch
-                balance_before = wallet.balance
-
-                # Trừ tiền từ ví
-                if wallet.deduct_balance(order.totalPrice):
-                    # Cập nhật trạng thái đơn hàng
-                    order.isPaid = True
-                    order.paidAt = timezone.now()
-                    order.paymentMethod = 'Paybox'
-                    order.save()
-
-                    # Tạo giao dịch
-                    PayboxTransaction.objects.create(
-                        wallet=wallet,
-                        transaction_type='PAYMENT',
-                        amount=order.totalPrice,
-                        status='COMPLETED',
-                        description=f'Thanh toán đơn hàng #{order.id}',
-                        order=order,
-                        balance_before=balance_before,
-                        balance_after=wallet.balance
+                # Trừ tiền trước (khóa ví trước đơn hàng, xem api.wallets); không đủ số dư thì dừng ở đây
+                try:
+                    wallets.debit(
+                        wallet, order.totalPrice, 'PAYMENT',
+                        description=f'Thanh toán đơn hàng #{order.id}', order=order,
                     )
-
+                except wallets.InsufficientBalance as exc:
                     return Response({
-                        'message': 'Thanh toán thành công',
-                        'order_id': order.id,
-                        'amount_paid': float(order.totalPrice),
-                        'remaining_balance': float(wallet.balance)
-                    })
-                else:
-                    return Response({'error': 'Không thể thực hiện thanh toán'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                        'error': 'Số dư không đủ để thanh toán đơn hàng',
+                        'required': float(exc.required),
+                        'available': float(exc.available)
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
+                # Request đồng thời đã thanh toán đơn này: hoàn tác khoản vừa trừ
+                if not mark_paid(order, payment_method='Paybox'):
+                    transaction.set_rollback(True)
+                    return Response({'error': 'Đơn hàng đã được thanh toán'}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response({
+                'message': 'Thanh toán thành công',
+                'order_id': order.id,
+                'amount_paid': float(order.totalPrice),
+                'remaining_balance': float(wallet.balance)
+            })
 
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class AdminSalesAnalyticsView(APIView):
+    """
+    Doanh số từ bảng tổng hợp (api.sales_rollups): ?from=&to= (YYYY-MM-DD, mặc định 30 ngày gần nhất),
+    ?dimension=total|category|brand|payment_method, ?group=day|total
+    """
+    permission_classes = [permissions.IsAdminUser]
+    MAX_DAYS = 366 * 3
+
+    def get(self, request):
+        params = request.query_params
+        end = self._parse_day(params.get('to')) or timezone.localdate()
+        start = self._parse_day(params.get('from')) or end - timedelta(days=29)
+        dimension = params.get('dimension', SalesRollup.TOTAL)
+        group = params.get('group', 'day')
+        if dimension not in sales_rollups.DIMENSIONS or group not in ('day', 'total'):
+            raise ValidationError({'detail': 'Invalid dimension or group'})
+        if start > end or (end - start).days > self.MAX_DAYS:
+            raise ValidationError({'detail': 'Invalid date range'})
+        return Response({
+            'from': start,
+            'to': end,
+            'dimension': dimension,
+            'group': group,
+            'results': sales_rollups.query(start, end, dimension, by_day=group == 'day'),
+        })
+
+    @staticmethod
+    def _parse_day(value):
+        if not value:
+            return None
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError({'detail': 'Invalid date value'})
+        return day
+
+
+class AdminPaymentGatewayMetricsView(APIView):
+    """
+    Trạng thái mạch và số liệu các lời gọi Stripe (api.stripe_gateway) của process đang phục vụ request
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        gateway = stripe_gateway.get_gateway()
+        return Response({
+            'circuit': gateway.breaker.state,
+            'consecutive_failures': gateway.breaker.failures,
+            'operations': gateway.metrics.snapshot(),
+        })
+
+
 # ==================== ADMIN PAYBOX VIEWS ====================
 
 class AdminPayboxWalletListView(APIView):
@@ -712,7 +1070,7 @@ class AdminPayboxTransactionListView(APIView):
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            transactions = PayboxTransaction.objects.all().order_by('-created_at')
+            transactions = PayboxTransaction.objects.select_related('wallet__user', 'order').order_by('-created_at')
             serializer = PayboxTransactionSerializer(transactions, many=True)
             return Response(serializer.data)
         except Exception as e:
@@ -784,30 +1142,24 @@ class ApproveRefundRequestView(APIView):
         if refund.is_approved:
             return Response({'error': 'Yêu cầu đã được duyệt'}, status=400)
 
-        wallet, _ = PayboxWallet.objects.get_or_create(user=order.user)
-        balance_before = wallet.balance
+        wallet = wallets.get_wallet(order.user)
 
         with transaction.atomic():
-            wallet.add_balance(order.totalPrice)
-
-            order.isRefunded = True
-            order.save()
+            # Cộng tiền trước (khóa ví trước đơn hàng, xem api.wallets)
+            if order.totalPrice > 0:
+                wallets.credit(
+                    wallet, order.totalPrice, 'REFUND',
+                    description=f'Hoàn tiền cho đơn hàng #{order.id}', order=order,
+                )
+            # Yêu cầu duyệt đồng thời đã hoàn tiền đơn này: hoàn tác khoản vừa cộng
+            if not mark_refunded(order):
+                transaction.set_rollback(True)
+                return Response({'error': 'Đơn hàng đã được hoàn tiền'}, status=400)
 
             refund.is_approved = True
             refund.approved_at = timezone.now()
             refund.save()
 
-            PayboxTransaction.objects.create(
-                wallet=wallet,
-                transaction_type='REFUND',
-                amount=order.totalPrice,
-                status='COMPLETED',
-                description=f'Hoàn tiền cho đơn hàng #{order.id}',
-                order=order,
-                balance_before=balance_before,
-                balance_after=wallet.balance
-            )
-
         return Response({'message': 'Đã hoàn tiền thành công'}, status=200)
 class RejectRefundRequestView(APIView):
     permission_classes = [IsAuthenticated]
@@ -888,9 +1240,10 @@ class FavoriteView(APIView):
     
     def get(self, request):
         """Lấy danh sách sản phẩm yêu thích của người dùng"""
-        favorites = Favorite.objects.filter(user=request.user)
-        products = [favorite.product for favorite in favorites]
-        serializer = ProductSerializer(products, many=True)
+        products = Product.objects.with_stock_summary().with_related().filter(
+            favorite__user=request.user
+        ).order_by('favorite__created_at')
+        serializer = ProductSerializer(products, many=True, context={'request': request})
         return Response(serializer.data)
     
     def post(self, request):
@@ -0,0 +1,246 @@
+"""
+Thay đổi số dư ví Paybox.
+
+Số dư được cộng/trừ bằng một UPDATE có điều kiện (balance >= số tiền khi trừ) nên hai giao dịch
+đồng thời không thể cùng đọc một số dư rồi ghi đè lên nhau, và ví không bao giờ bị âm. Số dư sau
+giao dịch được đọc lại ngay sau UPDATE trong cùng transaction (dòng ví đang bị khóa nên không có
+giao dịch khác chen vào), rồi dòng PayboxTransaction được ghi trong transaction đó, nên
+balance_before/balance_after luôn nối tiếp nhau.
+
+Thứ tự khóa: dòng ví luôn được khóa trước đơn hàng, sản phẩm và bảng tổng hợp (thanh toán,
+hoàn tiền đều trừ/cộng ví trước rồi mới đánh dấu đơn) để tránh deadlock.
+
+PayboxTransaction là sổ chỉ ghi thêm và là nguồn gốc của số dư: mỗi giao dịch có số thứ tự
+liên tục trong ví (tăng cùng UPDATE số dư), cứ SNAPSHOT_EVERY giao dịch thì ghi một
+WalletSnapshot. Số dư hiện tại hoặc tại một thời điểm = snapshot gần nhất + tổng chênh lệch của
+tối đa SNAPSHOT_EVERY giao dịch sau nó (balance_at); PayboxWallet.balance là bản sao để kiểm
+tra điều kiện khi trừ tiền, được đối chiếu bằng lệnh compact_wallet_ledger --verify.
+
+Sao kê tháng (WalletMonthlySummary: số dư đầu/cuối tháng, tổng theo loại giao dịch) được cộng
+dồn cùng transaction ghi giao dịch, nên API sao kê chỉ đọc vài dòng tổng hợp. Lệnh
+rebuild_wallet_statements tính lại từ sổ.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.models import PayboxTransaction, PayboxWallet, WalletMonthlySummary, WalletSnapshot
+
+SNAPSHOT_EVERY = getattr(settings, 'WALLET_SNAPSHOT_EVERY', 100)
+# Cột tổng của WalletMonthlySummary theo loại giao dịch
+TYPE_TOTALS = {'DEPOSIT': 'deposits', 'PAYMENT': 'payments', 'REFUND': 'refunds', 'TRANSFER': 'transfers'}
+
+
+class WalletError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class InsufficientBalance(WalletError):
+    def __init__(self, required, available):
+        super().__init__('Số dư không đủ')
+        self.required = required
+        self.available = available
+
+
+def get_wallet(user):
+    wallet, _ = PayboxWallet.objects.get_or_create(user=user)
+    return wallet
+
+
+def lock_wallet(wallet):
+    """Khóa dòng ví tới hết transaction hiện tại"""
+    PayboxWallet.objects.select_for_update().filter(id=wallet.id).values_list('id', flat=True).first()
+
+
+def _change_balance(wallet, delta):
+    """
+    Cộng delta (âm là trừ) vào số dư và tăng số thứ tự bằng một UPDATE có điều kiện;
+    trả về (số dư mới, số thứ tự), None nếu không đủ tiền. Phải gọi trong transaction.
+    """
+    wallets = PayboxWallet.objects.filter(id=wallet.id)
+    if delta < 0:
+        wallets = wallets.filter(balance__gte=-delta)
+    if not wallets.update(balance=F('balance') + delta, last_sequence=F('last_sequence') + 1,
+                          updated_at=timezone.now()):
+        return None
+    # Đọc lại trong cùng transaction: dòng vừa UPDATE đang bị khóa (MySQL không có UPDATE ... RETURNING)
+    balance, sequence = PayboxWallet.objects.filter(id=wallet.id).values_list('balance', 'last_sequence').get()
+    wallet.balance, wallet.last_sequence = balance, sequence
+    return balance, sequence
+
+
+def _apply(wallet, delta, transaction_type, amount, **fields):
+    with transaction.atomic():
+        changed = _change_balance(wallet, delta)
+        if changed is None:
+            available = PayboxWallet.objects.filter(id=wallet.id).values_list('balance', flat=True).get()
+            wallet.balance = available
+            raise InsufficientBalance(amount, available)
+        balance, sequence = changed
+        record = PayboxTransaction.objects.create(
+            wallet=wallet,
+            sequence=sequence,
+            transaction_type=transaction_type,
+            amount=amount,
+            status='COMPLETED',
+            balance_before=balance - delta,
+            balance_after=balance,
+            **fields,
+        )
+        if sequence % SNAPSHOT_EVERY == 0:
+            WalletSnapshot.objects.create(wallet=wallet, sequence=sequence, balance=balance, as_of=record.created_at)
+        _record_monthly(record)
+        return record
+
+
+def _month(moment):
+    return timezone.localdate(moment).replace(day=1)
+
+
+def _record_monthly(record):
+    """Cộng giao dịch vào sao kê tháng; dòng ví đang bị khóa nên không có giao dịch khác của ví chen vào"""
+    month = _month(record.created_at)
+    total = TYPE_TOTALS[record.transaction_type]
+    rows = WalletMonthlySummary.objects.filter(wallet_id=record.wallet_id, month=month)
+    if not rows.update(closing_balance=record.balance_after, transaction_count=F('transaction_count') + 1,
+                       **{total: F(total) + record.amount}):
+        WalletMonthlySummary.objects.create(
+            wallet_id=record.wallet_id, month=month, opening_balance=record.balance_before,
+            closing_balance=record.balance_after, transaction_count=1, **{total: record.amount},
+        )
+
+
+def credit(wallet, amount, transaction_type, **fields):
+    """Cộng tiền và ghi giao dịch; trả về PayboxTransaction"""
+    if amount <= 0:
+        raise WalletError('Số tiền phải lớn hơn 0')
+    return _apply(wallet, amount, transaction_type, amount, **fields)
+
+
+def debit(wallet, amount, transaction_type, **fields):
+    """Trừ tiền và ghi giao dịch; ném InsufficientBalance nếu không đủ số dư"""
+    if amount <= 0:
+        raise WalletError('Số tiền phải lớn hơn 0')
+    return _apply(wallet, -amount, transaction_type, amount, **fields)
+
+
+def _delta_sum():
+    return Sum(F('balance_after') - F('balance_before'), output_field=DecimalField(max_digits=14, decimal_places=0))
+
+
+def balance_at(wallet, moment=None):
+    """Số dư của ví hiện tại (moment=None) hoặc tại một thời điểm, tính từ sổ giao dịch"""
+    snapshots = WalletSnapshot.objects.filter(wallet_id=wallet.id)
+    transactions = PayboxTransaction.objects.filter(wallet_id=wallet.id)
+    if moment is not None:
+        snapshots = snapshots.filter(as_of__lte=moment)
+        transactions = transactions.filter(created_at__lte=moment)
+    snapshot = snapshots.order_by('-sequence').values_list('sequence', 'balance').first()
+    sequence, balance = snapshot or (0, 0)
+    tail = transactions.filter(sequence__gt=sequence).order_by().aggregate(delta=_delta_sum())['delta']
+    return balance + (tail or 0)
+
+
+def compact(min_tail=SNAPSHOT_EVERY, batch_size=500):
+    """
+    Ghi snapshot mới cho các ví có từ min_tail giao dịch trở lên sau snapshot gần nhất, theo lô:
+    mỗi lô một truy vấn tổng hợp và một bulk_create. Trả về số snapshot đã ghi.
+    """
+    latest = WalletSnapshot.objects.filter(wallet_id=OuterRef('wallet_id')).order_by('-sequence')
+    last_id = 0
+    written = 0
+    while True:
+        wallet_ids = list(
+            PayboxWallet.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not wallet_ids:
+            return written
+        last_id = wallet_ids[-1]
+        bases = {
+            row['wallet_id']: row
+            for row in WalletSnapshot.objects.filter(wallet_id__in=wallet_ids, sequence=Subquery(latest.values('sequence')[:1]))
+            .values('wallet_id', 'sequence', 'balance')
+        }
+        tails = (
+            PayboxTransaction.objects.filter(wallet_id__in=wallet_ids)
+            .annotate(base=Subquery(latest.values('sequence')[:1]))
+            .filter(sequence__gt=Coalesce(F('base'), 0))
+            .order_by().values('wallet_id')
+            .annotate(delta=_delta_sum(), count=Count('id'), last=Max('sequence'), as_of=Max('created_at'))
+        )
+        snapshots = []
+        for tail in tails:
+            if tail['count'] < min_tail:
+                continue
+            base = bases.get(tail['wallet_id'], {'balance': 0})
+            snapshots.append(WalletSnapshot(
+                wallet_id=tail['wallet_id'], sequence=tail['last'],
+                balance=base['balance'] + (tail['delta'] or 0), as_of=tail['as_of'],
+            ))
+        WalletSnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+        written += len(snapshots)
+
+
+def verify(wallet_ids=None):
+    """[(wallet_id, số dư lưu trong ví, số dư tính từ sổ)] của các ví bị lệch"""
+    wallets = PayboxWallet.objects.order_by('id')
+    if wallet_ids is not None:
+        wallets = wallets.filter(id__in=wallet_ids)
+    drift = []
+    for wallet in wallets.only('id', 'balance').iterator():
+        computed = balance_at(wallet)
+        if computed != wallet.balance:
+            drift.append((wallet.id, wallet.balance, computed))
+    return drift
+
+
+def monthly_summaries(wallet_ids=None):
+    """Tính sao kê tháng từ sổ giao dịch, đọc tuần tự theo (ví, số thứ tự); trả về danh sách WalletMonthlySummary chưa lưu"""
+    transactions = PayboxTransaction.objects.order_by('wallet_id', 'sequence')
+    if wallet_ids is not None:
+        transactions = transactions.filter(wallet_id__in=wallet_ids)
+    summaries = {}
+    rows = transactions.values_list('wallet_id', 'created_at', 'transaction_type', 'amount',
+                                    'balance_before', 'balance_after')
+    for wallet_id, created_at, transaction_type, amount, before, after in rows.iterator(chunk_size=2000):
+        key = (wallet_id, _month(created_at))
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = WalletMonthlySummary(
+                wallet_id=wallet_id, month=key[1], opening_balance=before, transaction_count=0)
+        summary.closing_balance = after
+        summary.transaction_count += 1
+        total = TYPE_TOTALS[transaction_type]
+        setattr(summary, total, getattr(summary, total) + amount)
+    return list(summaries.values())
+
+
+def rebuild_monthly_summaries(wallet_ids=None):
+    """Xóa và ghi lại sao kê tháng (của các ví wallet_ids, mặc định tất cả); trả về số dòng đã ghi"""
+    summaries = monthly_summaries(wallet_ids)
+    with transaction.atomic():
+        stale = WalletMonthlySummary.objects.all()
+        if wallet_ids is not None:
+            stale = stale.filter(wallet_id__in=wallet_ids)
+        stale.delete()
+        WalletMonthlySummary.objects.bulk_create(summaries, batch_size=500)
+    return len(summaries)
+
+
+def statement(wallet, months=12):
+    """Sao kê của months tháng gần nhất có giao dịch, mới nhất trước"""
+    rows = WalletMonthlySummary.objects.filter(wallet_id=wallet.id).order_by('-month')[:months]
+    return [
+        {
+            'month': row.month.strftime('%Y-%m'),
+            'opening_balance': row.opening_balance,
+            'closing_balance': row.closing_balance,
+            'transaction_count': row.transaction_count,
+            'totals': {transaction_type: getattr(row, total) for transaction_type, total in TYPE_TOTALS.items()},
+        }
+        for row in rows
+    ]
@@ -7,13 +7,14 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 django.setup()
 
+import api.routing
 import chat.routing
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),  # thêm dòng này để xử lý HTTP
     "websocket": AuthMiddlewareStack(
         URLRouter(
-            chat.routing.websocket_urlpatterns
+            chat.routing.websocket_urlpatterns + api.routing.order_intake_urlpatterns
         )
     ),
 })
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 from datetime import timedelta
 from pathlib import Path
 import dj_database_url
+from corsheaders.defaults import default_headers
 import dotenv
 dotenv.load_dotenv()
 
@@ -157,6 +158,23 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/images/'
 MEDIA_ROOT = 'static/images'
+# File upload được đặt tên theo hash nội dung và chỉ lưu một lần (api/storage.py)
+DEFAULT_FILE_STORAGE = 'api.storage.ContentAddressedStorage'
+
+# Ảnh phái sinh (rộng, cao tối đa) cho ảnh sản phẩm, mỗi loại có bản JPEG/PNG và WebP
+IMAGE_DERIVATIVES = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+IMAGE_DERIVATIVE_QUALITY = 82
+
+# Upload ảnh theo từng phần (api/uploads.py): file tạm nằm ngoài MEDIA_ROOT,
+# mỗi request gửi tối đa CHUNK_SIZE byte, phiên không hoạt động quá EXPIRY_HOURS bị gc_media_blobs dọn
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'tmp', 'uploads')
+CHUNKED_UPLOAD_CHUNK_SIZE = 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+CHUNKED_UPLOAD_EXPIRY_HOURS = 24
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
@@ -169,6 +187,13 @@ CORS_ALLOW_ALL_ORIGINS = True
 #     "http://localhost:3000",
 #     "http://127.0.0.1:3000",
 # ]
+# Header riêng của API: Idempotency-Key (đặt hàng/thanh toán), Upload-Offset/Upload-Checksum (upload theo phần)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'upload-offset', 'upload-checksum')
+CORS_EXPOSE_HEADERS = ('Idempotent-Replayed',)
+
+# Idempotency-Key (api/idempotency.py): thời gian request trùng chờ request đầu tiên và thời gian giữ key
+IDEMPOTENCY_WAIT_SECONDS = 10
+IDEMPOTENCY_KEY_TTL_HOURS = 24
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -234,7 +259,54 @@ SIMPLE_JWT = {
 }
 
 
+# Cache cho API sản phẩm; khi chạy nhiều worker nên dùng cache dùng chung (Redis/Memcached)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Bộ đếm tồn kho flash sale (api/flash_sale.py): không được bị cull như cache thường;
+    # chạy nhiều process thì phải đổi sang cache dùng chung (Redis/Memcached)
+    'flash_sale': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'flash-sale',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+FLASH_SALE_CACHE = 'flash_sale'
+CATALOG_CACHE_TIMEOUT = 300
+
+# Nhận đơn bất đồng bộ (api/order_intake.py): placeOrder chỉ lưu vào hàng đợi và trả 202,
+# các worker `manage.py process_order_intake --processes N` tạo đơn
+ORDER_INTAKE_ASYNC = False
+ORDER_INTAKE_BATCH_SIZE = 50
+
+# Sổ giao dịch ví (api/wallets.py): cứ N giao dịch ghi một snapshot số dư; lệnh
+# compact_wallet_ledger ghi bù snapshot và đối chiếu số dư với sổ
+WALLET_SNAPSHOT_EVERY = 100
+
+# Thời gian giữ hàng cho giỏ hàng (api/reservations.py); hàng hết hạn được trả lại kho
+# bởi lệnh release_expired_reservations (chạy định kỳ, ví dụ mỗi phút)
+STOCK_RESERVATION_MINUTES = 15
+
+# Chỉ mục facet trong bộ nhớ (api/facets.py): mỗi process xây lại tối đa một lần trong N giây
+# khi catalog thay đổi liên tục; trong lúc đó phản hồi lọc không được cache
+FACET_INDEX_REBUILD_INTERVAL = 5
+
+
 STRIPE_API_KEY = os.getenv('STRIPE_API_KEY')
+# Thanh toán được xác nhận qua webhook (api/stripe_events.py): Stripe gửi tới /api/stripe/webhook/,
+# lệnh `manage.py apply_stripe_events` áp dụng vào đơn hàng/ví
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_EVENT_BATCH_SIZE = 100
+# Địa chỉ API Stripe khác mặc định, ví dụ http://127.0.0.1:12111 của `manage.py fake_stripe_server`
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
+# Lời gọi API Stripe (api/stripe_gateway.py): thời gian chờ mỗi lời gọi (giây), số lần thử lại,
+# pool kết nối, và ngắt mạch sau N lỗi liên tiếp trong M giây
+STRIPE_TIMEOUT = 10
+STRIPE_MAX_RETRIES = 2
+STRIPE_POOL_SIZE = 20
+STRIPE_CIRCUIT_FAILURES = 5
+STRIPE_CIRCUIT_RESET_SECONDS = 30
 
 # CSRF settings
 CSRF_COOKIE_SECURE = False  # Set to True in production with HTTPS
@@ -14,9 +14,10 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from api.images import DERIVATIVES_DIR
+from api.views import serve_derivative, serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,5 +27,9 @@ urlpatterns = [
     path('auth/', include('djoser.urls.jwt')),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
+# Ảnh phái sinh được tạo khi có request đầu tiên, phải đứng trước route phục vụ MEDIA
+media_prefix = settings.MEDIA_URL.lstrip('/')
+urlpatterns += [
+    re_path(rf'^{media_prefix}{DERIVATIVES_DIR}/(?P<size>[\w-]+)/(?P<path>.+)$', serve_derivative),
+    re_path(rf'^{media_prefix}(?P<path>.+)$', serve_media),
+]
@@ -1,11 +1,18 @@
-import React, { useContext } from "react";
+import React, { useContext, useEffect } from "react";
 import { Card, Table, Badge, Button } from "react-bootstrap";
 import PayboxContext from "../context/payboxContext";
 import Loader from "./loader";
 import Message from "./message";
 
 function PayboxTransactions() {
-  const { transactions, loading, error, formatVND, fetchTransactions } = useContext(PayboxContext);
+  const {
+    transactions, hasMoreTransactions, loadMoreTransactions, statements, fetchStatements,
+    loading, error, formatVND, fetchTransactions
+  } = useContext(PayboxContext);
+
+  useEffect(() => {
+    fetchStatements();
+  }, [transactions.length]); // eslint-disable-line react-hooks/exhaustive-deps
 
   const getTransactionIcon = (type) => {
     switch (type) {
@@ -139,13 +146,51 @@ function PayboxTransactions() {
       </Card.Body>
       
       {transactions.length > 0 && (
-        <Card.Footer className="text-muted">
+        <Card.Footer className="text-muted d-flex justify-content-between align-items-center">
           <small>
             <i className="fas fa-info-circle me-1"></i>
             Hiển thị {transactions.length} giao dịch gần nhất
           </small>
+          {hasMoreTransactions && (
+            <Button variant="outline-secondary" size="sm" onClick={loadMoreTransactions}>
+              Xem thêm
+            </Button>
+          )}
         </Card.Footer>
       )}
+
+      {statements.length > 0 && (
+        <Card.Body className="border-top">
+          <h6 className="mb-3">
+            <i className="fas fa-calendar-alt me-2"></i>
+            Sao kê theo tháng
+          </h6>
+          <Table size="sm" className="mb-0">
+            <thead className="table-light">
+              <tr>
+                <th>Tháng</th>
+                <th>Số dư đầu</th>
+                <th>Nạp</th>
+                <th>Thanh toán</th>
+                <th>Hoàn tiền</th>
+                <th>Số dư cuối</th>
+              </tr>
+            </thead>
+            <tbody>
+              {statements.map((month) => (
+                <tr key={month.month}>
+                  <td>{month.month}</td>
+                  <td>{formatVND(month.opening_balance)}</td>
+                  <td className="text-success">+{formatVND(month.totals.DEPOSIT)}</td>
+                  <td className="text-danger">-{formatVND(month.totals.PAYMENT)}</td>
+                  <td className="text-info">+{formatVND(month.totals.REFUND)}</td>
+                  <td><strong>{formatVND(month.closing_balance)}</strong></td>
+                </tr>
+              ))}
+            </tbody>
+          </Table>
+        </Card.Body>
+      )}
     </Card>
   );
 }
@@ -1,5 +1,5 @@
 import React, { useContext, useState, useEffect } from "react";
-import httpService from "../services/httpService";
+import { fetchAllOrders } from "../services/orderService";
 import UserContext from "../context/userContext";
 import Loader from "./loader";
 import Message from "./message";
@@ -16,8 +16,7 @@ function OrdersList(props) {
   useEffect(() => {
     const fecthOrders = async () => {
       try {
-        const { data } = await httpService.get("/api/orders/");
-        setOrders(data);
+        setOrders(await fetchAllOrders());
       } catch (ex) {
         if (ex.response && ex.response.status == 403) logout();
         setError(ex.message);
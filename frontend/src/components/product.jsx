@@ -2,6 +2,7 @@ import React from "react";
 import { Card, Badge } from "react-bootstrap";
 import { Link } from "react-router-dom";
 import Rating from "./rating";
+import ProductImage from "./productImage";
 import { formatVND } from "../utils/currency";
 
 function Product({ product, showSoldCount = false }) {
@@ -13,7 +14,7 @@ function Product({ product, showSoldCount = false }) {
           window.scrollTo(0, 0);
         }}
       >
-        <Card.Img src={product.image} />
+        <ProductImage product={product} as={Card.Img} />
       </Link>
       <Card.Body>
         <Link
@@ -0,0 +1,18 @@
+import React from "react";
+
+// Ảnh sản phẩm dùng bản phái sinh theo kích thước (thumbnail/card/detail), ưu tiên WebP
+function ProductImage({ product, size = "card", as: Component = "img", ...props }) {
+  const urls = product.image_urls?.[size];
+  if (!urls) {
+    return <Component src={product.image} alt={product.name} loading="lazy" {...props} />;
+  }
+
+  return (
+    <picture>
+      <source srcSet={urls.webp} type="image/webp" />
+      <Component src={urls.src} alt={product.name} loading="lazy" {...props} />
+    </picture>
+  );
+}
+
+export default ProductImage;
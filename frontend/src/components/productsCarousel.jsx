@@ -2,6 +2,7 @@ import React from 'react';
 import { Link } from 'react-router-dom';
 import { Carousel, Image } from 'react-bootstrap';
 import { formatVND } from '../utils/currency';
+import ProductImage from './productImage';
 
 function ProductsCarousel({products}) {
     let topRatedProducts = [...products];
@@ -12,7 +13,7 @@ function ProductsCarousel({products}) {
         <Carousel pause="hover" className='bg-dark'>
             {topRatedProducts.map((product) => (<Carousel.Item key={product.id}>
                 <Link to={`/products/${product.id}`}>
-                    <Image src={product.image} alt={product.name} style={{objectFit:'cover'}}/>
+                    <ProductImage product={product} size='detail' as={Image} style={{objectFit:'cover'}}/>
                     <Carousel.Caption className='carousel-caption'>
                         <h4>{product.name} ({formatVND(product.price)})</h4></Carousel.Caption>
                 </Link>
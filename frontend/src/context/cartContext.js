@@ -1,8 +1,9 @@
-import { createContext, useState, useContext } from "react";
+import { createContext, useState, useContext, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import httpService from "../services/httpService";
 import UserContext from './userContext';
 import { CURRENCY } from "../utils/currency";
+import { idempotencyHeaders, newIdempotencyKey } from "../utils/idempotency";
 
 const CartContext = createContext();
 
@@ -32,6 +33,23 @@ export const CartProvider = ({ children }) => {
   const [discountAmount, setDiscountAmount] = useState(0);
   const navigate = useNavigate();
   const { logout } = useContext(UserContext);
+  // Giữ nguyên khóa khi đặt lại sau lỗi mạng để server không tạo đơn trùng
+  const checkoutKey = useRef(null);
+
+  // Giữ hàng trên server cho giỏ hàng (khi đã đăng nhập), để không bị hết hàng lúc đặt
+  const syncReservations = async (items) => {
+    if (!localStorage.getItem("authTokens")) return;
+    try {
+      await httpService.put("/api/cart/reservations/", {
+        items: items.map(item => ({ id: item.id, variant_id: item.variant_id, qty: item.qty })),
+      });
+    } catch (ex) {
+      if (ex.response?.status === 409) {
+        const failed = ex.response.data.items?.find(item => item.error);
+        setError(failed?.error || "Không đủ hàng");
+      }
+    }
+  };
 
   const addItemToCart = async (cartItem, qtyParam = 1) => {
     // cartItem có thể là object {id, qty, variant_id, color, size} hoặc chỉ là id (backward compatibility)
@@ -86,6 +104,7 @@ export const CartProvider = ({ children }) => {
         JSON.stringify([...productsInCart, product])
       );
       setProductsInCart([...productsInCart, product]);
+      syncReservations([...productsInCart, product]);
     } catch (ex) {
       setError(ex.message);
     }
@@ -104,6 +123,7 @@ export const CartProvider = ({ children }) => {
     );
     localStorage.setItem("cartItems", JSON.stringify(updatedProductsInCart));
     setProductsInCart(updatedProductsInCart);
+    syncReservations(updatedProductsInCart);
   };
 
   const removeFromCart = (uniqueKey) => {
@@ -113,6 +133,7 @@ export const CartProvider = ({ children }) => {
 
     localStorage.setItem("cartItems", JSON.stringify(updatedProductsInCart));
     setProductsInCart(updatedProductsInCart);
+    syncReservations(updatedProductsInCart);
   };
 
   const updateShippingAddress = (address, city, postalCode, country) => {
@@ -161,6 +182,20 @@ export const CartProvider = ({ children }) => {
   const taxPrice = Math.round(0.05 * totalItemsPrice);
   const totalPrice = totalItemsPrice + shippingPrice + taxPrice;
 
+  // Server nhận đơn bất đồng bộ (202): hỏi trạng thái vé cho tới khi worker tạo xong đơn.
+  // Trả về id đơn, hoặc null nếu không tạo được đơn (giỏ hàng được giữ nguyên)
+  const waitForOrder = async (statusUrl) => {
+    for (;;) {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      const { data } = await httpService.get(statusUrl);
+      if (data.status === "done") return data.order_id;
+      if (data.status === "failed") {
+        setError(data.error || "Đã xảy ra lỗi khi đặt hàng");
+        return null;
+      }
+    }
+  };
+
   const placeOrder = async () => {
     try {
       setError(""); // Reset lỗi trước khi gửi
@@ -174,7 +209,8 @@ export const CartProvider = ({ children }) => {
         size: item.size
       }));
 
-      const { data } = await httpService.post("/api/placeorder/", {
+      if (!checkoutKey.current) checkoutKey.current = newIdempotencyKey();
+      const { data, status } = await httpService.post("/api/placeorder/", {
         orderItems: orderItems,
         shippingAddress,
         paymentMethod,
@@ -183,15 +219,20 @@ export const CartProvider = ({ children }) => {
         shippingPrice,
         totalPrice,
         coupon_code: couponCode,
-      });
+      }, idempotencyHeaders(checkoutKey.current));
+      checkoutKey.current = null;
+      const orderId = status === 202 ? await waitForOrder(data.status_url) : data.id;
+      if (!orderId) return;
       setProductsInCart([]);
       localStorage.removeItem("cartItems");
       localStorage.removeItem("couponCode");
       setCouponCode("");
       setDiscountAmount(0);
       setCouponMessage("");
-      navigate(`/orders/${data.id}`);
+      navigate(`/orders/${orderId}`);
     } catch (ex) {
+      // Server đã trả lời (không phải lỗi mạng/5xx): lần đặt sau là một đơn mới
+      if (ex.response && ex.response.status < 500) checkoutKey.current = null;
       if (ex.response && ex.response.status === 403) {
         logout();
       } else {
@@ -1,5 +1,7 @@
 import React, { createContext, useState, useContext, useEffect } from "react";
 import httpService from "../services/httpService";
+import { fetchStatements as fetchStatementsPage, fetchTransactionsPage } from "../services/payboxService";
+import { idempotencyHeaders } from "../utils/idempotency";
 import UserContext from "./userContext";
 
 const PayboxContext = createContext();
@@ -7,6 +9,8 @@ const PayboxContext = createContext();
 export const PayboxProvider = ({ children }) => {
   const [wallet, setWallet] = useState(null);
   const [transactions, setTransactions] = useState([]);
+  const [nextTransactions, setNextTransactions] = useState(null);
+  const [statements, setStatements] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
   const { userInfo, authTokens, loading: userLoading } = useContext(UserContext);
@@ -59,9 +63,9 @@ export const PayboxProvider = ({ children }) => {
     try {
       setLoading(true);
       console.log("Fetching transactions for user:", userInfo.username);
-      const { data } = await httpService.get("/api/paybox/transactions/");
-      console.log("Transactions data received:", data.length, "transactions");
-      setTransactions(data);
+      const data = await fetchTransactionsPage();
+      setTransactions(data.results);
+      setNextTransactions(data.next);
       setError("");
     } catch (ex) {
       console.error("Error fetching transactions:", ex);
@@ -79,6 +83,27 @@ export const PayboxProvider = ({ children }) => {
     }
   };
 
+  // Tải thêm trang giao dịch cũ hơn
+  const loadMoreTransactions = async () => {
+    if (!nextTransactions) return;
+    try {
+      const data = await fetchTransactionsPage(nextTransactions);
+      setTransactions((current) => [...current, ...data.results]);
+      setNextTransactions(data.next);
+    } catch (ex) {
+      setError("Không thể tải lịch sử giao dịch");
+    }
+  };
+
+  // Sao kê theo tháng
+  const fetchStatements = async () => {
+    try {
+      setStatements(await fetchStatementsPage());
+    } catch (ex) {
+      console.error("Error fetching statements:", ex);
+    }
+  };
+
   // Tạo payment intent để nạp tiền
   const createDepositIntent = async (amount) => {
     try {
@@ -105,9 +130,16 @@ export const PayboxProvider = ({ children }) => {
   const confirmDeposit = async (paymentIntentId) => {
     try {
       setLoading(true);
-      const { data } = await httpService.post("/api/paybox/deposit/confirm/", {
-        payment_intent_id: paymentIntentId
-      });
+      // 202: Stripe chưa gửi webhook xác nhận, hỏi lại sau
+      let response;
+      for (let attempt = 0; attempt < 30; attempt++) {
+        response = await httpService.post("/api/paybox/deposit/confirm/", {
+          payment_intent_id: paymentIntentId
+        });
+        if (response.status !== 202) break;
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+      }
+      const { data } = response;
       
       // Cập nhật lại thông tin ví và giao dịch
       await fetchWallet();
@@ -130,7 +162,7 @@ export const PayboxProvider = ({ children }) => {
       setLoading(true);
       const { data } = await httpService.post("/api/paybox/payment/", {
         order_id: orderId
-      });
+      }, idempotencyHeaders(`paybox-${orderId}`));
       
       // Cập nhật lại thông tin ví và giao dịch
       await fetchWallet();
@@ -177,12 +209,18 @@ export const PayboxProvider = ({ children }) => {
       console.log("Conditions not met, clearing wallet and transactions");
       setWallet(null);
       setTransactions([]);
+      setNextTransactions(null);
+      setStatements([]);
     }
   }, [userInfo, authTokens, userLoading]);
 
   const contextData = {
     wallet,
     transactions,
+    hasMoreTransactions: Boolean(nextTransactions),
+    loadMoreTransactions,
+    statements,
+    fetchStatements,
     loading,
     error,
     fetchWallet,
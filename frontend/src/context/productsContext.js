@@ -1,5 +1,6 @@
 import { createContext, useState } from "react";
 import httpService from "../services/httpService";
+import { fetchAllProducts } from "../services/productService";
 
 const ProductsContext = createContext();
 
@@ -16,7 +17,7 @@ export const ProductsProvider = ({ children }) => {
     if (productsLoaded && !forced) return;
 
     try {
-      const { data } = await httpService.get("/api/products/");
+      const data = await fetchAllProducts();
       setProducts(data);
       const { data: brandsData } = await httpService.get("/api/brands/");
       setBrands(brandsData);
@@ -31,11 +32,7 @@ export const ProductsProvider = ({ children }) => {
   };
 
   const loadProduct = async (id) => {
-    if (productsLoaded) {
-      const product = products.find((p) => p.id == id);
-      return product;
-    }
-
+    // Danh sách chỉ chứa dòng tóm tắt, chi tiết sản phẩm luôn lấy từ API
     try {
       const { data } = await httpService.get(`/api/products/${id}/`);
       return data;
@@ -55,12 +52,24 @@ export const ProductsProvider = ({ children }) => {
     }
   };
 
+  const loadVariantMatrix = async (productId) => {
+    // Toàn bộ lưới màu × size trong một request, tra cứu biến thể ngay trên client
+    try {
+      const { data } = await httpService.get(`/api/products/${productId}/variant-matrix/`);
+      return data;
+    } catch (ex) {
+      setError(ex.message);
+      return null;
+    }
+  };
+
   const contextData = {
     products,
     error,
     loadProducts,
     loadProduct,
     getProductVariant,
+    loadVariantMatrix,
     // productsLoaded,
     brands,
     categories,
@@ -2,7 +2,10 @@ import React, { useState, useEffect } from 'react';
 import { Row, Col, Card } from 'react-bootstrap';
 import { Link } from 'react-router-dom';
 import AdminLayout from '../../components/admin/AdminLayout';
+import { fetchAllProducts } from '../../services/productService';
+import { fetchAllOrders } from '../../services/orderService';
 import httpService from '../../services/httpService';
+import { formatVND } from '../../utils/currency';
 import './AdminDashboard.css';
 
 const AdminDashboard = () => {
@@ -20,16 +23,18 @@ const AdminDashboard = () => {
   const fetchDashboardStats = async () => {
     try {
       // Fetch various stats from your APIs
-      const [ordersRes, productsRes] = await Promise.all([
-        httpService.get('/api/orders/'),
-        httpService.get('/api/products/')
+      const [ordersRes, productsRes, salesRes] = await Promise.all([
+        fetchAllOrders(),
+        fetchAllProducts({ fields: 'id' }),
+        // Doanh thu thuần 30 ngày gần nhất từ bảng tổng hợp doanh số
+        httpService.get('/api/admin/analytics/sales/', { params: { group: 'total' } })
       ]);
 
       setStats({
         totalUsers: 2500, // Mock data - you can implement user count API
-        totalOrders: ordersRes.data.length || 0,
-        totalProducts: productsRes.data.length || 0,
-        totalRevenue: 123.50 // Mock data - calculate from orders
+        totalOrders: ordersRes.length || 0,
+        totalProducts: productsRes.length || 0,
+        totalRevenue: salesRes.data.results.reduce((sum, row) => sum + Number(row.net_revenue), 0)
       });
     } catch (error) {
       console.error('Error fetching dashboard stats:', error);
@@ -97,7 +102,7 @@ const AdminDashboard = () => {
                     <i className="fas fa-dollar-sign"></i>
                   </div>
                   <div className="stat-info">
-                    <h3>${stats.totalRevenue}</h3>
+                    <h3>{formatVND(stats.totalRevenue)}</h3>
                     <p>Revenue</p>
                   </div>
                 </div>
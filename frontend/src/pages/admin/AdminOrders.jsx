@@ -1,7 +1,8 @@
 import React, { useState, useEffect } from 'react';
-import { Row, Col, Card, Table, Badge, Button, Modal } from 'react-bootstrap';
+import { Row, Col, Card, Table, Badge, Button, Modal, Form } from 'react-bootstrap';
 import AdminLayout from '../../components/admin/AdminLayout';
 import httpService from '../../services/httpService';
+import { fetchOrdersPage } from '../../services/orderService';
 import './AdminOrders.css';
 import { formatVND } from '../../utils/currency';
 
@@ -10,15 +11,22 @@ const AdminOrders = () => {
   const [loading, setLoading] = useState(true);
   const [selectedOrder, setSelectedOrder] = useState(null);
   const [showModal, setShowModal] = useState(false);
+  // Bộ lọc gửi lên server (paid/delivered/refunded: "true"/"false", created_from/created_to: YYYY-MM-DD)
+  const [filters, setFilters] = useState({});
+  const [nextPage, setNextPage] = useState(null);
 
   useEffect(() => {
     fetchOrders();
-  }, []);
+  }, [filters]);
+
+  const activeFilters = () =>
+    Object.fromEntries(Object.entries(filters).filter(([, value]) => value !== ''));
 
   const fetchOrders = async () => {
     try {
-      const response = await httpService.get('/api/orders/');
-      setOrders(response.data);
+      const data = await fetchOrdersPage(activeFilters());
+      setOrders(data.results);
+      setNextPage(data.next);
     } catch (error) {
       console.error('Error fetching orders:', error);
     } finally {
@@ -26,6 +34,19 @@ const AdminOrders = () => {
     }
   };
 
+  const loadMore = async () => {
+    try {
+      const data = await fetchOrdersPage({}, nextPage);
+      setOrders((current) => [...current, ...data.results]);
+      setNextPage(data.next);
+    } catch (error) {
+      console.error('Error fetching orders:', error);
+    }
+  };
+
+  const updateFilter = (name) => (event) =>
+    setFilters((current) => ({ ...current, [name]: event.target.value }));
+
   const handleShowOrderDetails = (order) => {
     setSelectedOrder(order);
     setShowModal(true);
@@ -89,6 +110,38 @@ const AdminOrders = () => {
                 <h5 className="mb-0">Orders Management</h5>
               </Card.Header>
               <Card.Body>
+                <Row className="mb-3 g-2">
+                  <Col md={2}>
+                    <Form.Select size="sm" value={filters.paid || ''} onChange={updateFilter('paid')}>
+                      <option value="">All payments</option>
+                      <option value="true">Paid</option>
+                      <option value="false">Unpaid</option>
+                    </Form.Select>
+                  </Col>
+                  <Col md={2}>
+                    <Form.Select size="sm" value={filters.delivered || ''} onChange={updateFilter('delivered')}>
+                      <option value="">All deliveries</option>
+                      <option value="true">Delivered</option>
+                      <option value="false">Not delivered</option>
+                    </Form.Select>
+                  </Col>
+                  <Col md={2}>
+                    <Form.Select size="sm" value={filters.refunded || ''} onChange={updateFilter('refunded')}>
+                      <option value="">All refunds</option>
+                      <option value="true">Refunded</option>
+                      <option value="false">Not refunded</option>
+                    </Form.Select>
+                  </Col>
+                  <Col md={2}>
+                    <Form.Control size="sm" type="date" value={filters.created_from || ''} onChange={updateFilter('created_from')} />
+                  </Col>
+                  <Col md={2}>
+                    <Form.Control size="sm" type="date" value={filters.created_to || ''} onChange={updateFilter('created_to')} />
+                  </Col>
+                  <Col md={2}>
+                    <Form.Control size="sm" type="number" placeholder="User ID" value={filters.user || ''} onChange={updateFilter('user')} />
+                  </Col>
+                </Row>
                 <Table responsive hover>
                   <thead>
                     <tr>
@@ -158,6 +211,13 @@ const AdminOrders = () => {
                     ))}
                   </tbody>
                 </Table>
+                {nextPage && (
+                  <div className="text-center">
+                    <Button variant="outline-secondary" size="sm" onClick={loadMore}>
+                      Load more
+                    </Button>
+                  </div>
+                )}
               </Card.Body>
             </Card>
           </Col>
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Row, Col, Card, Table, Button, Badge, Modal, Form } from 'react-bootstrap';
 import AdminLayout from '../../components/admin/AdminLayout';
 import httpService from '../../services/httpService';
+import { fetchAllProducts } from '../../services/productService';
 import './AdminProducts.css';
 import { formatVND } from '../../utils/currency';
 
@@ -36,14 +37,16 @@ const AdminProducts = () => {
   const fetchData = async () => {
     try {
       const [productsRes, categoriesRes, brandsRes, colorsRes, sizesRes] = await Promise.all([
-        httpService.get('/api/products/'),
+        fetchAllProducts({
+          fields: 'id,name,image,brand,category,description,rating,numReviews,price,countInStock,total_sold,has_variants,min_price,total_stock'
+        }),
         httpService.get('/api/category/'),
         httpService.get('/api/brands/'),
         httpService.get('/api/colors/'),
         httpService.get('/api/sizes/')
       ]);
 
-      setProducts(productsRes.data);
+      setProducts(productsRes);
       setCategories(categoriesRes.data);
       setBrands(brandsRes.data);
       setColors(colorsRes.data);
@@ -206,41 +209,35 @@ const AdminProducts = () => {
       if (formData.has_variants && variants.length > 0) {
         const productId = editingProduct ? editingProduct.id : productResponse.data.id;
 
-        // Xóa biến thể cũ nếu đang edit
+        // Tạo mới/cập nhật tất cả biến thể trong một request, giữ nguyên id của biến thể cũ
+        const rows = variants
+          .filter(variant => variant.color && variant.size && variant.price && variant.stock_quantity)
+          .map(variant => ({
+            product: productId,
+            color_id: parseInt(variant.color),
+            size_id: parseInt(variant.size),
+            price: parseFloat(variant.price),
+            stock_quantity: parseInt(variant.stock_quantity)
+          }));
+
+        try {
+          await httpService.post('/api/product-variants/', rows);
+        } catch (error) {
+          console.error('Error saving variants:', error.response?.data || error);
+        }
+
+        // Xóa các biến thể không còn trong form nếu đang edit
         if (editingProduct) {
           try {
+            const keep = new Set(rows.map(row => `${row.color_id}-${row.size_id}`));
             const existingVariants = await httpService.get(`/api/product-variants/?product=${productId}`);
             for (const variant of existingVariants.data) {
-              await httpService.delete(`/api/product-variants/${variant.id}/`);
+              if (!keep.has(`${variant.color.id}-${variant.size.id}`)) {
+                await httpService.delete(`/api/product-variants/${variant.id}/`);
+              }
             }
           } catch (error) {
-            console.error('Error deleting existing variants:', error);
-          }
-        }
-
-        // Thêm biến thể mới
-        for (const variant of variants) {
-          if (variant.color && variant.size && variant.price && variant.stock_quantity) {
-            try {
-              console.log('Creating variant:', {
-                product: productId,
-                color_id: parseInt(variant.color),
-                size_id: parseInt(variant.size),
-                price: parseFloat(variant.price),
-                stock_quantity: parseInt(variant.stock_quantity)
-              });
-
-              await httpService.post('/api/product-variants/', {
-                product: productId,
-                color_id: parseInt(variant.color),
-                size_id: parseInt(variant.size),
-                price: parseFloat(variant.price),
-                stock_quantity: parseInt(variant.stock_quantity)
-              });
-            } catch (error) {
-              console.error('Error creating variant:', error);
-              console.error('Variant data:', variant);
-            }
+            console.error('Error deleting removed variants:', error);
           }
         }
       }
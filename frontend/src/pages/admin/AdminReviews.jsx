@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Row, Col, Card, Table, Button, Modal, Form } from 'react-bootstrap';
 import AdminLayout from '../../components/admin/AdminLayout';
 import httpService from '../../services/httpService';
+import { fetchAllProducts } from '../../services/productService';
 import './AdminProducts.css'; // Reuse the same CSS
 
 const AdminReviews = () => {
@@ -23,12 +24,12 @@ const AdminReviews = () => {
     try {
       setLoading(true);
       // Lấy tất cả sản phẩm để có thông tin về reviews
-      const productsResponse = await httpService.get('/api/products/');
-      setProducts(productsResponse.data);
+      const productsData = await fetchAllProducts({ fields: 'id,name', expand: 'reviews' });
+      setProducts(productsData);
       
       // Tạo mảng reviews từ tất cả reviews của các sản phẩm
       let allReviews = [];
-      productsResponse.data.forEach(product => {
+      productsData.forEach(product => {
         if (product.reviews && product.reviews.length > 0) {
           // Thêm thông tin sản phẩm vào mỗi review
           const productReviews = product.reviews.map(review => ({
@@ -32,10 +32,17 @@ function ConfirmationPage(props) {
 
     const fetchPaymentStatus = async () => {
       try {
-        const { data } = await httpService.post(`/api/orders/${id}/pay/`, {
-          payment_intent,
-        });
-        if (data && data.detail) {
+        // 202: Stripe chưa gửi webhook xác nhận, hỏi lại sau
+        let response;
+        for (let attempt = 0; attempt < 30; attempt++) {
+          response = await httpService.post(`/api/orders/${id}/pay/`, { payment_intent });
+          if (response.status !== 202) break;
+          await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
+        const { data, status } = response;
+        if (status === 202) {
+          setMessage(data.detail);
+        } else if (data && data.detail) {
           setMessage(data.detail);
         } else {
           setError("Unexpected response format.");
@@ -13,6 +13,7 @@ import {
   Tab,
 } from "react-bootstrap";
 import Rating from "../components/rating";
+import ProductImage from "../components/productImage";
 import ProductsContext from "../context/productsContext";
 import Loader from "../components/loader";
 import Message from "../components/message";
@@ -26,7 +27,7 @@ import { toast } from "react-toastify";
 
 function ProductPage(props) {
   const { id } = useParams();
-  const { error, loadProduct, getProductVariant } = useContext(ProductsContext);
+  const { error, loadProduct, loadVariantMatrix } = useContext(ProductsContext);
   const { addItemToCart } = useContext(CartContext);
   const { isFavorite, addToFavorites, removeFromFavorites } =
     useContext(FavoriteContext);
@@ -38,6 +39,7 @@ function ProductPage(props) {
   const [selectedColor, setSelectedColor] = useState("");
   const [selectedSize, setSelectedSize] = useState("");
   const [selectedVariant, setSelectedVariant] = useState(null);
+  const [variantMatrix, setVariantMatrix] = useState(null);
   const [currentPrice, setCurrentPrice] = useState(0);
   const [currentStock, setCurrentStock] = useState(0);
   const navigate = useNavigate();
@@ -49,6 +51,7 @@ function ProductPage(props) {
 
       // Khởi tạo giá và tồn kho
       if (productData.has_variants) {
+        setVariantMatrix(await loadVariantMatrix(productData.id));
         setCurrentPrice(productData.min_price || productData.price);
         setCurrentStock(productData.total_stock || 0);
       } else {
@@ -60,7 +63,7 @@ function ProductPage(props) {
       window.scrollTo(0, 0);
     };
     fetchData();
-  }, [id, loadProduct]);
+  }, [id, loadProduct, loadVariantMatrix]);
 
   // Function để lấy sizes có sẵn cho màu đã chọn
   const getAvailableSizesForColor = () => {
@@ -132,31 +135,41 @@ function ProductPage(props) {
     }
   }, [selectedSize]);
 
+  // Tìm biến thể trong ma trận màu × size đã tải
+  const findVariant = (colorId, sizeId) => {
+    if (!variantMatrix) return null;
+    const colorIndex = variantMatrix.colors.findIndex(c => c.id === colorId);
+    const sizeIndex = variantMatrix.sizes.findIndex(s => s.id === sizeId);
+    if (colorIndex < 0 || sizeIndex < 0) return null;
+
+    const index = variantMatrix.grid[colorIndex * variantMatrix.sizes.length + sizeIndex];
+    if (index < 0) return null;
+
+    const [variantId, price, stock, sku] = variantMatrix.variants[index];
+    return { id: variantId, price, stock_quantity: stock, sku };
+  };
+
   // Effect để cập nhật biến thể khi chọn màu sắc và size
   useEffect(() => {
-    const updateVariant = async () => {
-      if (product.has_variants && selectedColor && selectedSize) {
-        const colorObj = product.available_colors?.find(c => c.name === selectedColor);
-        const sizeObj = product.available_sizes?.find(s => s.name === selectedSize);
-
-        if (colorObj && sizeObj) {
-          const variant = await getProductVariant(product.id, colorObj.id, sizeObj.id);
-          if (variant) {
-            setSelectedVariant(variant);
-            setCurrentPrice(variant.price);
-            setCurrentStock(variant.stock_quantity);
-          } else {
-            // Nếu không tìm thấy biến thể, reset thông tin
-            setSelectedVariant(null);
-            setCurrentPrice(product.min_price || product.price);
-            setCurrentStock(0);
-          }
+    if (product.has_variants && selectedColor && selectedSize) {
+      const colorObj = product.available_colors?.find(c => c.name === selectedColor);
+      const sizeObj = product.available_sizes?.find(s => s.name === selectedSize);
+
+      if (colorObj && sizeObj) {
+        const variant = findVariant(colorObj.id, sizeObj.id);
+        if (variant) {
+          setSelectedVariant(variant);
+          setCurrentPrice(variant.price);
+          setCurrentStock(variant.stock_quantity);
+        } else {
+          // Nếu không tìm thấy biến thể, reset thông tin
+          setSelectedVariant(null);
+          setCurrentPrice(product.min_price || product.price);
+          setCurrentStock(0);
         }
       }
-    };
-
-    updateVariant();
-  }, [selectedColor, selectedSize, product, getProductVariant]);
+    }
+  }, [selectedColor, selectedSize, product, variantMatrix]);
 
   const addToCartHandler = () => {
     const cartItem = {
@@ -256,11 +269,7 @@ function ProductPage(props) {
             <Col lg={5} md={6}>
               <div className="product-images">
                 <div className="main-image">
-                  <Image
-                    src={productImages[selectedImage] || product.image}
-                    alt={product.name}
-                    fluid
-                  />
+                  <ProductImage product={product} size="detail" as={Image} fluid />
                 </div>
                 {productImages.length > 1 && (
                   <div className="thumbnail-images">
@@ -272,8 +281,10 @@ function ProductPage(props) {
                         }`}
                         onClick={() => handleImageClick(index)}
                       >
-                        <Image
-                          src={img}
+                        <ProductImage
+                          product={product}
+                          size="thumbnail"
+                          as={Image}
                           alt={`${product.name} - ${index + 1}`}
                           fluid
                         />
@@ -698,7 +709,7 @@ function ProductPage(props) {
                     <Col key={idx} xs={6} md={3}>
                       <Card className="product-card">
                         <Link to={`/products/${product.id}`}>
-                          <Card.Img variant="top" src={product.image} />
+                          <ProductImage product={product} as={Card.Img} variant="top" />
                         </Link>
                         <Card.Body>
                           <Link
@@ -5,6 +5,8 @@ import ProductsContext from "../context/productsContext";
 import Loader from "../components/loader";
 import Message from "../components/message";
 import AdminRedirect from "../components/AdminRedirect";
+import ProductImage from "../components/productImage";
+import httpService from "../services/httpService";
 import "../styles/searchPage.css";
 
 function SearchPage() {
@@ -17,6 +19,7 @@ function SearchPage() {
   const [priceRange, setPriceRange] = useState(0); // 0 = all prices
   const [sortBy, setSortBy] = useState('');
   const [currentPage, setCurrentPage] = useState(1);
+  const [searchResults, setSearchResults] = useState(null);
   const productsPerPage = 12;
   
   const navigate = useNavigate();
@@ -52,6 +55,27 @@ function SearchPage() {
     fetchData();
   }, [loadProducts, brandParam, categoryParam, priceParam]);
 
+  // Tìm kiếm theo từ khóa trên server (không phân biệt dấu, xếp theo độ liên quan)
+  useEffect(() => {
+    if (!keyword.trim()) {
+      setSearchResults(null);
+      return;
+    }
+
+    const fetchSearchResults = async () => {
+      try {
+        const { data } = await httpService.get("/api/products/search/", {
+          params: { q: keyword, limit: 100 },
+        });
+        setSearchResults(data.results);
+      } catch (error) {
+        setErrorFilters(error.message);
+      }
+    };
+
+    fetchSearchResults();
+  }, [keyword]);
+
   // Hàm sắp xếp
   const sortProducts = (products, sortBy) => {
     const sortedProducts = [...products];
@@ -90,9 +114,7 @@ function SearchPage() {
     }
   };
 
-  let filteredProducts = products.filter((product) =>
-    product.name.toLowerCase().includes(keyword.toLowerCase())
-  );
+  let filteredProducts = keyword.trim() ? searchResults || [] : products;
 
   if (selectedBrand !== 0) {
     filteredProducts = filteredProducts.filter(
@@ -348,7 +370,7 @@ function SearchPage() {
                     <Col key={product.id} sm={6} md={6} lg={4} className="mb-4">
                       <div className="product-card">
                         <Link to={`/products/${product.id}`} className="product-image">
-                          <img src={product.image} alt={product.name} />
+                          <ProductImage product={product} />
                           {product.total_sold > 10 && (
                             <span className="product-badge bestseller">
                               <i className="fas fa-fire-alt mr-1"></i> Bán chạy
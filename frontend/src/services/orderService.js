@@ -0,0 +1,21 @@
+import httpService from './httpService';
+
+// Một trang (cursor) của /api/orders/; url là link "next" của trang trước (đã chứa tham số lọc)
+export const fetchOrdersPage = async (params = {}, url = null) => {
+  const { data } = url
+    ? await httpService.get(url)
+    : await httpService.get('/api/orders/', { params: { page_size: 50, ...params } });
+  return data;
+};
+
+// Duyệt lần lượt các trang của /api/orders/ và gộp kết quả
+export const fetchAllOrders = async (params = {}) => {
+  let orders = [];
+  let next = null;
+  do {
+    const data = await fetchOrdersPage({ page_size: 100, ...params }, next);
+    orders = [...orders, ...data.results];
+    next = data.next;
+  } while (next);
+  return orders;
+};
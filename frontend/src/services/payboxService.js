@@ -0,0 +1,15 @@
+import httpService from './httpService';
+
+// Một trang (cursor) của sao kê ví; url là link "next" của trang trước
+export const fetchTransactionsPage = async (url = null) => {
+  const { data } = url
+    ? await httpService.get(url)
+    : await httpService.get('/api/paybox/transactions/', { params: { page_size: 20 } });
+  return data;
+};
+
+// Sao kê theo tháng (số dư đầu/cuối tháng, tổng theo loại giao dịch)
+export const fetchStatements = async (months = 12) => {
+  const { data } = await httpService.get('/api/paybox/statements/', { params: { months } });
+  return data.results;
+};
@@ -0,0 +1,17 @@
+import httpService from './httpService';
+
+// Duyệt lần lượt các trang (cursor) của /api/products/ và gộp kết quả
+export const fetchAllProducts = async (params = {}) => {
+  let products = [];
+  let url = '/api/products/';
+  let config = { params: { page_size: 100, ...params } };
+
+  while (url) {
+    const { data } = await httpService.get(url, config);
+    products = [...products, ...data.results];
+    url = data.next;
+    config = undefined; // link "next" đã chứa sẵn các tham số truy vấn
+  }
+
+  return products;
+};
@@ -0,0 +1,7 @@
+// Idempotency-Key: request gửi lại (timeout, bấm hai lần) với cùng khóa chỉ được server xử lý một lần
+export const newIdempotencyKey = () =>
+  window.crypto?.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+export const idempotencyHeaders = (key) => ({ headers: { "Idempotency-Key": key } });